@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+local stand-in for the bedrock-runtime client, used by the offline benchmarks
+
+responses are replayed from fixtures/bedrock_responses.json: the first rule whose operation matches and
+whose `contains` text is part of the request (converse) or whose `model_prefix` matches the model id
+(invoke_model) is served. "__PNG__" in an invoke_model body is replaced by a generated PNG of the
+requested size, repeated `numberOfImages` times.
+
+latency (per call, and per chunk for converse_stream) and throttling are injected.
+"""
+
+import base64
+import io
+import json
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from PIL import Image
+
+from utils.payload_estimator import estimate_tokens
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "bedrock_responses.json")
+
+
+def _request_text(request):
+    parts = [block.get("text", "") for block in request.get("system", [])]
+    for message in request.get("messages", []):
+        parts.extend(block.get("text", "") for block in message.get("content", []))
+    return "\n".join(parts)
+
+
+class StubBedrockRuntime:
+    """
+    duck-typed bedrock-runtime client: converse, converse_stream and invoke_model
+    """
+
+    def __init__(self, fixtures_path=FIXTURES_PATH, latency_ms=300, jitter_ms=100, chunk_latency_ms=20,
+                 stream_chunks=8, throttle_rate=0.0, seed=0):
+        """
+        :param fixtures_path: JSON list of response rules
+        :param latency_ms: mean latency of a call (time to first token for converse_stream)
+        :param jitter_ms: uniform jitter added to / removed from latency_ms
+        :param chunk_latency_ms: delay between two converse_stream chunks
+        :param stream_chunks: number of text chunks of a converse_stream response
+        :param throttle_rate: share of calls rejected with ThrottlingException
+        :param seed: random seed of latency jitter and throttling
+        """
+        with open(fixtures_path, encoding="utf-8") as f:
+            self.rules = json.load(f)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.chunk_latency_ms = chunk_latency_ms
+        self.stream_chunks = stream_chunks
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"converse": 0, "converse_stream": 0, "invoke_model": 0, "throttled": 0}
+
+    def _latency(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def _start(self, operation):
+        with self._lock:
+            self.stats[operation] += 1
+            throttled = self._random.random() < self.throttle_rate
+            if throttled:
+                self.stats["throttled"] += 1
+        if throttled:
+            time.sleep(self._latency() / 10)
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests (stub)"}}, operation)
+
+    def _rule(self, operation, model_id, text=""):
+        for rule in self.rules:
+            if rule["operation"] != operation:
+                continue
+            if operation == "invoke_model" and model_id.startswith(rule["model_prefix"]):
+                return rule
+            if operation == "converse" and rule["contains"] in text:
+                return rule
+        raise ValueError(f"no stub response for {operation} {model_id}")
+
+    def _converse_text(self, request):
+        text = _request_text(request)
+        return text, self._rule("converse", request["modelId"], text)["text"]
+
+    def converse(self, **request):
+        self._start("converse")
+        latency = self._latency()
+        time.sleep(latency)
+        prompt, text = self._converse_text(request)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "stopReason": "end_turn",
+            "usage": {"inputTokens": estimate_tokens(prompt), "outputTokens": estimate_tokens(text)},
+            "metrics": {"latencyMs": int(latency * 1000)},
+        }
+
+    def converse_stream(self, **request):
+        self._start("converse_stream")
+        prompt, text = self._converse_text(request)
+        return {"stream": self._stream(prompt, text)}
+
+    def _stream(self, prompt, text):
+        start = time.perf_counter()
+        time.sleep(self._latency())
+        yield {"messageStart": {"role": "assistant"}}
+        size = max(1, -(-len(text) // self.stream_chunks))
+        for i in range(0, len(text), size):
+            yield {"contentBlockDelta": {"delta": {"text": text[i:i + size]}, "contentBlockIndex": 0}}
+            time.sleep(self.chunk_latency_ms / 1000)
+        yield {"messageStop": {"stopReason": "end_turn"}}
+        yield {"metadata": {
+            "usage": {"inputTokens": estimate_tokens(prompt), "outputTokens": estimate_tokens(text)},
+            "metrics": {"latencyMs": int((time.perf_counter() - start) * 1000)},
+        }}
+
+    def invoke_model(self, **request):
+        self._start("invoke_model")
+        latency = self._latency()
+        time.sleep(latency)
+        body = json.loads(json.dumps(self._rule("invoke_model", request["modelId"])["body"]))
+        if "images" in body:
+            config = json.loads(request["body"]).get("imageGenerationConfig", {})
+            png = _png(config.get("width", 512), config.get("height", 512))
+            body["images"] = [png if image == "__PNG__" else image for image in body["images"]]
+            body["images"] *= config.get("numberOfImages", 1)
+        if "content" in body:
+            body["usage"] = {"input_tokens": estimate_tokens(request["body"]),
+                             "output_tokens": estimate_tokens(body["content"][0]["text"])}
+        return {
+            "body": io.BytesIO(json.dumps(body).encode("utf-8")),
+            "contentType": "application/json",
+            "ResponseMetadata": {"HTTPHeaders": {"x-amzn-bedrock-invocation-latency": str(int(latency * 1000))}},
+        }
+
+
+def _png(width, height):
+    buffer = io.BytesIO()
+    Image.linear_gradient("L").resize((width, height)).convert("RGB").save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmark utils.image_preprocess against the resize routines it replaced
+
+the legacy routine (read -> decode at full size -> LANCZOS resize -> re-encode in the source format) is kept
+below as the baseline. inputs are the bundled images plus a synthetic large camera-style JPEG.
+
+usage:
+    python -m benchmarks.image_preprocess_benchmark --repeat 5
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from utils import image_preprocess
+
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), "..", "images")
+
+
+def legacy_image_encoder(image_path, max_size=1568):
+    """
+    the former image_base64_encoder of content_moderation / listing_voc_prompt / prompt_template
+    """
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+
+    img = Image.open(io.BytesIO(image_bytes))
+    width, height = img.size
+    img_format = img.format.lower()
+
+    if width > max_size or height > max_size:
+        if width > height:
+            new_width = max_size
+            new_height = int(height * (max_size / width))
+        else:
+            new_height = max_size
+            new_width = int(width * (max_size / height))
+
+        img = img.resize((new_width, new_height), resample=Image.Resampling.LANCZOS)
+
+    resized_bytes = io.BytesIO()
+    img.save(resized_bytes, format=img_format)
+    return resized_bytes.getvalue(), img_format
+
+
+def _synthetic_photo(directory):
+    path = os.path.join(directory, "photo_4032x3024.jpg")
+    img = Image.radial_gradient("L").resize((4032, 3024)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for i in range(0, 4032, 96):
+        draw.line([(i, 0), (4032 - i, 3024)], fill=(i % 255, 80, 160), width=7)
+    img.save(path, quality=92)
+    return path
+
+
+def _best(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run(repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        files = sorted(glob.glob(os.path.join(IMAGES_DIR, "*.png")))[:4] + [_synthetic_photo(tmp)]
+        rows = []
+        for path in files:
+            legacy_s, (legacy_bytes, _) = _best(lambda: legacy_image_encoder(path), repeat)
+
+            def uncached():
+                image_preprocess.clear_cache()
+                return image_preprocess.prepare_image(path, 1568, "claude")
+
+            new_s, (new_bytes, new_format) = _best(uncached, repeat)
+            cached_s, _ = _best(lambda: image_preprocess.prepare_image(path, 1568, "claude"), repeat)
+            rows.append({
+                "file": os.path.basename(path),
+                "legacy_ms": round(legacy_s * 1000, 1),
+                "new_ms": round(new_s * 1000, 1),
+                "memoized_ms": round(cached_s * 1000, 2),
+                "speedup": round(legacy_s / new_s, 2),
+                "legacy_bytes": len(legacy_bytes),
+                "new_bytes": len(new_bytes),
+                "new_format": new_format,
+            })
+    return {"repeat": repeat, "max_size": 1568, "target": "claude", "images": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per image, the best one is kept")
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
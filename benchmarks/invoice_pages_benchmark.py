@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmark page level parallelism of invoice pre processing (OSD / OCR / resize / webp encoding)
+
+the bundled data/invoice samples are repeated to build a long multi page invoice, which is then
+pre processed with 1 worker and with N workers.
+
+usage:
+    python -m benchmarks.invoice_pages_benchmark --pages 10 --workers 1 2 4
+
+requires tesseract (with chi_sim), see README.
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import time
+
+import pypdfium2 as pdfium
+from PIL import Image
+
+from utils.invoice_extract import SCANNED_PDF_DPI, _ImageInvoiceExtractor, render_pdf_pages
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "invoice")
+
+
+def _page_count(path: str) -> int:
+    pdf = pdfium.PdfDocument(path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def load_sample_pages() -> list[Image]:
+    pages: list[Image] = []
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "invoice_sample_*"))):
+        if path.endswith(".pdf"):
+            pages.extend(render_pdf_pages(path, itertools.repeat(SCANNED_PDF_DPI, _page_count(path))))
+        else:
+            with Image.open(path) as image:
+                pages.append(image.convert("RGB"))
+    return pages
+
+
+def run(pages: int, workers: list[int], repeat: int) -> dict:
+    samples = load_sample_pages()
+    images = [samples[i % len(samples)] for i in range(pages)]
+
+    results = {"pages": pages, "repeat": repeat, "runs": []}
+    for n in workers:
+        extractor = _ImageInvoiceExtractor("benchmark", page_workers=n)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            extractor._pre_process_images(['' for _ in images], images)
+            timings.append(time.perf_counter() - start)
+        results["runs"].append({"workers": n, "best_s": round(min(timings), 3)})
+
+    baseline = results["runs"][0]["best_s"]
+    for run_ in results["runs"]:
+        run_["speedup"] = round(baseline / run_["best_s"], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=10, help="number of pages of the synthetic invoice")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="worker counts, first one is the baseline")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per worker count, the best one is kept")
+    args = parser.parse_args()
+    print(json.dumps(run(args.pages, args.workers, args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+offline end-to-end benchmark of every pipeline against a local bedrock-runtime stub (see bedrock_stub.py)
+
+each pipeline operation runs the same utils code as the pages, on the bundled data/ fixtures:
+    listing       gen_listing_prompt + streamed generation
+    voc           review condensing + summary stream + the six aspect calls in parallel
+    moderation    text moderation + image moderation
+    image_factory prompt from image + Titan text-to-image + background removal
+    invoice       extraction of the bundled invoices (PNG samples only if tesseract is installed)
+
+response / dedup caches are disabled unless --cache is given, so every operation reaches the stub.
+
+usage:
+    python -m benchmarks.pipelines_benchmark --iterations 20 --concurrency 4 --latency-ms 300 \
+        --throttle-rate 0.05 -o bench.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PIPELINES = ("listing", "voc", "moderation", "image_factory", "invoice")
+
+LISTING_MODEL_ID = "meta.llama3-1-70b-instruct-v1:0"
+VOC_MODEL_ID = "anthropic.claude-3-sonnet-20240229-v1:0"
+TITAN_IMAGE_MODEL_ID = "amazon.titan-image-generator-v2:0"
+
+
+def _configure(args, workdir):
+    """
+    settings read at import time by the utils modules, must run before they are imported
+    """
+    os.environ["data_folder"] = os.path.join(ROOT, "data")
+    os.environ["save_folder"] = os.path.join(workdir, "generated_images")
+    os.environ["response_cache_backend"] = "memory" if args.cache else "none"
+    os.environ["dedup_store_path"] = os.path.join(workdir, "dedup_store.sqlite3")
+    os.environ["rate_limit_initial_rps"] = str(args.rps)
+    os.environ["rate_limit_base_delay"] = str(args.retry_base_delay)
+
+
+def _pipelines(args):
+    from utils.catalog import get_catalog
+    from utils.content_moderation import _content_moderation_image, content_moderation_image, content_moderation_text
+    from utils.image_generation import generate_or_vary_image
+    from utils.invoice_extract import InvoiceExtractor
+    from utils.listing_voc_prompt import bedrock_converse_stream_api, gen_listing_prompt, gen_voc_prompt
+    from utils.prompt_template import generate_prompt_from_image
+    from utils.review_condenser import condense_reviews
+    from utils.voc_engine import SUMMARY_REPORT, gen_aspect_prompts, run_voc_analysis
+
+    catalog = get_catalog()
+    listing_asins = catalog.asins("com")
+    voc_asins = catalog.asins("com", with_reviews=True)
+    image = os.path.join(ROOT, "images", "image.png")
+    invoices = [os.path.join(ROOT, "data", "invoice", "invoice_sample_1.pdf")]
+    if shutil.which("tesseract"):
+        invoices += [os.path.join(ROOT, "data", "invoice", f"invoice_sample_{i}.png") for i in (2, 3, 4)]
+
+    def listing(i):
+        prompt = gen_listing_prompt(listing_asins[i % len(listing_asins)], "com", "Apple", "renewed, unlocked", "English")
+        output = "".join(bedrock_converse_stream_api(LISTING_MODEL_ID, prompt, use_cache=args.cache, call_site="listing"))
+        assert "<title>" in output, output
+
+    def voc(i):
+        asin = voc_asins[i % len(voc_asins)]
+        review_set = catalog.get_reviews(asin, "com")
+        condensed = condense_reviews(review_set.reviews, source_tokens=review_set.source_tokens)
+        prompts = {SUMMARY_REPORT: gen_voc_prompt(asin, "com", "Chinese", condensed), **gen_aspect_prompts(condensed.text)}
+        results = dict(run_voc_analysis(VOC_MODEL_ID, prompts, use_cache=args.cache))
+        assert all(results.values()), [name for name, result in results.items() if not result]
+
+    def moderation(i):
+        assert content_moderation_text("I hate everyone.")
+        assert (content_moderation_image if args.cache else _content_moderation_image)(image)
+
+    def image_factory(i):
+        prompt = generate_prompt_from_image(image, "a product photo")
+        status, result = generate_or_vary_image(TITAN_IMAGE_MODEL_ID, prompt, task_type="image generation",
+                                                width=512, height=512, seed=i)
+        assert status == 0, result
+        status, result = generate_or_vary_image(TITAN_IMAGE_MODEL_ID, source_image=image, task_type="background removal")
+        assert status == 0, result
+
+    def invoice(i):
+        extractor = InvoiceExtractor(invoices[i % len(invoices)], page_workers=1)
+        output = extractor.extract() if args.cache else extractor._extractor().extract()
+        assert json.loads(output), output
+
+    return {"listing": listing, "voc": voc, "moderation": moderation, "image_factory": image_factory, "invoice": invoice}
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    p50, p95 = np.percentile(values, [50, 95])
+    return {"p50": int(p50), "p95": int(p95), "max": int(max(values)), "mean": int(np.mean(values))}
+
+
+def run_pipeline(fn, iterations, concurrency):
+    from utils.instrumentation import get_call_records, summarize_calls
+
+    first_record = len(get_call_records())
+    latencies, errors = [], {}
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(iterations)))
+    wall = time.perf_counter() - start
+    return {
+        "ops": iterations,
+        "ok": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_ops_s": round(len(latencies) / wall, 3),
+        "latency_ms": _percentiles(latencies),
+        "model_calls": summarize_calls(get_call_records()[first_record:]),
+    }
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure(args, workdir)
+        sys.path.insert(0, ROOT)
+        from benchmarks.bedrock_stub import StubBedrockRuntime
+        from utils.bedrock_client import set_bedrock_client
+
+        stub = StubBedrockRuntime(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                  throttle_rate=args.throttle_rate, seed=args.seed)
+        for region in ("us-west-2", "us-east-1"):
+            set_bedrock_client(stub, region)
+
+        pipelines = _pipelines(args)
+        results = {name: run_pipeline(pipelines[name], args.iterations, args.concurrency) for name in args.pipelines}
+
+        from utils.rate_limiter import get_rate_limiter
+        return {
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "pipelines": results,
+            "stub": stub.stats,
+            "rate_limiter": get_rate_limiter().metrics(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--iterations", type=int, default=10, help="operations per pipeline")
+    parser.add_argument("--concurrency", type=int, default=4, help="operations in flight")
+    parser.add_argument("--latency-ms", type=float, default=300, help="mean stub latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="uniform stub latency jitter")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of stub calls throttled")
+    parser.add_argument("--rps", type=float, default=50, help="initial rate limit per model, requests per second")
+    parser.add_argument("--retry-base-delay", type=float, default=0.1, help="base delay of throttle retries, seconds")
+    parser.add_argument("--cache", action="store_true", help="keep the response and dedup caches enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="JSON output file, defaults to stdout")
+    args = parser.parse_args()
+
+    # the pipelines print progress, keep stdout for the JSON results
+    with contextlib.redirect_stdout(sys.stderr):
+        results = json.dumps(run(args), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(results)
+    else:
+        print(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ import json
 from dotenv import load_dotenv
 from utils.content_moderation import content_moderation_image
 from utils.content_moderation import content_moderation_text
+from utils.dedup_store import get_dedup_store
 from PIL import Image
 
 import logging
@@ -59,6 +60,7 @@ def main():
                     st.write('【说明】', data['reason'])
                     st.write(' 结构化输出')
                     st.write(data)
+                    st.caption(get_dedup_store().summary())
 
             else:
                 st.write('请选择要审核的图片')
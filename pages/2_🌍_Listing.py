@@ -3,9 +3,9 @@ import string
 import streamlit as st
 from pathlib import Path
 import os
-import json
 from dotenv import load_dotenv
-from utils.listing_voc_prompt import gen_listing_prompt, bedrock_converse_api, bedrock_converse_api_with_image
+from utils.catalog import get_catalog
+from utils.listing_voc_prompt import gen_listing_prompt, bedrock_converse_api_with_image, bedrock_converse_stream_api, format_stream_stats
 
 from PIL import Image
 
@@ -44,19 +44,16 @@ def main():
         st.divider()
 
         # 选择参考热卖商品
-        asin_label = ['B0BZYCJK89', 'B0BGYWPWNC', 'B0CX23V2ZK']
+        catalog = get_catalog()
+        asin_label = catalog.asins('com')
         asin = st.selectbox('请选择参考的热卖商品', asin_label)
 
         # 展示热卖商品参考信息
-        filename = './data/' + 'asin_' + asin + '_product.json'
-        with open(filename, 'r', encoding='utf-8') as file:
-            product_data = file.read()
-            
-        product_results = json.loads(product_data)
-        
-        as_title = product_results['results'][0]['content']['title']
-        as_bullet = product_results['results'][0]['content']['bullet_points']
-        as_des = product_results['results'][0]['content']['description']
+        product = catalog.get_product(asin, 'com')
+
+        as_title = product.title
+        as_bullet = product.bullet_points
+        as_des = product.description
 
         expander = st.expander('详细信息')
         expander.write('Title:')
@@ -89,7 +86,7 @@ def main():
                         print('user_prompt:' + user_prompt)
                         
                         if use_multi_modal:
-                            llm_output = bedrock_converse_api_with_image(model_Id_multi_modal, file_name, user_prompt)
+                            llm_output = bedrock_converse_api_with_image(model_Id_multi_modal, file_name, user_prompt, use_cache=True, call_site="listing.image")
 
                             # 2. 显示图片功能
                             st.subheader("商品图片")
@@ -103,22 +100,26 @@ def main():
                             else:
                                 st.image(File, caption='Uploaded Image', use_column_width=True)
                         else:
-                            llm_output = bedrock_converse_api(model_Id, user_prompt)
+                            llm_output = stream_listing_output(user_prompt)
                             print(llm_output)
 
                     
-                        title, bullets, description = parse_listing_xml_response(llm_output)
+                        listing = parse_listing_xml_response(llm_output) if llm_output else None
+                        if listing is None:
+                            show_listing_error(llm_output)
+                        else:
+                            title, bullets, description = listing
 
-                        st.subheader("商品Listing")
+                            st.subheader("商品Listing")
 
-                        st.write("Title:\n")
-                        st.write(title)
+                            st.write("Title:\n")
+                            st.write(title)
 
-                        st.write("Bullet Point:\n")
-                        st.write(bullets)
+                            st.write("Bullet Point:\n")
+                            st.write(bullets)
 
-                        st.write("Product Description:\n")
-                        st.write(description)
+                            st.write("Product Description:\n")
+                            st.write(description)
         
                         # removing the image file that was temporarily saved to perform the question and answer task
                         os.remove(save_path)
@@ -127,10 +128,15 @@ def main():
                         user_prompt = gen_listing_prompt(asin, 'com', brand, features, language_lable)
                         print('user_prompt:' + user_prompt)
                             
-                        llm_output = bedrock_converse_api(model_Id, user_prompt)
+                        llm_output = stream_listing_output(user_prompt)
                         print(llm_output)
 
-                        title, bullets, description = parse_listing_xml_response(llm_output)
+                        listing = parse_listing_xml_response(llm_output) if llm_output else None
+                        if listing is None:
+                            show_listing_error(llm_output)
+                            return
+
+                        title, bullets, description = listing
 
                         st.write("Title:\n")
                         st.write(title)
@@ -140,7 +146,34 @@ def main():
 
                         st.write("Description:\n")
                         st.write(description)
-    
+
+def stream_listing_output(user_prompt):
+    """
+    流式显示模型输出，生成完成后清除并返回完整文本
+    """
+    stream_stats = {}
+    placeholder = st.empty()
+    llm_output = placeholder.write_stream(
+        bedrock_converse_stream_api(model_Id, user_prompt, use_cache=True, on_metadata=stream_stats.update, call_site="listing"))
+    placeholder.empty()
+    if stream_stats.get("error"):
+        logger.error(f"Listing generation failed: {stream_stats['error']}")
+        return ""
+    st.caption(format_stream_stats(stream_stats))
+    return llm_output if isinstance(llm_output, str) else "".join(llm_output)
+
+
+def show_listing_error(llm_output):
+    """
+    模型调用失败（例如被限流）或输出无法解析时提示用户，而不是让页面崩溃
+    """
+    if not llm_output:
+        st.error("Listing生成失败：模型调用失败或请求过多被限流，请稍后重试")
+    else:
+        st.error("Listing生成失败：模型输出格式无法解析，原始输出如下")
+        st.text(llm_output)
+
+
 def parse_listing_xml_response(xml_string):
     try:
         # 将XML字符串包装在根元素中
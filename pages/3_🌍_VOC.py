@@ -3,10 +3,13 @@ import string
 import streamlit as st
 from pathlib import Path
 import os
-import json
+from dataclasses import asdict
 from dotenv import load_dotenv
-from utils.listing_voc_prompt import gen_listing_prompt, gen_voc_prompt, bedrock_converse_api
-from utils.listing_voc_prompt import gen_purchase_motivation_prompt, gen_user_suggestions_prompt, gen_negative_opinions_prompt,gen_product_experience_prompt,gen_star_rating_distribution_prompt,gen_user_expectations_prompt
+from utils.catalog import get_catalog
+from utils.listing_voc_prompt import gen_listing_prompt, gen_voc_prompt, bedrock_converse_stream_api, format_stream_stats
+from utils.review_condenser import condense_reviews
+from utils.voc_mapreduce import VocMapError, gen_voc_mapreduce_prompt
+from utils.voc_engine import VOC_ASPECTS, gen_aspect_prompts, submit_voc_analysis, collect_voc_results
 
 from PIL import Image
 
@@ -17,18 +20,12 @@ model_Id = 'meta.llama3-1-70b-instruct-v1:0'
 
 st.set_page_config(page_title="VoC客户之声", page_icon="🎨", layout="wide")
 
-@st.cache_data
 def load_reviews(asin):
-    filename = f'./data/asin_{asin}_reviews.json'
     try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            return json.load(file)
-    except FileNotFoundError:
+        return get_catalog().get_reviews(asin, 'com')
+    except KeyError:
         st.error(f"Review file for ASIN {asin} not found.")
         return None
-    except json.JSONDecodeError:
-        st.error(f"Invalid JSON in review file for ASIN {asin}.")
-        return None
 
 def main():
     language_options = ['English', 'Chinese']
@@ -36,44 +33,70 @@ def main():
 
     st.title('VOC 客户之声')
 
-    asin_label = ['B0BZYCJK89', 'B0BGYWPWNC', 'B0CX23V2ZK']
+    asin_label = get_catalog().asins('com', with_reviews=True)
     asin = st.selectbox('请选择 Amazon ASIN', asin_label)
 
     reviews = load_reviews(asin)
     if reviews:
         with st.expander("用户评论信息"):
-            st.json(reviews['results'][0]['content'])
+            st.json([asdict(review) for review in reviews.reviews])
 
     if st.button("点击生成报告"):
         with st.spinner('正在生成报告...'):
             domain = "com"
-            user_prompt = gen_voc_prompt(asin, domain, language_label)
-            
+            # 精简评论以控制prompt长度
+            condensed = condense_reviews(reviews.reviews, source_tokens=reviews.source_tokens)
+            st.caption(condensed.summary())
+
+            # 六个分类指标在后台并发执行，与分批汇总同时进行
+            aspect_futures = submit_voc_analysis(model_Id, gen_aspect_prompts(condensed.text), use_cache=True)
+
+            map_error = None
+            if condensed.truncated:
+                # 评论超出单次调用的预算时，先分批汇总(map)，再合并为总结报告(reduce)
+                progress = st.progress(0.0, text='正在分批汇总评论...')
+                try:
+                    user_prompt = gen_voc_mapreduce_prompt(
+                        model_Id, reviews.reviews, language_label,
+                        on_progress=lambda done, total: progress.progress(done / total, text=f'正在分批汇总评论 {done}/{total}'))
+                except VocMapError as e:
+                    map_error = e
+                progress.empty()
+            else:
+                user_prompt = gen_voc_prompt(asin, domain, language_label, condensed)
+
             # 创建两列布局
             col1, col2 = st.columns(2)
-            
-            with col1:
-                st.subheader("总结报告")
-                output = bedrock_converse_api(model_Id, user_prompt)
-                st.write(output)
-            
+
+            # 先创建分类指标的输出占位，结果返回后立即填充
+            placeholders = {}
             with col2:
                 st.subheader("分类指标")
-                analysis_aspect = ["购买动机", "用户建议", "负面观点", "产品体验", "星级分布", "用户期望"]
-                prompt_generators = {
-                    "购买动机": gen_purchase_motivation_prompt,
-                    "用户建议": gen_user_suggestions_prompt,
-                    "负面观点": gen_negative_opinions_prompt,
-                    "产品体验": gen_product_experience_prompt,
-                    "星级分布": gen_star_rating_distribution_prompt,
-                    "用户期望": gen_user_expectations_prompt
-                }
-
-                for aspect in analysis_aspect:
+                for aspect in VOC_ASPECTS:
                     with st.expander(aspect):
-                        prompt = prompt_generators[aspect](reviews['results'])
-                        voc_metrics = bedrock_converse_api(model_Id, prompt)
-                        st.write(voc_metrics)
+                        placeholders[aspect] = st.empty()
+
+            def render_aspects(wait=False):
+                for aspect, voc_metrics in collect_voc_results(aspect_futures, wait):
+                    placeholders[aspect].write(voc_metrics)
+
+            # 总结报告流式输出，期间渲染已完成的分类指标
+            def summary_stream():
+                for delta in bedrock_converse_stream_api(model_Id, user_prompt, use_cache=True, on_metadata=stream_stats.update,
+                                                         call_site="voc.summary"):
+                    render_aspects()
+                    yield delta
+
+            stream_stats = {}
+            with col1:
+                st.subheader("总结报告")
+                if map_error:
+                    st.error(f"评论分批汇总全部失败，无法生成总结报告: {map_error}")
+                else:
+                    st.write_stream(summary_stream())
+                    st.caption(format_stream_stats(stream_stats))
+
+            render_aspects(wait=True)
 
 if __name__ == '__main__':
     main()
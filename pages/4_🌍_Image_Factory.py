@@ -3,8 +3,9 @@ from pathlib import Path
 import os
 from dotenv import load_dotenv
 from utils.prompt_template import generate_prompt_from_image, generate_prompt_from_text
-from utils.image_generation import generate_or_vary_image
-from PIL import Image
+from utils.image_generation import IMAGE_MODEL_PROFILES, get_image_router
+from utils.image_jobs import get_image_job_queue
+from utils.image_store import get_display_image, get_image_store
 
 import logging
 logger = logging.getLogger(__name__)
@@ -39,33 +40,43 @@ def main():
     
         # 模型选择
         model_options = ["stability.stable-image-ultra-v1:0", "stability.stable-image-core-v1:0", "stability.sd3-large-v1:0"]
-        selected_model = st.selectbox("选择模型", model_options)
+        selected_model = st.selectbox("选择模型", [AUTO_MODEL] + model_options)
+        batch_model_options = model_options + ["amazon.titan-image-generator-v2:0"]
+        if selected_model == AUTO_MODEL:
+            policy = st.radio("路由策略", list(ROUTING_POLICIES), horizontal=True, key="routing_policy")
+            st.dataframe(
+                [{"model_id": model_id, **get_image_router().stats(model_id)} for model_id in IMAGE_MODEL_PROFILES],
+                use_container_width=True,
+            )
     
         # 生成按钮
         result = st.button("生成图片", key="text_submit")
     
         st.info("👆 在上方输入描述，可以点击'优化提示词'来改进描述，选择模型后点击'生成图片'按钮")
     
-        # 处理图片生成
+        # 处理图片生成：提交到后台任务队列，不阻塞页面
         if result:
             if text:
-                with st.spinner('正在生成图片...'):
-                    status, image_result = generate_or_vary_image(model_id=selected_model, positive_prompt=text, task_type='image generation')
-                    if status == 0:
-                        st.success("图片生成成功!")
-                        display_and_resize_image(image_result, target_size=768)
-                        
-                        # 下载按钮
-                        st.download_button(
-                            label="下载图片",
-                            data=image_result,
-                            file_name="generated_image.png",
-                            mime="image/png"
-                        )
-                    else:
-                        st.error(f'遇到执行错误: {image_result}')
+                if selected_model == AUTO_MODEL:
+                    job_id = get_image_job_queue().submit_routed(text, policy=ROUTING_POLICIES[policy])
+                else:
+                    job_id = get_image_job_queue().submit(model_id=selected_model, positive_prompt=text, task_type='image generation')
+                submit_image_job('image_jobs', job_id)
             else:
                 st.warning("请输入图片描述!")
+        poll_image_jobs('image_jobs', show_generation_job)
+
+        with st.expander("批量生成"):
+            batch_prompts = st.text_area("每行一个图片描述", text, height=100, key="batch_prompt_area")
+            batch_models = st.multiselect("选择模型", batch_model_options, default=batch_model_options[:1], key="batch_models")
+            variants = st.number_input("每个描述每个模型生成张数", min_value=1, max_value=12, value=4, key="batch_variants")
+            if st.button("批量生成图片", key="batch_submit"):
+                prompts = [line.strip() for line in batch_prompts.splitlines() if line.strip()]
+                if prompts and batch_models:
+                    submit_image_job('batch_jobs', get_image_job_queue().submit_batch(prompts, batch_models, int(variants)))
+                else:
+                    st.warning("请输入图片描述并选择模型!")
+            poll_image_jobs('batch_jobs', show_batch_job)
     with image_variation_sd:
         st.title("图像变体生成")
         st.subheader("上传原图，输入提示词，生成新图片")
@@ -76,8 +87,8 @@ def main():
             st.session_state.uploaded_file = None
         if 'user_prompt' not in st.session_state:
             st.session_state.user_prompt = ""
-        if 'generated_image' not in st.session_state:
-            st.session_state.generated_image = None
+        if 'variation_jobs' not in st.session_state:
+            st.session_state.variation_jobs = []
     
         def process_uploaded_image_sd():
             File = st.session_state.uploaded_file
@@ -97,13 +108,6 @@ def main():
                     st.subheader("原始图片")
                     display_and_resize_image(file_name)
     
-                with col2:
-                    st.subheader("变体图片")
-                    if st.session_state.generated_image:
-                        display_and_resize_image(st.session_state.generated_image)
-                    else:
-                        st.info("生成的变体图片将显示在这里")
-    
                 # 用户输入提示词
                 user_prompt = st.text_area("输入提示词:", value=st.session_state.user_prompt, key="user_prompt_image_area")
                 st.session_state.user_prompt = user_prompt
@@ -118,14 +122,18 @@ def main():
     
                 # 生成新图像按钮
                 if st.button('生成新图片',key='sd_variation_image'):
-                    with st.spinner('正在生成新图片...'):
-                        status, result = generate_or_vary_image(model_id=model_id, positive_prompt=st.session_state.user_prompt, source_image=file_name)
-                    if status == 0:
-                        st.session_state.generated_image = result
-                        st.success('新图片生成成功！')
-                        st.rerun()  # 重新运行以更新变体图片
+                    job_id = get_image_job_queue().submit(model_id=model_id, positive_prompt=st.session_state.user_prompt, source_image=file_name)
+                    # 只显示最新的变体
+                    st.session_state.variation_jobs = []
+                    submit_image_job('variation_jobs', job_id)
+
+                # 按钮处理之后再填充右栏，新提交的任务无需 st.rerun() 即可显示
+                with col2:
+                    st.subheader("变体图片")
+                    if st.session_state.variation_jobs:
+                        poll_image_jobs('variation_jobs', show_image_job)
                     else:
-                        st.error(f'遇到执行错误: {result}')
+                        st.info("生成的变体图片将显示在这里")
     
         uploaded_file = st.file_uploader('选择你的原始图片', type=["png", "jpg", "jpeg"], key="variation_img")
         
@@ -133,7 +141,7 @@ def main():
         if uploaded_file is not None and uploaded_file != st.session_state.uploaded_file:
             st.session_state.uploaded_file = uploaded_file
             st.session_state.user_prompt = ""
-            st.session_state.generated_image = None
+            st.session_state.variation_jobs = []
             process_uploaded_image_sd()
         elif uploaded_file is not None:
             process_uploaded_image_sd()
@@ -157,36 +165,22 @@ def main():
         # can generate color guide image with or without reference_image
         if st.button("生成图片"):
             if prompt and color_list:
-                with st.spinner('正在生成图片...'):
-                    save_folder = os.getenv("save_folder")
-                    save_path = Path(save_folder, reference_image.name) if reference_image else None
-                    if reference_image:
-                        with open(save_path, mode='wb') as w:
-                            w.write(reference_image.getvalue())
-                    print("start generate color guide image2")
-                    if save_path:
-                        print("start generate color guide image3")
-                        status, result = generate_or_vary_image(
-                            positive_prompt=prompt,
-                            model_id=model_id,
-                            source_image=save_path,
-                            task_type="color_guided_titan",
-                            color_list=color_list
-                        )
-                    else:
-                        status, result = generate_or_vary_image(
-                                model_id=model_id,
-                                positive_prompt=prompt,
-                                task_type="color_guided_titan",
-                                color_list=color_list
-                            )
-                    if status == 0:
-                        st.success("图片生成成功!")
-                        display_and_resize_image(result, target_size=768)
-                    else:
-                        st.error(f'发生执行错误: {result}')
+                save_folder = os.getenv("save_folder")
+                save_path = Path(save_folder, reference_image.name) if reference_image else None
+                if reference_image:
+                    with open(save_path, mode='wb') as w:
+                        w.write(reference_image.getvalue())
+                job_id = get_image_job_queue().submit(
+                    model_id=model_id,
+                    positive_prompt=prompt,
+                    source_image=save_path,
+                    task_type="color_guided_titan",
+                    color_list=color_list
+                )
+                submit_image_job('color_guided_jobs', job_id)
             else:
                 st.warning("请输入提示文本和颜色列表!")
+        poll_image_jobs('color_guided_jobs', show_generation_job)
 
 
     with image_background_removal:
@@ -203,34 +197,30 @@ def main():
                 st.image(file, caption='原始图片', use_column_width=True)
             else:
                 st.info("请上传图片")
-        with col2:
-            st.subheader("背景移除后")
         # 提交按钮
         result = st.button("移除背景", key="submit_image_for_background_removal")
     
         if result:
             if file is not None:
-                with st.spinner('正在处理图片...'):
-                    save_folder = os.getenv("save_folder")
-                    save_path = Path(save_folder, file.name)
-                    # 保存上传的文件
-                    with open(save_path, mode='wb') as w:
-                        w.write(file.getvalue())
-                    if save_path.exists():
-                        # 处理图片
-                        status, result = generate_or_vary_image(
-                            model_id=model_id, 
-                            source_image=save_path,
-                            task_type="background removal"
-                        )
-                        if status == 0:
-                            st.session_state.generated_image = result
-                            with col2:
-                                st.image(result, caption='背景移除后', use_column_width=True)
-                        else:
-                            st.error(f'遇到执行错误: {result}')
+                save_folder = os.getenv("save_folder")
+                save_path = Path(save_folder, file.name)
+                # 保存上传的文件
+                with open(save_path, mode='wb') as w:
+                    w.write(file.getvalue())
+                if save_path.exists():
+                    # 提交处理任务，只显示最新的结果
+                    job_id = get_image_job_queue().submit(
+                        model_id=model_id, 
+                        source_image=save_path,
+                        task_type="background removal"
+                    )
+                    st.session_state.background_removal_jobs = []
+                    submit_image_job('background_removal_jobs', job_id)
             else:
                 st.warning('请上传图片!')
+        with col2:
+            st.subheader("背景移除后")
+            poll_image_jobs('background_removal_jobs', show_image_job)
     
         # 添加一些说明信息
         st.markdown("---")
@@ -242,6 +232,106 @@ def main():
     st.markdown("由 AI 驱动 | 创建于 2024")
 
 
+JOB_STATUS_LABELS = {"queued": "排队中", "running": "生成中"}
+AUTO_MODEL = "自动选择"
+ROUTING_POLICIES = {"最快": "fastest", "最便宜": "cheapest", "SLA 内质量最佳": "quality"}
+# 每个任务列表在会话中保留的最近任务数
+SESSION_MAX_JOBS = 10
+
+
+def submit_image_job(key, job_id):
+    """
+    记录会话提交的图片任务，最新的在前，只保留最近 SESSION_MAX_JOBS 个。
+
+    参数:
+    key (str): st.session_state 中任务 id 列表的键
+    job_id (str): 任务 id
+    """
+    st.session_state[key] = ([job_id] + st.session_state.get(key, []))[:SESSION_MAX_JOBS]
+
+
+def poll_image_jobs(key, render):
+    """
+    显示会话提交的图片任务。未完成的任务在片段中每秒刷新，不重新执行整个页面；
+    已完成的任务只在整页执行时显示一次，有任务完成时整页刷新一次。
+
+    参数:
+    key (str): st.session_state 中任务 id 列表的键
+    render (callable): 显示单个任务的函数，参数为 ImageJob
+
+    返回:
+    None
+    """
+    job_queue = get_image_job_queue()
+    jobs = [job for job in map(job_queue.get, st.session_state.get(key, [])) if job is not None]
+    # 丢弃已被任务队列清理的任务
+    st.session_state[key] = [job.id for job in jobs]
+    pending_ids = [job.id for job in jobs if not job.finished]
+
+    def show_pending_jobs():
+        pending = [job for job in map(job_queue.get, pending_ids) if job is not None]
+        if any(job.finished for job in pending):
+            st.rerun()
+        for job in pending:
+            render(job)
+
+    if pending_ids:
+        st.fragment(show_pending_jobs, run_every=1)()
+    for job in jobs:
+        if job.finished:
+            render(job)
+
+
+def show_image_job(job, target_size=512):
+    """
+    显示单张图片任务的状态或结果。
+    """
+    if not job.finished:
+        st.info(f"正在生成图片...（{JOB_STATUS_LABELS[job.status]}）")
+    elif job.result:
+        display_and_resize_image(job.result, target_size=target_size)
+    else:
+        st.error(f'遇到执行错误: {job.errors[0]}')
+
+
+def show_generation_job(job):
+    """
+    显示单张图片任务的结果和下载按钮。
+    """
+    show_image_job(job, target_size=768)
+    if job.metadata:
+        tried = " → ".join(attempt["model_id"] for attempt in job.metadata["attempts"])
+        st.caption(f"路由策略 {job.metadata['policy']}，使用模型 {job.metadata['model_id'] or '无'}（尝试顺序：{tried}）")
+    if job.result:
+        st.download_button(
+            label="下载图片",
+            data=get_image_store().read_bytes(job.result),
+            file_name="generated_image" + Path(job.result).suffix,
+            mime=f"image/{Path(job.result).suffix[1:]}",
+            key=f"download_{job.id}"
+        )
+
+
+def show_batch_job(job, columns=4):
+    """
+    显示批量生成任务的进度，已完成的图片按完成顺序填入网格。
+    """
+    st.progress(job.progress, text=f"{len(job.images)} / {job.total}")
+    cells = st.columns(columns)
+    for i, image in enumerate(job.images):
+        with cells[i % columns]:
+            caption = f"#{image.prompt_index + 1} {image.model_id.split('.')[1]} v{image.variant + 1}"
+            if image.status == 0:
+                st.image(get_display_image(image.result, 512), caption=caption, use_column_width=True)
+            else:
+                st.error(f"{caption}: {image.result}")
+    if job.finished:
+        if job.errors:
+            st.warning(f"{len(job.errors)} 张图片生成失败")
+        else:
+            st.success("图片生成成功!")
+
+
 def display_and_resize_image(file_name, target_size=512):
     """
     打开图片文件，根据需要调整大小并显示。
@@ -254,15 +344,11 @@ def display_and_resize_image(file_name, target_size=512):
     None
     """
     try:
-        # 打开图片
-        img = Image.open(file_name)
-        width, height = img.size
-
-        # 调整图片大小（如果需要）
-        if width > target_size:
-            # 计算等比例缩放的高度
-            new_height = int(height * (target_size / width))
-            img = img.resize((target_size, new_height))
+        # 打开缩放后的图片（按路径、修改时间和尺寸缓存，重复渲染无需再解码原图）
+        img = get_display_image(file_name, target_size)
+
+        # 原图比目标尺寸宽时按目标宽度显示
+        if img.width == target_size:
             st.image(img, caption='Image', width=target_size)
         else:
             st.image(img, caption='Image', use_column_width=True)
@@ -6,7 +6,9 @@ from pathlib import Path
 import streamlit as st
 from dotenv import load_dotenv
 
-from utils.invoice_extract import InvoiceExtractor
+from utils.dedup_store import get_dedup_store
+from utils.invoice_batch import extract_invoices
+from utils.rate_limiter import PRIORITY_INTERACTIVE
 
 logger = logging.getLogger(__name__)
 
@@ -43,27 +45,39 @@ def main():
         expander = st.expander('prompts 详细信息')
         expander.text_area('', value=prompts, height=300)
 
-        File = st.file_uploader(label='发票文件',
-                                type=["pdf", "webp", "png", "jpg", "jpeg"],
-                                accept_multiple_files=False,
-                                key="new")
+        files = st.file_uploader(label='发票文件',
+                                 type=["pdf", "webp", "png", "jpg", "jpeg"],
+                                 accept_multiple_files=True,
+                                 key="new")
 
         result = st.button("提交", key="invoice_submit")
         if result:
-            if File is not None:
+            if files:
                 save_folder = os.getenv("save_folder")
                 print(save_folder)
-                print('filename:' + File.name)
-                save_path = Path(save_folder, File.name)
-                with open(save_path, mode='wb') as w:
-                    w.write(File.getvalue())
-
-                if save_path.exists():
-                    file_name = str(save_path)
-                    print(file_name)
-                    output = InvoiceExtractor(file_name).extract()
-                    data = json.loads(output)
-                    st.write(data)
+                file_names = []
+                for File in files:
+                    print('filename:' + File.name)
+                    save_path = Path(save_folder, File.name)
+                    with open(save_path, mode='wb') as w:
+                        w.write(File.getvalue())
+                    file_names.append(str(save_path))
+
+                # 多个文件并发提取，每个文件完成后立即显示
+                progress = st.progress(0.0, text='正在提取发票信息...')
+                for done, output in enumerate(extract_invoices(file_names, priority=PRIORITY_INTERACTIVE), 1):
+                    progress.progress(done / len(file_names), text=f'已完成 {done}/{len(file_names)}')
+                    with st.expander(f"{Path(output['file']).name} ({output['timings']['total_s']}s)", expanded=True):
+                        if output['status'] == 'ok':
+                            st.write(output['invoices'])
+                        else:
+                            st.error(output['error'])
+                        st.caption(json.dumps(output['timings']))
+                        if output.get('pages'):
+                            st.caption('页面处理路径: ' + ', '.join(page['path'] for page in output['pages']))
+                        if output.get('cached'):
+                            st.caption('结果来自去重缓存，未调用 Bedrock')
+                st.caption(get_dedup_store().summary())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,41 @@
+from dataclasses import asdict
+
+import streamlit as st
+
+from utils.instrumentation import get_call_records, summarize_calls
+from utils.rate_limiter import get_rate_limiter
+
+import logging
+logger = logging.getLogger(__name__)
+
+GROUP_BY_OPTIONS = {"调用点": "call_site", "模型": "model_id"}
+
+
+def main():
+    st.set_page_config(page_title="Admin")
+
+    st.title("模型调用监控")
+    st.button("刷新")
+
+    records = get_call_records()
+    st.caption(f"本进程最近 {len(records)} 次模型调用（耗时单位：毫秒）")
+    if not records:
+        st.info("暂无模型调用记录")
+        return
+
+    group_by = st.radio("分组", list(GROUP_BY_OPTIONS), horizontal=True)
+    st.subheader("延迟与 tokens")
+    st.dataframe(summarize_calls(records, GROUP_BY_OPTIONS[group_by]), use_container_width=True)
+
+    st.subheader("限流状态")
+    st.dataframe(
+        [{"model_id": model_id, **metrics} for model_id, metrics in get_rate_limiter().metrics().items()],
+        use_container_width=True,
+    )
+
+    st.subheader("最近调用")
+    st.dataframe([asdict(record) for record in reversed(records[-100:])], use_container_width=True)
+
+
+if __name__ == '__main__':
+    main()
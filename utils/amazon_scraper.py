@@ -6,9 +6,10 @@ import sys
 from datetime import datetime
 import boto3
 
-import requests
 from pprint import pprint
 
+from utils.replay import replay_request
+
 def get_product(asin, do):
     print(asin, do)
     # Structure payload.
@@ -25,7 +26,7 @@ def get_product(asin, do):
     }
 
     # Get response.
-    response = requests.request(
+    response = replay_request(
         'POST',
         'https://realtime.oxylabs.io/v1/queries',
         #auth=('awslab_KkvGd', 'awsLAB_10248376'),
@@ -47,7 +48,7 @@ def get_reviews(asin, do):
 
 
     # Get response.
-    response = requests.request(
+    response = replay_request(
         'POST',
         'https://realtime.oxylabs.io/v1/queries',
         # auth=('awslab_KkvGd', 'awsLAB_10248376'),
@@ -75,7 +76,7 @@ def get_bestsellers(categoryid):
     }
 
     # Get response.
-    response = requests.request(
+    response = replay_request(
         'POST',
         'https://realtime.oxylabs.io/v1/queries',
         # auth=('awslab_KkvGd', 'awsLAB_10248376'),
@@ -0,0 +1,261 @@
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import threading
+import weakref
+
+from dotenv import load_dotenv
+
+from utils.bedrock_client import DEFAULT_REGION, ROLE_SESSION_NAME, _client_config, get_boto3_client
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.credentials import AioAssumeRoleCredentialFetcher, AioDeferredRefreshableCredentials
+    from aiobotocore.session import get_session
+except ImportError:  # optional, falls back to the pooled boto3 client run in threads
+    AioConfig = None
+    get_session = None
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# max concurrent in-flight requests per model id, can be overridden in .env
+MAX_CONCURRENCY_PER_MODEL = int(os.getenv("bedrock_max_concurrency_per_model", 16))
+
+_END = object()
+
+
+class _LoopState:
+    """
+    aiobotocore clients and asyncio semaphores are bound to the event loop they are used in.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.exit_stack = contextlib.AsyncExitStack()
+        self.client_lock = asyncio.Lock()
+        self.semaphores = {}
+
+
+class AsyncBedrockClient:
+    """
+    asyncio-native Bedrock runtime client.
+
+    Uses aiobotocore when it is installed (one pooled aiohttp client per event loop), otherwise the
+    shared boto3 client of `get_boto3_client` in worker threads. Concurrent requests are bounded by
+    one semaphore per model id.
+    """
+
+    def __init__(self, region_name=DEFAULT_REGION, role_arn=None, max_concurrency_per_model=MAX_CONCURRENCY_PER_MODEL):
+        self.region_name = region_name
+        self.role_arn = role_arn or os.getenv("bedrock_role_arn") or None
+        self.max_concurrency_per_model = max_concurrency_per_model
+        self._states = weakref.WeakKeyDictionary()
+        self.sync = SyncBedrockFacade(self)
+
+    @property
+    def native(self):
+        """
+        True if requests are sent by aiobotocore, False if they run in threads.
+        """
+        return get_session is not None
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState()
+        return state
+
+    def _semaphore(self, model_id):
+        semaphores = self._state().semaphores
+        if model_id not in semaphores:
+            semaphores[model_id] = asyncio.Semaphore(self.max_concurrency_per_model)
+        return semaphores[model_id]
+
+    async def _client(self):
+        state = self._state()
+        if state.client is None:
+            async with state.client_lock:
+                if state.client is None:
+                    session = get_session()
+                    session.set_config_variable("region", self.region_name)
+                    if self.role_arn:
+                        # the assumed role credentials are refreshed before they expire, as in bedrock_client
+                        fetcher = AioAssumeRoleCredentialFetcher(
+                            client_creator=session.create_client,
+                            source_credentials=await session.get_credentials(),
+                            role_arn=self.role_arn,
+                            extra_args={"RoleSessionName": ROLE_SESSION_NAME},
+                        )
+                        session._credentials = AioDeferredRefreshableCredentials(
+                            method="assume-role", refresh_using=fetcher.fetch_credentials)
+                    config = AioConfig(**{
+                        key: getattr(_client_config(), key)
+                        for key in ("max_pool_connections", "tcp_keepalive", "read_timeout", "retries")
+                    })
+                    state.client = await state.exit_stack.enter_async_context(session.create_client(
+                        "bedrock-runtime", region_name=self.region_name, config=config))
+                    logger.info(f"Created aiobotocore bedrock-runtime client for {self.region_name}")
+        return state.client
+
+    def _sync_client(self):
+        return get_boto3_client(self.region_name, self.role_arn)
+
+    async def converse(self, **request):
+        """
+        Args:
+            **request: converse arguments (modelId, messages, inferenceConfig, ...).
+
+        Returns:
+            dict: converse response.
+        """
+        async with self._semaphore(request.get("modelId")):
+            if not self.native:
+                return await asyncio.to_thread(self._sync_client().converse, **request)
+            return await (await self._client()).converse(**request)
+
+    async def converse_stream(self, **request):
+        """
+        The model's semaphore is held until the stream is consumed or closed.
+
+        Args:
+            **request: converse_stream arguments.
+
+        Yields:
+            dict: converse_stream events.
+        """
+        async with self._semaphore(request.get("modelId")):
+            if self.native:
+                response = await (await self._client()).converse_stream(**request)
+                async for event in response["stream"]:
+                    yield event
+                return
+
+            stream = (await asyncio.to_thread(self._sync_client().converse_stream, **request))["stream"]
+            events = iter(stream)
+            try:
+                while (event := await asyncio.to_thread(next, events, _END)) is not _END:
+                    yield event
+            finally:
+                if hasattr(stream, "close"):
+                    stream.close()
+
+    async def invoke_model(self, **request):
+        """
+        Args:
+            **request: invoke_model arguments (modelId, body, ...).
+
+        Returns:
+            dict: invoke_model response, its `body` is fully read into a file-like object.
+        """
+        async with self._semaphore(request.get("modelId")):
+            if not self.native:
+                response = await asyncio.to_thread(self._sync_client().invoke_model, **request)
+                response["body"] = io.BytesIO(await asyncio.to_thread(response["body"].read))
+                return response
+            response = await (await self._client()).invoke_model(**request)
+            async with response["body"] as body:
+                response["body"] = io.BytesIO(await body.read())
+            return response
+
+    async def close(self):
+        """
+        Close the aiobotocore client of the running event loop.
+        """
+        state = self._states.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state.exit_stack.aclose()
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    """
+    Event loop running in a daemon thread, shared by every sync facade of the process.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="bedrock-async-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_sync(coro):
+    """
+    Run a coroutine on the background event loop and wait for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+class SyncBedrockFacade:
+    """
+    Blocking view of an AsyncBedrockClient with the boto3 client interface, so existing callers keep
+    working while every request of the process is multiplexed on one event loop.
+
+    Operations other than converse / converse_stream / invoke_model go to the boto3 client.
+    """
+
+    def __init__(self, async_client):
+        self.async_client = async_client
+
+    def converse(self, **request):
+        return run_sync(self.async_client.converse(**request))
+
+    def converse_stream(self, **request):
+        return {"stream": self._iter_stream(self.async_client.converse_stream(**request))}
+
+    def _iter_stream(self, events):
+        try:
+            while True:
+                try:
+                    yield run_sync(events.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            run_sync(events.aclose())
+
+    def invoke_model(self, **request):
+        return run_sync(self.async_client.invoke_model(**request))
+
+    def __getattr__(self, name):
+        return getattr(self.async_client._sync_client(), name)
+
+
+_async_clients = {}
+_async_clients_lock = threading.Lock()
+
+
+def get_async_bedrock_client(region_name=DEFAULT_REGION, role_arn=None):
+    """
+    Return the shared AsyncBedrockClient for (region, role), creating it on first use.
+
+    Args:
+        region_name (str): AWS region of the Bedrock endpoint.
+        role_arn (str, optional): IAM role to assume, defaults to the `bedrock_role_arn` env variable.
+
+    Returns:
+        AsyncBedrockClient: the shared client.
+    """
+    key = (region_name, role_arn or os.getenv("bedrock_role_arn") or None)
+    with _async_clients_lock:
+        if key not in _async_clients:
+            _async_clients[key] = AsyncBedrockClient(region_name, key[1])
+        return _async_clients[key]
+
+
+def get_sync_facade(region_name=DEFAULT_REGION, role_arn=None):
+    """
+    Returns:
+        SyncBedrockFacade: blocking facade of the shared AsyncBedrockClient for (region, role).
+    """
+    return get_async_bedrock_client(region_name, role_arn).sync
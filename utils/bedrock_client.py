@@ -0,0 +1,138 @@
+import os
+import threading
+
+import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.credentials import AssumeRoleCredentialFetcher, DeferredRefreshableCredentials
+from dotenv import load_dotenv
+
+from utils.replay import replay_client
+
+# loading in variables from .env file
+load_dotenv()
+
+DEFAULT_REGION = 'us-west-2'
+ROLE_SESSION_NAME = 'genai-assistant-for-ecommerce'
+
+# connection pool / retry settings, can be overridden in .env
+MAX_POOL_CONNECTIONS = int(os.getenv("bedrock_max_pool_connections", 50))
+TCP_KEEPALIVE = os.getenv("bedrock_tcp_keepalive", "true").lower() == "true"
+MAX_RETRY_ATTEMPTS = int(os.getenv("bedrock_max_retry_attempts", 5))
+READ_TIMEOUT = int(os.getenv("bedrock_read_timeout", 300))
+# serve bedrock-runtime calls through the asyncio client layer (see utils/async_bedrock.py)
+ASYNC_RUNTIME = os.getenv("bedrock_async", "false").lower() == "true"
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _client_config(service_name='bedrock-runtime', rate_limited=True):
+    if service_name == 'bedrock-runtime' and rate_limited:
+        # single attempt: throttles and transient errors of runtime calls are retried by utils/rate_limiter.py,
+        # which must see every throttle to adjust its rate, and botocore retries on top would multiply the attempts
+        retries = {"total_max_attempts": 1, "mode": "standard"}
+    else:
+        retries = {"max_attempts": MAX_RETRY_ATTEMPTS, "mode": "adaptive"}
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=TCP_KEEPALIVE,
+        read_timeout=READ_TIMEOUT,
+        retries=retries,
+    )
+
+
+def _session(region_name, role_arn=None):
+    if not role_arn:
+        return boto3.session.Session(region_name=region_name)
+
+    # the assumed role credentials are refreshed by botocore before they expire, so long running
+    # Streamlit servers keep a working client
+    base = boto3.session.Session(region_name=region_name)
+    fetcher = AssumeRoleCredentialFetcher(
+        client_creator=base._session.create_client,
+        source_credentials=base.get_credentials(),
+        role_arn=role_arn,
+        extra_args={'RoleSessionName': ROLE_SESSION_NAME},
+    )
+    botocore_session = botocore.session.get_session()
+    botocore_session._credentials = DeferredRefreshableCredentials(
+        method='assume-role', refresh_using=fetcher.fetch_credentials)
+    return boto3.session.Session(botocore_session=botocore_session, region_name=region_name)
+
+
+def get_bedrock_client(region_name=DEFAULT_REGION, role_arn=None, service_name='bedrock-runtime', rate_limited=True):
+    """
+    Return the shared Bedrock client for (service, region, role), creating it on first use.
+
+    boto3 clients are thread safe, so one pooled client per key is reused by every
+    module and every Streamlit session instead of building a new one per call.
+    With `bedrock_async=true`, bedrock-runtime clients are blocking facades of the shared
+    asyncio client, so the requests of all sessions are multiplexed on one event loop.
+    With `replay_mode=record|replay`, bedrock-runtime calls are recorded to / served from
+    a JSON Lines file (see utils/replay.py).
+
+    bedrock-runtime clients don't retry: their callers go through utils/rate_limiter.py, which retries
+    throttles and transient errors. Callers that can't, e.g. LangChain's ChatBedrock, ask for
+    `rate_limited=False` and get a client with botocore's adaptive retries.
+
+    Args:
+        region_name (str): AWS region of the Bedrock endpoint.
+        role_arn (str, optional): IAM role to assume, defaults to the `bedrock_role_arn` env variable.
+        service_name (str): boto3 service name.
+        rate_limited (bool): the caller sends its requests through the rate limiter.
+
+    Returns:
+        botocore.client.BaseClient: the pooled client.
+    """
+    if service_name != 'bedrock-runtime':
+        return get_boto3_client(region_name, role_arn, service_name)
+    if not rate_limited:
+        client = get_boto3_client(region_name, role_arn, service_name, rate_limited=False)
+    elif ASYNC_RUNTIME:
+        from utils.async_bedrock import get_sync_facade
+        client = get_sync_facade(region_name, role_arn)
+    else:
+        client = get_boto3_client(region_name, role_arn, service_name)
+    return replay_client(client)
+
+
+def get_boto3_client(region_name=DEFAULT_REGION, role_arn=None, service_name='bedrock-runtime', rate_limited=True):
+    """
+    Return the shared boto3 client for (service, region, role), see get_bedrock_client.
+    """
+    role_arn = role_arn or os.getenv("bedrock_role_arn") or None
+    key = (service_name, region_name, role_arn, rate_limited)
+
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            session = _session(region_name, role_arn)
+            client = session.client(service_name=service_name, config=_client_config(service_name, rate_limited))
+            _clients[key] = client
+    return client
+
+
+def clear_clients():
+    """
+    Drop every cached client, e.g. after credentials have been rotated.
+    """
+    with _lock:
+        _clients.clear()
+
+
+def set_bedrock_client(client, region_name=DEFAULT_REGION, role_arn=None, service_name='bedrock-runtime'):
+    """
+    Install the client returned for (service, region, role), e.g. a local stand-in for offline benchmarks.
+
+    Modules that keep a module level client (listing_voc_prompt, content_moderation) must be
+    imported after this call.
+    """
+    role_arn = role_arn or os.getenv("bedrock_role_arn") or None
+    with _lock:
+        for rate_limited in (True, False):
+            _clients[(service_name, region_name, role_arn, rate_limited)] = client
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+from utils.payload_estimator import estimate_tokens
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DATA_FOLDER = os.getenv("data_folder") or "./data"
+# min seconds between two scans of the data folder for changed files
+REFRESH_INTERVAL = float(os.getenv("catalog_refresh_interval", 2))
+
+_FILE_PATTERN = re.compile(r"^asin_(?P<asin>[A-Z0-9]+)_(?P<kind>product|reviews)\.json$")
+
+
+@dataclass(slots=True)
+class Product:
+    asin: str
+    domain: str
+    title: str
+    bullet_points: str
+    description: str
+    brand: str = ""
+    product_name: str = ""
+
+
+@dataclass(slots=True)
+class Review:
+    id: str
+    rating: int
+    title: str
+    content: str
+    author: str = ""
+    timestamp: str = ""
+    profile_id: str = ""
+    is_verified: bool = False
+    product_attributes: str = ""
+    helpful_count: int = 0
+
+
+@dataclass(slots=True)
+class ReviewSet:
+    asin: str
+    domain: str
+    product_name: str
+    page: int
+    pages: int
+    reviews: list[Review] = field(default_factory=list)
+    # estimated tokens of the raw Oxylabs results, as the VOC prompt used to paste them verbatim
+    source_tokens: int = 0
+
+
+def _domain_from_url(url):
+    """
+    'https://www.amazon.co.uk/dp/...' -> 'co.uk'
+    """
+    host = urlparse(url or "").hostname or ""
+    _, _, domain = host.partition("amazon.")
+    return domain or "com"
+
+
+def _parse_product(asin, data):
+    content = data['results'][0]['content']
+    return Product(
+        asin=asin,
+        domain=_domain_from_url(content.get('url')),
+        title=content.get('title') or "",
+        bullet_points=content.get('bullet_points') or "",
+        description=content.get('description') or "",
+        brand=content.get('brand') or "",
+        product_name=content.get('product_name') or "",
+    )
+
+
+def _parse_reviews(asin, data):
+    content = data['results'][0]['content']
+    reviews = [
+        Review(
+            id=review.get('id') or "",
+            rating=int(review.get('rating') or 0),
+            title=review.get('title') or "",
+            content=review.get('content') or "",
+            author=review.get('author') or "",
+            timestamp=review.get('timestamp') or "",
+            profile_id=review.get('profile_id') or "",
+            is_verified=bool(review.get('is_verified')),
+            product_attributes=review.get('product_attributes') or "",
+            helpful_count=int(review.get('helpful_count') or 0),
+        )
+        for result in data['results']
+        for review in result['content'].get('reviews', [])
+    ]
+    return ReviewSet(
+        asin=asin,
+        domain=_domain_from_url(content.get('url')),
+        product_name=content.get('product_name') or "",
+        page=int(content.get('page') or 1),
+        pages=int(content.get('pages') or 1),
+        reviews=reviews,
+        source_tokens=estimate_tokens(str(data['results'])),
+    )
+
+
+class Catalog:
+    """
+    Product and review records of every `asin_<ASIN>_{product,reviews}.json` file in the data folder.
+
+    Files are parsed once into typed records indexed by (domain, ASIN), and re-parsed only
+    when their mtime or size changes.
+    """
+
+    def __init__(self, data_folder=DATA_FOLDER, refresh_interval=REFRESH_INTERVAL):
+        self._data_folder = data_folder
+        self._refresh_interval = refresh_interval
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+        self._files = {}  # file name -> (mtime_ns, size)
+        self._products = {}  # (domain, asin) -> Product
+        self._reviews = {}  # (domain, asin) -> ReviewSet
+        self._keys = {}  # file name -> (domain, asin)
+
+    def refresh(self, force=False):
+        """
+        Re-parse new or modified files and drop deleted ones.
+        """
+        if not force and time.monotonic() - self._last_refresh < self._refresh_interval:
+            return
+        with self._lock:
+            seen = set()
+            for entry in os.scandir(self._data_folder):
+                match = _FILE_PATTERN.match(entry.name)
+                if not match:
+                    continue
+                seen.add(entry.name)
+                stat = entry.stat()
+                signature = (stat.st_mtime_ns, stat.st_size)
+                if self._files.get(entry.name) == signature:
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as file:
+                        data = json.load(file)
+                    self._load(entry.name, match['asin'], match['kind'], data)
+                    self._files[entry.name] = signature
+                except (OSError, ValueError, KeyError, IndexError) as e:
+                    logger.error(f"Failed to load {entry.path}: {e}")
+
+            for name in set(self._files) - seen:
+                self._unload(name)
+            self._last_refresh = time.monotonic()
+
+    def _load(self, name, asin, kind, data):
+        self._unload(name)
+        record = _parse_product(asin, data) if kind == 'product' else _parse_reviews(asin, data)
+        key = (record.domain, asin)
+        (self._products if kind == 'product' else self._reviews)[key] = record
+        self._keys[name] = key
+
+    def _unload(self, name):
+        self._files.pop(name, None)
+        key = self._keys.pop(name, None)
+        if key is not None:
+            index = self._products if name.endswith('_product.json') else self._reviews
+            index.pop(key, None)
+
+    def get_product(self, asin, domain='com'):
+        """
+        :raise KeyError: if the ASIN has no product file for the domain
+        """
+        self.refresh()
+        try:
+            return self._products[(domain, asin)]
+        except KeyError:
+            raise KeyError(f"No product data for ASIN {asin} on amazon.{domain}") from None
+
+    def get_reviews(self, asin, domain='com'):
+        """
+        :raise KeyError: if the ASIN has no reviews file for the domain
+        """
+        self.refresh()
+        try:
+            return self._reviews[(domain, asin)]
+        except KeyError:
+            raise KeyError(f"No review data for ASIN {asin} on amazon.{domain}") from None
+
+    def asins(self, domain='com', with_reviews=False):
+        """
+        Sorted ASINs having product data (or review data if `with_reviews`) for the domain.
+        """
+        self.refresh()
+        index = self._reviews if with_reviews else self._products
+        return sorted(asin for (d, asin) in index if d == domain)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    Return the process wide catalog of the `data_folder` directory.
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = Catalog()
+    return _catalog
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from PIL import Image
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# dedup store settings, can be overridden in .env
+DEDUP_STORE_PATH = os.getenv("dedup_store_path", ".cache/dedup_store.sqlite3")
+# max hamming distance between two 64 bit perceptual hashes of near-identical images
+DEDUP_MAX_DISTANCE = int(os.getenv("dedup_max_distance", 4))
+# stored results expire after dedup_ttl seconds, and the oldest are dropped above dedup_max_entries
+DEDUP_TTL = int(os.getenv("dedup_ttl", 30 * 24 * 3600))
+DEDUP_MAX_ENTRIES = int(os.getenv("dedup_max_entries", 10000))
+
+_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def perceptual_hash(image_path):
+    """
+    64 bit difference hash (dHash): robust to re-encoding, resizing and small edits.
+
+    Returns:
+        int: the hash, or None if the file is not an image.
+    """
+    if not str(image_path).lower().endswith(_IMAGE_EXTENSIONS):
+        return None
+    with Image.open(image_path) as img:
+        # JPEG: decode at reduced scale, the hash only needs 9x8 pixels
+        img.draft('L', (64, 64))
+        pixels = list(img.convert('L').resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+    # sqlite integers are signed 64 bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def fingerprint(file_path, perceptual=True):
+    """
+    Args:
+        file_path (str): uploaded file.
+        perceptual (bool): also compute the perceptual hash.
+
+    Returns:
+        tuple: (sha256 hex digest of the file content, perceptual hash or None)
+    """
+    with open(file_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if not perceptual:
+        return digest, None
+    try:
+        phash = perceptual_hash(file_path)
+    except OSError:
+        phash = None
+    return digest, phash
+
+
+def _distance(a, b):
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+class DedupStore:
+    """
+    Results of upload processing (invoice extraction, image moderation, image Q&A) keyed by the upload's
+    exact content hash and its perceptual hash, so identical and near-identical uploads skip Bedrock.
+
+    Results are partitioned by namespace, which must capture everything else the result depends on
+    (feature, model id, prompt). Results whose value depends on small details of the image (invoice numbers,
+    amounts, a small infringing element) must be stored without perceptual hash, so they match exactly only.
+    """
+
+    def __init__(self, path=DEDUP_STORE_PATH, max_distance=DEDUP_MAX_DISTANCE, ttl=DEDUP_TTL,
+                 max_entries=DEDUP_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "namespace TEXT NOT NULL, sha256 TEXT NOT NULL, phash INTEGER, result TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, sha256))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "perceptual_hits": 0, "misses": 0, "bedrock_calls_saved": 0}
+
+    def lookup(self, namespace, digest, phash=None):
+        """
+        Returns:
+            the stored result, or None.
+        """
+        not_before = time.time() - self.ttl
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM results WHERE namespace = ? AND sha256 = ? AND created_at >= ?",
+                (namespace, digest, not_before)).fetchone()
+            if row is not None:
+                self.stats["exact_hits"] += 1
+                self.stats["bedrock_calls_saved"] += 1
+                return json.loads(row[0])
+
+            if phash is not None and self.max_distance > 0:
+                # only the hashes are scanned, the matching result is fetched afterwards
+                rows = self._conn.execute(
+                    "SELECT phash, sha256 FROM results WHERE namespace = ? AND phash IS NOT NULL AND created_at >= ?",
+                    (namespace, not_before))
+                best = min(((_distance(phash, other), other_digest) for other, other_digest in rows), default=None)
+                if best is not None and best[0] <= self.max_distance:
+                    row = self._conn.execute(
+                        "SELECT result FROM results WHERE namespace = ? AND sha256 = ?", (namespace, best[1])).fetchone()
+                    self.stats["perceptual_hits"] += 1
+                    self.stats["bedrock_calls_saved"] += 1
+                    return json.loads(row[0])
+
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, namespace, digest, phash, result):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (namespace, sha256, phash, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, digest, phash, json.dumps(result, ensure_ascii=False), time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        self._conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+
+    def hit_rate(self):
+        hits = self.stats["exact_hits"] + self.stats["perceptual_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def summary(self):
+        return (f"去重缓存命中率 {self.hit_rate():.0%}（完全相同 {self.stats['exact_hits']}，"
+                f"近似 {self.stats['perceptual_hits']}），节省 Bedrock 调用 {self.stats['bedrock_calls_saved']} 次")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_dedup_store():
+    """
+    Return the process wide dedup store.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = DedupStore()
+    return _store
+
+
+def dedup_call(namespace, file_path, fn, perceptual=True):
+    """
+    Return the stored result for `file_path` (or a near-identical image), or compute it with `fn()` and store it.
+
+    Args:
+        namespace (str): feature / model / prompt the result depends on.
+        file_path (str): uploaded file.
+        fn (callable): computes the result, must return a JSON serializable value; None is not stored.
+        perceptual (bool): also reuse the result of near-identical images, False to match identical files only.
+    """
+    store = get_dedup_store()
+    digest, phash = fingerprint(file_path, perceptual)
+    result = store.lookup(namespace, digest, phash)
+    if result is not None:
+        logger.info(f"Dedup store hit for {file_path} in {namespace}")
+        return result
+
+    result = fn()
+    if result is not None:
+        store.store(namespace, digest, phash, result)
+    return result
@@ -3,11 +3,47 @@ import io
 import os
 import json
 import logging
-import boto3
-from PIL import Image
+import random
+import threading
 import time
+from collections import deque
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from enum import Enum, unique
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from utils.bedrock_client import get_bedrock_client
+from utils.image_preprocess import prepare_image_base64
+from utils.image_store import get_image_store
+from utils.instrumentation import instrument_call, invoke_model_metadata
+from utils.payload_estimator import estimate_request
+from utils.rate_limiter import RETRY_MAX_ATTEMPTS, is_throttling_error, is_transient_error, rate_limited_call
+
+# Titan image generator accepts 1 to 5 images per request
+TITAN_MAX_IMAGES_PER_REQUEST = 5
+# max number of image requests in flight per batch, can be overridden in .env
+IMAGE_BATCH_MAX_CONCURRENCY = int(os.getenv("image_batch_max_concurrency", 8))
+
+# text-to-image models the router picks from: list price in USD per 1024x1024 image, relative quality,
+# and the latency (seconds) assumed until calls have been measured
+IMAGE_MODEL_PROFILES = {
+    "stability.stable-image-ultra-v1:0": {"cost": 0.14, "quality": 3, "latency_s": 15.0},
+    "stability.sd3-large-v1:0": {"cost": 0.08, "quality": 2, "latency_s": 10.0},
+    "stability.stable-image-core-v1:0": {"cost": 0.04, "quality": 1, "latency_s": 5.0},
+    "amazon.titan-image-generator-v2:0": {"cost": 0.01, "quality": 1, "latency_s": 6.0},
+}
+ROUTER_POLICIES = ("fastest", "cheapest", "quality")
+# router settings, can be overridden in .env
+ROUTER_WINDOW = int(os.getenv("image_router_window", 50))  # recent calls kept per model
+ROUTER_SLA_S = float(os.getenv("image_router_sla_s", 20))  # p95 latency allowed by the quality policy
+ROUTER_MAX_ERROR_RATE = float(os.getenv("image_router_max_error_rate", 0.5))
+ROUTER_MAX_AGE_S = float(os.getenv("image_router_max_age_s", 900))  # older calls are forgotten
+# share of routed requests sent first to the model with the oldest statistics, so that models ranked
+# low after a bad window get measured again
+ROUTER_PROBE_RATE = float(os.getenv("image_router_probe_rate", 0.05))
+# calls needed before a model's error rate is trusted
+_ROUTER_MIN_CALLS = 5
 
 
 class ImageError(Exception):
@@ -29,36 +65,70 @@ formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 handler.setFormatter(formatter)
 logger.setLevel(logging.INFO)
 
-def generate_image_request(model_id, body):
+def generate_images_request(model_id, body, observe=True, max_attempts=RETRY_MAX_ATTEMPTS):
     """
-    Generate an image using bedrock invoke model.
+    Generate images using bedrock invoke model.
+
+    Args:
+        model_id (str): The ID of the model to use.
+        body (str): JSON request body.
+        observe (bool): feed the latency and outcome to the router statistics, only for single image
+            text to image requests, which the router compares.
+        max_attempts (int): attempts of a throttled request, see rate_limited_call.
+
+    Returns:
+        tuple: (seeds, list of image bytes), Titan returns `numberOfImages` images per request.
     """
+    if not observe:
+        return _generate_images_request(model_id, body, max_attempts)
+    start = time.perf_counter()
+    try:
+        seeds, images_bytes = _generate_images_request(model_id, body, max_attempts)
+    except Exception:
+        get_image_router().observe(model_id, time.perf_counter() - start, ok=False)
+        raise
+    get_image_router().observe(model_id, time.perf_counter() - start, ok=True)
+    return seeds, images_bytes
+
+
+def _generate_images_request(model_id, body, max_attempts):
     logger.info(f"Generating image with model {model_id}")
     
-    bedrock = boto3.client(service_name="bedrock-runtime", region_name='us-west-2')
-    response = bedrock.invoke_model(body=body, modelId=model_id, accept="application/json", contentType="application/json")
-    response_body = json.loads(response.get("body").read().decode("utf-8"))
+    bedrock = get_bedrock_client(region_name='us-west-2')
+    with instrument_call(model_id, "invoke_model", estimate_request(body=body), call_site="image_factory") as call:
+        response = rate_limited_call(model_id, lambda: bedrock.invoke_model(
+            body=body, modelId=model_id, accept="application/json", contentType="application/json"),
+            max_attempts=max_attempts)
+        response_body = json.loads(response.get("body").read().decode("utf-8"))
+        call.update(invoke_model_metadata(response))
     
     if model_id.startswith('stability'):
         finish_reasons = response_body.get('finish_reasons')
         logger.info(f"finish reasons is: {finish_reasons}")
         seeds = response_body.get('seeds')
-        images = response_body.get('images')[0]
+        images = response_body.get('images')
         # 检查是否有错误
         if finish_reasons and any(reason is not None for reason in finish_reasons):
             raise ImageError(f"Image generation error. Error code is {finish_reasons}")
-        image_bytes = base64.b64decode(images)
+        images_bytes = [base64.b64decode(image) for image in images]
     else:  # Titan model
-        base64_image = response_body.get("images")[0]
         if response_body.get("error"):
             raise ImageError(f"Image generation error. Error is {response_body.get('error')}")
-        image_bytes = base64.b64decode(base64_image.encode("ascii"))
+        images_bytes = [base64.b64decode(image.encode("ascii")) for image in response_body.get("images")]
         body_dict = json.loads(body)
         seeds = body_dict.get("imageGenerationConfig", {}).get("seed", 0)
     
-    logger.info(f"Successfully generated image with model {model_id}")
+    logger.info(f"Successfully generated {len(images_bytes)} image(s) with model {model_id}")
     
-    return seeds, image_bytes
+    return seeds, images_bytes
+
+
+def generate_image_request(model_id, body, observe=True, max_attempts=RETRY_MAX_ATTEMPTS):
+    """
+    Generate an image using bedrock invoke model, see generate_images_request.
+    """
+    seeds, images_bytes = generate_images_request(model_id, body, observe, max_attempts)
+    return seeds, images_bytes[0]
 
 
 def generate_or_vary_image(model_id, positive_prompt=None, negative_prompt='low quality', source_image=None, **kwargs):
@@ -76,85 +146,13 @@ def generate_or_vary_image(model_id, positive_prompt=None, negative_prompt='low
         tuple: A tuple containing status code (0 for success, 1 for failure) and result (file path or error message).
     """
     try:
-        if model_id.startswith('stability'):
-            request_data = {
-                "prompt": positive_prompt,
-                "negative_prompt": negative_prompt,
-                "mode": kwargs.get('mode', "text-to-image") ,
-                "aspect_ratio": kwargs.get('aspect_ratio', "1:1") ,
-                "seed": kwargs.get('seed', 0),
-                "output_format": kwargs.get('output_format', 'png'),
-            }
-            if source_image and model_id == "stability.sd3-large-v1:0":
-                # Image variation mode
-                request_data.pop('aspect_ratio', None)
-                request_data.update({
-                    "mode": "image-to-image",
-                    "strength": kwargs.get('strength', 1),
-                })
-                
-                with open(source_image, "rb") as image_file:
-                    request_data["image"] = base64.b64encode(image_file.read()).decode("utf-8")
+        body = build_request_body(model_id, positive_prompt, negative_prompt, source_image, **kwargs)
+        if body is None:
+            return 1, "parameters error, please check again!"
 
-            body = json.dumps(request_data)
-            
-        elif model_id == 'amazon.titan-image-generator-v2:0':
-            print(f"task_type is {kwargs.get('task_type')}")
-            print(f"prompt is: {positive_prompt}")
-            print(f"color_list is: {kwargs.get('color_list')}")
-            if kwargs.get('task_type') == "image generation":
-                body = json.dumps({
-                    "taskType": "TEXT_IMAGE",
-                    "textToImageParams": {
-                        "text": positive_prompt,
-                        "negativeText": negative_prompt
-                    },
-                    "imageGenerationConfig": {
-                        "numberOfImages": kwargs.get('numberOfImages', 1),
-                        "height": kwargs.get('height', 1024),
-                        "width": kwargs.get('width', 1024),
-                        "cfgScale": kwargs.get('cfgScale', 8.0),
-                        "seed": kwargs.get('seed', 0)
-                    }
-                })
-            elif kwargs.get('task_type') == "color_guided_titan":
-                print("start color guided titan11")
-                print(kwargs.get('color_list'))
-                color_list = kwargs.get('color_list')
-                request_data = {
-                    "taskType": "COLOR_GUIDED_GENERATION",
-                    "colorGuidedGenerationParams": {
-                        "text": positive_prompt, # sample: a jar of salad dressing in a rustic kitchen surrounded by fresh vegetables with studio lighting
-                        "negativeText": negative_prompt,
-                        "colors": color_list # '#ff8080', '#ffb280', '#ffe680', '#e5ff80'
-                    },
-                    "imageGenerationConfig": {
-                    "numberOfImages": 1,
-                    "height": 512,
-                    "width": 512,
-                    "cfgScale": 8.0
-                    }
-                }
-                if source_image:
-                    input_image=load_and_resize_image(source_image)
-                    request_data["colorGuidedGenerationParams"]["referenceImage"] = input_image
-                body = json.dumps(request_data)
-
-            elif kwargs.get('task_type') == "background removal":
-                input_image=load_and_resize_image(source_image)
-                body = json.dumps({
-                    "taskType": "BACKGROUND_REMOVAL",
-                    "backgroundRemovalParams": {
-                    "image": input_image,
-                    }
-                })
-            else:
-                return 1, "parameters error, please check again!"
-
-        else:
-            raise ValueError(f"Unsupported model_id: {model_id}")
-
-        seeds, image_bytes = generate_image_request(model_id=model_id, body=body)
+        # only text to image latencies are comparable across the models the router picks from
+        text_to_image = not source_image and kwargs.get('task_type', 'image generation') == 'image generation'
+        seeds, image_bytes = generate_image_request(model_id=model_id, body=body, observe=text_to_image)
         image = Image.open(io.BytesIO(image_bytes))
         
         if source_image:
@@ -173,50 +171,345 @@ def generate_or_vary_image(model_id, positive_prompt=None, negative_prompt='low
         logger.error(f"An unexpected error occurred: {str(err)}")
         return 1, f"Unexpected error: {str(err)}"
 
-def load_and_resize_image(image_path, max_size=1408):
-    with Image.open(image_path) as img:
-        # 如果图片的宽度或高度超过max_size，就进行缩放
-        if img.width > max_size or img.height > max_size:
-            # 计算缩放比例
-            scale = max_size / max(img.width, img.height)
-            new_size = (int(img.width * scale), int(img.height * scale))
-            img = img.resize(new_size, Image.LANCZOS)
 
-        # 将图片转换为PNG格式的字节流
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
+def build_request_body(model_id, positive_prompt=None, negative_prompt='low quality', source_image=None, **kwargs):
+    """
+    Build the invoke_model body of an image generation / variation request, see generate_or_vary_image.
+
+    Returns:
+        str: JSON body, or None if the Titan task type is unknown.
+
+    Raises:
+        ValueError: if the model is not supported.
+    """
+    if model_id.startswith('stability'):
+        request_data = {
+            "prompt": positive_prompt,
+            "negative_prompt": negative_prompt,
+            "mode": kwargs.get('mode', "text-to-image") ,
+            "aspect_ratio": kwargs.get('aspect_ratio', "1:1") ,
+            "seed": kwargs.get('seed', 0),
+            "output_format": kwargs.get('output_format', 'png'),
+        }
+        if source_image and model_id == "stability.sd3-large-v1:0":
+            # Image variation mode
+            request_data.pop('aspect_ratio', None)
+            request_data.update({
+                "mode": "image-to-image",
+                "strength": kwargs.get('strength', 1),
+            })
+            
+            with open(source_image, "rb") as image_file:
+                request_data["image"] = base64.b64encode(image_file.read()).decode("utf-8")
+
+        body = json.dumps(request_data)
+        
+    elif model_id == 'amazon.titan-image-generator-v2:0':
+        print(f"task_type is {kwargs.get('task_type')}")
+        print(f"prompt is: {positive_prompt}")
+        print(f"color_list is: {kwargs.get('color_list')}")
+        if kwargs.get('task_type') == "image generation":
+            body = json.dumps({
+                "taskType": "TEXT_IMAGE",
+                "textToImageParams": {
+                    "text": positive_prompt,
+                    "negativeText": negative_prompt
+                },
+                "imageGenerationConfig": {
+                    "numberOfImages": kwargs.get('numberOfImages', 1),
+                    "height": kwargs.get('height', 1024),
+                    "width": kwargs.get('width', 1024),
+                    "cfgScale": kwargs.get('cfgScale', 8.0),
+                    "seed": kwargs.get('seed', 0)
+                }
+            })
+        elif kwargs.get('task_type') == "color_guided_titan":
+            print("start color guided titan11")
+            print(kwargs.get('color_list'))
+            color_list = kwargs.get('color_list')
+            request_data = {
+                "taskType": "COLOR_GUIDED_GENERATION",
+                "colorGuidedGenerationParams": {
+                    "text": positive_prompt, # sample: a jar of salad dressing in a rustic kitchen surrounded by fresh vegetables with studio lighting
+                    "negativeText": negative_prompt,
+                    "colors": color_list # '#ff8080', '#ffb280', '#ffe680', '#e5ff80'
+                },
+                "imageGenerationConfig": {
+                "numberOfImages": 1,
+                "height": 512,
+                "width": 512,
+                "cfgScale": 8.0
+                }
+            }
+            if source_image:
+                input_image=prepare_image_base64(source_image, max_size=1408, target='titan')
+                request_data["colorGuidedGenerationParams"]["referenceImage"] = input_image
+            body = json.dumps(request_data)
+
+        elif kwargs.get('task_type') == "background removal":
+            input_image=prepare_image_base64(source_image, max_size=1408, target='titan')
+            body = json.dumps({
+                "taskType": "BACKGROUND_REMOVAL",
+                "backgroundRemovalParams": {
+                "image": input_image,
+                }
+            })
+        else:
+            return None
+
+    else:
+        raise ValueError(f"Unsupported model_id: {model_id}")
+
+    return body
+
+
+@dataclass(slots=True)
+class BatchImageResult:
+    prompt_index: int
+    prompt: str
+    model_id: str
+    variant: int
+    status: int  # 0 for success, 1 for failure
+    result: str  # file path or error message
+
+
+def _batch_requests(prompts, model_ids, variants, seed):
+    """
+    Split a batch into invoke_model requests: Titan renders up to TITAN_MAX_IMAGES_PER_REQUEST variants
+    per request (`numberOfImages`), Stability models one.
+
+    Yields:
+        tuple: (prompt index, prompt, model id, first variant, number of images, seed)
+    """
+    for prompt_index, prompt in enumerate(prompts):
+        for model_id in model_ids:
+            per_request = TITAN_MAX_IMAGES_PER_REQUEST if model_id.startswith('amazon.titan') else 1
+            for first in range(0, variants, per_request):
+                count = min(per_request, variants - first)
+                # seed 0 is random for Stability models, other seeds are offset so that variants differ
+                yield prompt_index, prompt, model_id, first, count, (seed + first if seed or per_request > 1 else 0)
+
+
+def _generate_batch_request(prompt_index, prompt, model_id, first, count, seed, negative_prompt, kwargs):
+    try:
+        body = build_request_body(model_id, prompt, negative_prompt, task_type='image generation',
+                                  numberOfImages=count, seed=seed, **kwargs)
+        # multi image Titan requests would skew the single image latencies of the router
+        _, images_bytes = generate_images_request(model_id, body, observe=count == 1)
+        results = []
+        for i, image_bytes in enumerate(images_bytes[:count]):
+            file_path = save_image(Image.open(io.BytesIO(image_bytes)), "text2image")
+            results.append((first + i, 0, file_path) if file_path else (first + i, 1, "Failed to save image"))
+        return results
+    except (ClientError, ImageError, ValueError) as err:
+        logger.error(f"Error occurred: {str(err)}")
+        error = f"{type(err).__name__}: {str(err)}"
+    except Exception as err:
+        logger.error(f"An unexpected error occurred: {str(err)}")
+        error = f"Unexpected error: {str(err)}"
+    return [(first + i, 1, error) for i in range(count)]
+
+
+def generate_image_batch(prompts, model_ids, variants=1, negative_prompt='low quality', seed=0,
+                         max_concurrency=IMAGE_BATCH_MAX_CONCURRENCY, **kwargs):
+    """
+    Generate `variants` images of every prompt with every model, all requests in flight at once.
+
+    Requests are throttled by the per model rate limiter, Titan variants are batched with `numberOfImages`.
+
+    Args:
+        prompts (list): positive prompts.
+        model_ids (list): models to render every prompt with.
+        variants (int): images per prompt and model.
+        negative_prompt (str): The negative prompt for image generation.
+        seed (int): seed of the first variant, 0 for random (Stability).
+        max_concurrency (int): max number of requests in flight at the same time.
+        **kwargs: Additional parameters, see generate_or_vary_image.
+
+    Yields:
+        BatchImageResult: one per image, in completion order.
+    """
+    requests = list(_batch_requests(prompts, model_ids, variants, seed))
+    if not requests:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(len(requests), max_concurrency))) as executor:
+        futures = {executor.submit(_generate_batch_request, *request, negative_prompt, kwargs): request
+                   for request in requests}
+        for future in as_completed(futures):
+            prompt_index, prompt, model_id = futures[future][:3]
+            for variant, status, result in future.result():
+                yield BatchImageResult(prompt_index, prompt, model_id, variant, status, result)
+
+
+class ImageModelRouter:
+    """
+    Rolling latency / error statistics of the image models, and their ranking by routing policy:
+
+    fastest   lowest median latency
+    cheapest  lowest price, then lowest median latency
+    quality   best quality among the models whose p95 latency is within the SLA, then the fastest
+
+    Models failing more than ROUTER_MAX_ERROR_RATE of their recent calls are ranked last. Calls older than
+    max_age_s are forgotten, and probe() picks a model whose statistics are the oldest, so a model ranked
+    last after a bad window is measured again and can recover.
+    """
+
+    def __init__(self, window=ROUTER_WINDOW, max_age_s=ROUTER_MAX_AGE_S):
+        self.window = window
+        self.max_age_s = max_age_s
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model_id, latency_s, ok):
+        with self._lock:
+            self._calls.setdefault(model_id, deque(maxlen=self.window)).append((time.monotonic(), latency_s, ok))
+
+    def _recent(self, model_id):
+        not_before = time.monotonic() - self.max_age_s
+        with self._lock:
+            return [(at, latency, ok) for at, latency, ok in self._calls.get(model_id, ()) if at >= not_before]
+
+    def stats(self, model_id):
+        """
+        Returns:
+            dict: calls, error_rate, p50_s and p95_s of the recent calls (profile latency if none succeeded).
+        """
+        calls = [(latency, ok) for _, latency, ok in self._recent(model_id)]
+        latencies = sorted(latency for latency, ok in calls if ok)
+        default = IMAGE_MODEL_PROFILES.get(model_id, {}).get("latency_s", ROUTER_SLA_S)
+        return {
+            "calls": len(calls),
+            "error_rate": round(sum(not ok for _, ok in calls) / len(calls), 3) if calls else 0.0,
+            "p50_s": round(latencies[len(latencies) // 2], 3) if latencies else default,
+            "p95_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else default,
+        }
+
+    def rank(self, policy="fastest", candidates=None, sla_s=ROUTER_SLA_S):
+        """
+        Args:
+            policy (str): one of ROUTER_POLICIES
+            candidates (list, optional): model ids, defaults to every model of IMAGE_MODEL_PROFILES
+            sla_s (float): p95 latency limit of the quality policy
+
+        Returns:
+            list: model ids, best first
+        """
+        if policy not in ROUTER_POLICIES:
+            raise ValueError(f"Unsupported routing policy: {policy}")
+        candidates = list(candidates or IMAGE_MODEL_PROFILES)
+        stats = {model_id: self.stats(model_id) for model_id in candidates}
+
+        def key(model_id):
+            model_stats, profile = stats[model_id], IMAGE_MODEL_PROFILES.get(model_id, {})
+            unhealthy = model_stats["calls"] >= _ROUTER_MIN_CALLS and model_stats["error_rate"] > ROUTER_MAX_ERROR_RATE
+            if policy == "cheapest":
+                return unhealthy, profile.get("cost", float("inf")), model_stats["p50_s"]
+            if policy == "quality":
+                return unhealthy, model_stats["p95_s"] > sla_s, -profile.get("quality", 0), model_stats["p50_s"]
+            return unhealthy, model_stats["p50_s"]
+
+        return sorted(candidates, key=key)
+
+    def probe(self, ranking):
+        """
+        Returns:
+            str: the model after the first one in `ranking` whose last recent call is the oldest (never
+            called first), or None if there is nothing to probe.
+        """
+        if len(ranking) < 2:
+            return None
+        last_call = {model_id: max((at for at, _, _ in self._recent(model_id)), default=float("-inf"))
+                     for model_id in ranking[1:]}
+        return min(ranking[1:], key=lambda model_id: last_call[model_id])
+
+
+_router = ImageModelRouter()
+
+
+def get_image_router():
+    """
+    Return the process wide image model router.
+    """
+    return _router
+
+
+def route_image_generation(positive_prompt, negative_prompt='low quality', policy="fastest", candidates=None,
+                           sla_s=ROUTER_SLA_S, **kwargs):
+    """
+    Generate an image from text with the model picked by a routing policy, falling back to the next model
+    when one is throttled, fails with a transient error or returns an ImageError. Throttled and failed
+    requests are not retried, except on the last model. A share of ROUTER_PROBE_RATE requests is sent first to the model with the oldest statistics.
+
+    Args:
+        positive_prompt (str): The positive prompt for image generation.
+        negative_prompt (str): The negative prompt for image generation.
+        policy (str): fastest / cheapest / quality, see ImageModelRouter.
+        candidates (list, optional): model ids to choose from.
+        sla_s (float): p95 latency limit of the quality policy.
+        **kwargs: Additional parameters, see generate_or_vary_image.
+
+    Returns:
+        tuple: status code (0 for success, 1 for failure), result (file path or error message) and the
+        routing metadata: policy, ranking, chosen model_id, attempts and the statistics the decision used.
+    """
+    router = get_image_router()
+    ranking = router.rank(policy, candidates, sla_s)
+    probe = router.probe(ranking) if random.random() < ROUTER_PROBE_RATE else None
+    if probe:
+        ranking = [probe] + [model_id for model_id in ranking if model_id != probe]
+    metadata = {
+        "policy": policy,
+        "ranking": ranking,
+        "probe": probe,
+        "model_id": None,
+        "attempts": [],
+        "stats": {model_id: router.stats(model_id) for model_id in ranking},
+    }
+    error = None
+    for i, model_id in enumerate(ranking):
+        start = time.perf_counter()
+        try:
+            body = build_request_body(model_id, positive_prompt, negative_prompt, task_type='image generation', **kwargs)
+            # fail fast on throttling and transient errors while there is another model to fall back to
+            max_attempts = RETRY_MAX_ATTEMPTS if i == len(ranking) - 1 else 1
+            _, image_bytes = generate_image_request(model_id, body, max_attempts=max_attempts)
+            file_path = save_image(Image.open(io.BytesIO(image_bytes)), "text2image")
+        except (ClientError, BotoCoreError, ImageError) as err:
+            error = f"{type(err).__name__}: {str(err)}"
+            metadata["attempts"].append({"model_id": model_id, "error": error,
+                                         "latency_ms": int((time.perf_counter() - start) * 1000)})
+            if isinstance(err, ImageError) or is_throttling_error(err) or is_transient_error(err):
+                logger.warning(f"{model_id} failed ({error}), falling back to the next model")
+                continue
+            return 1, error, metadata
+        except Exception as err:
+            logger.error(f"An unexpected error occurred: {str(err)}")
+            return 1, f"Unexpected error: {str(err)}", metadata
+
+        metadata["attempts"].append({"model_id": model_id, "error": None,
+                                     "latency_ms": int((time.perf_counter() - start) * 1000)})
+        metadata["model_id"] = model_id
+        logger.info(f"Routed image generation ({policy}) to {model_id}")
+        return (0, file_path, metadata) if file_path else (1, "Failed to save image", metadata)
+
+    return 1, f"All models failed, last error: {error}", metadata
 
-        # 进行base64编码
-        encoded_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        return encoded_image
 
 def save_image(image, prefix="generated_image"):
     """
-    保存图像到指定文件夹。
+    保存图像到指定文件夹（内容寻址存储，后台写入，见 utils/image_store.py）。
 
     参数:
     image (PIL.Image): 要保存的图像
-    prefix (str): 文件名前缀
+    prefix (str): 图像类型，仅用于日志
 
     返回:
     str: 保存的文件路径，如果保存失败则返回 None
     """
     try:
-        # 从环境变量获取保存文件夹路径
-        save_folder = os.getenv("save_folder", "generated_images")
-        
-        # 确保保存目录存在
-        os.makedirs(save_folder, exist_ok=True)
-
-        # 生成唯一的文件名
-        epoch_time = int(time.time())
-        file_name = f"{prefix}_{epoch_time}.png"
-        file_path = os.path.join(save_folder, file_name)
-
-        # 保存图像
-        image.save(file_path)
-        logger.info(f"Image saved as {file_path}")
-
+        # 保存到 save_folder 环境变量指定的文件夹
+        file_path = get_image_store().put(image)
+        logger.info(f"{prefix} image queued as {file_path}")
         return file_path
 
     except Exception as err:
@@ -0,0 +1,183 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+
+from dotenv import load_dotenv
+
+from utils.image_generation import generate_image_batch, generate_or_vary_image, route_image_generation
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# image generation job queue settings, can be overridden in .env
+IMAGE_JOB_WORKERS = int(os.getenv("image_job_workers", 4))
+# finished jobs kept for polling, the oldest are dropped first
+IMAGE_JOB_MAX_FINISHED = int(os.getenv("image_job_max_finished", 500))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass(slots=True)
+class ImageJob:
+    id: str
+    kind: str  # single | batch | routed
+    model_id: str
+    status: str = QUEUED
+    progress: float = 0.0
+    total: int = 1
+    results: list = field(default_factory=list)  # file paths, in completion order
+    errors: list = field(default_factory=list)
+    images: list = field(default_factory=list)  # BatchImageResult of batch jobs, in completion order
+    metadata: dict = field(default_factory=dict)  # routing decision of routed jobs
+    created_at: float = field(default_factory=time.time)
+    started_at: float = None
+    finished_at: float = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    @property
+    def result(self):
+        return self.results[0] if self.results else None
+
+
+class ImageJobQueue:
+    """
+    In-process queue of image generation jobs run by background worker threads.
+
+    submit() returns a job id at once, get() returns a snapshot of the job state, so pages poll
+    without blocking and keep accepting requests while earlier ones are in flight. Jobs live in
+    the Streamlit server process and are shared by every session.
+    """
+
+    def __init__(self, workers=IMAGE_JOB_WORKERS, max_finished=IMAGE_JOB_MAX_FINISHED):
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"image-job-{i}", daemon=True).start()
+
+    def _add(self, job, task):
+        with self._lock:
+            self._jobs[job.id] = job
+        self._queue.put((job, task))
+        logger.info(f"Image job {job.id} queued ({job.kind}, {job.model_id})")
+        return job.id
+
+    def submit(self, model_id, **kwargs):
+        """
+        Queue one generation / variation / color guided / background removal, see generate_or_vary_image.
+
+        Returns:
+            str: job id
+        """
+        job = ImageJob(id=uuid.uuid4().hex, kind="single", model_id=model_id)
+        return self._add(job, lambda: self._run_single(job, model_id, kwargs))
+
+    def submit_routed(self, positive_prompt, policy="fastest", **kwargs):
+        """
+        Queue a text to image generation on the model picked by the router, see route_image_generation.
+
+        Returns:
+            str: job id
+        """
+        job = ImageJob(id=uuid.uuid4().hex, kind="routed", model_id=f"auto:{policy}")
+        return self._add(job, lambda: self._run_routed(job, positive_prompt, policy, kwargs))
+
+    def submit_batch(self, prompts, model_ids, variants=1, **kwargs):
+        """
+        Queue a batch generation, see generate_image_batch. Progress is updated as images complete.
+
+        Returns:
+            str: job id
+        """
+        job = ImageJob(id=uuid.uuid4().hex, kind="batch", model_id=",".join(model_ids),
+                       total=len(prompts) * len(model_ids) * variants)
+        return self._add(job, lambda: self._run_batch(job, prompts, model_ids, variants, kwargs))
+
+    def _run_single(self, job, model_id, kwargs):
+        status, result = generate_or_vary_image(model_id, **kwargs)
+        with self._lock:
+            (job.results if status == 0 else job.errors).append(result)
+
+    def _run_routed(self, job, positive_prompt, policy, kwargs):
+        status, result, metadata = route_image_generation(positive_prompt, policy=policy, **kwargs)
+        with self._lock:
+            (job.results if status == 0 else job.errors).append(result)
+            job.metadata = metadata
+            job.model_id = metadata["model_id"] or job.model_id
+
+    def _run_batch(self, job, prompts, model_ids, variants, kwargs):
+        for done, image in enumerate(generate_image_batch(prompts, model_ids, variants, **kwargs), start=1):
+            with self._lock:
+                (job.results if image.status == 0 else job.errors).append(image.result)
+                job.images.append(image)
+                job.progress = done / job.total
+
+    def _work(self):
+        while True:
+            job, task = self._queue.get()
+            with self._lock:
+                job.status, job.started_at = RUNNING, time.time()
+            try:
+                task()
+            except Exception as err:
+                logger.error(f"Image job {job.id} failed: {str(err)}")
+                with self._lock:
+                    job.errors.append(f"Unexpected error: {str(err)}")
+            with self._lock:
+                job.status = DONE if job.results else FAILED
+                job.progress, job.finished_at = 1.0, time.time()
+                self._evict()
+            logger.info(f"Image job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s")
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """
+        Returns:
+            ImageJob: snapshot of the job, or None if unknown (or dropped).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return replace(job, results=list(job.results), errors=list(job.errors), images=list(job.images),
+                           metadata=dict(job.metadata)) if job else None
+
+    def pending(self):
+        """
+        Returns:
+            int: number of queued or running jobs.
+        """
+        with self._lock:
+            return sum(not job.finished for job in self._jobs.values())
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_image_job_queue():
+    """
+    Return the process wide image job queue, starting its workers on first use.
+    """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = ImageJobQueue()
+    return _queue
@@ -0,0 +1,179 @@
+import base64
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from PIL import Image
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# max number of prepared images kept in memory, can be overridden in .env
+IMAGE_PREPROCESS_CACHE_ENTRIES = int(os.getenv("image_preprocess_cache_entries", 64))
+
+# output codec per target model family: formats the model accepts, and the encoder settings of the
+# cheapest one that keeps enough detail for it
+IMAGE_CODECS = {
+    # Claude (Converse API) accepts png / jpeg / gif / webp, lossy webp is the smallest
+    "claude": {"accepts": ("png", "jpeg", "gif", "webp"), "format": "webp", "params": {"quality": 85, "method": 2}},
+    # Titan Image Generator only takes png / jpeg input images
+    "titan": {"accepts": ("png", "jpeg"), "format": "jpeg", "params": {"quality": 95}},
+}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def fit_size(size, max_size):
+    """
+    Size of an image scaled down so that its longest side is at most max_size, keeping the aspect ratio.
+
+    Args:
+        size (tuple): (width, height)
+        max_size (int): max width / height
+
+    Returns:
+        tuple: (width, height), unchanged if the image already fits.
+    """
+    width, height = size
+    if width <= max_size and height <= max_size:
+        return width, height
+    if width > height:
+        return max_size, max(1, int(height * (max_size / width)))
+    return max(1, int(width * (max_size / height))), max_size
+
+
+def load_image(image_path, max_size):
+    """
+    Decode an image at (close to) its target size.
+
+    JPEG is decoded directly at a reduced DCT scale (Image.draft), other formats are first shrunk by an integer
+    factor (Image.reduce) so the final LANCZOS resize only works on a little more than the target resolution.
+
+    Args:
+        image_path (str or file): image file
+        max_size (int): max width / height of the result
+
+    Returns:
+        tuple: (PIL.Image, source format in lower case, True if the image was downscaled)
+    """
+    img = Image.open(image_path)
+    img_format = img.format.lower()
+    size = fit_size(img.size, max_size)
+    resized = size != img.size
+    if resized:
+        img = downscale(img, size)
+    else:
+        img.load()
+    return img, img_format, resized
+
+
+def downscale(img, size):
+    """
+    Downscale a lazily opened image, see load_image.
+
+    Args:
+        img (PIL.Image): image from Image.open, not decoded yet for the JPEG draft mode to apply
+        size (tuple): (width, height) of the result
+
+    Returns:
+        PIL.Image
+    """
+    # keeps the decoded image at least as large as the target
+    img.draft(None, size)
+    factor = min(img.width // size[0], img.height // size[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img.resize(size, resample=Image.Resampling.LANCZOS)
+
+
+def _has_alpha(img):
+    """
+    True if the image has transparent pixels, a fully opaque alpha channel doesn't count.
+    """
+    if img.mode in ("RGBA", "LA", "PA"):
+        return img.getchannel("A").getextrema()[0] < 255
+    return img.mode == "P" and "transparency" in img.info
+
+
+def encode_image(img, target="claude"):
+    """
+    Encode an image with the cheapest codec accepted by the target model.
+
+    Args:
+        img (PIL.Image): image to encode
+        target (str): model family, a key of IMAGE_CODECS
+
+    Returns:
+        tuple: (image bytes, format)
+    """
+    codec = IMAGE_CODECS[target]
+    img_format, params = codec["format"], codec["params"]
+    if img_format == "jpeg" and _has_alpha(img):
+        # jpeg has no alpha channel, keep transparency lossless
+        img_format, params = "png", {"optimize": True}
+    if img_format in ("jpeg", "webp") and img.mode not in ("RGB", "L"):
+        img = img.convert("RGBA" if img_format == "webp" and _has_alpha(img) else "RGB")
+
+    buffered = io.BytesIO()
+    img.save(buffered, format=img_format, **params)
+    return buffered.getvalue(), img_format
+
+
+def prepare_image(image_path, max_size=1568, target="claude"):
+    """
+    Read, downscale and encode an image for a model request, in a single decode.
+
+    If the image needs no resizing and its original encoding is accepted by the target model and smaller
+    than the re-encoded one, the original bytes are sent unchanged.
+    Results are memoized by (file content hash, max_size, target).
+
+    Args:
+        image_path (str): image file
+        max_size (int): max width / height
+        target (str): model family, a key of IMAGE_CODECS
+
+    Returns:
+        tuple: (image bytes, format), format is a Converse API image format (png / jpeg / gif / webp).
+    """
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+    key = (hashlib.sha256(image_bytes).hexdigest(), max_size, target)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    img, source_format, resized = load_image(io.BytesIO(image_bytes), max_size)
+    result = encode_image(img, target)
+    if not resized and source_format in IMAGE_CODECS[target]["accepts"] and len(image_bytes) <= len(result[0]):
+        result = (image_bytes, source_format)
+    logger.debug(f"Prepared {image_path} for {target}: {len(image_bytes)} -> {len(result[0])} bytes ({result[1]})")
+
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > IMAGE_PREPROCESS_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return result
+
+
+def prepare_image_base64(image_path, max_size=1408, target="titan"):
+    """
+    prepare_image, base64 encoded for JSON request bodies (InvokeModel).
+
+    Returns:
+        str: base64 encoded image
+    """
+    image_bytes, _ = prepare_image(image_path, max_size, target)
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,344 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from utils.image_preprocess import downscale
+
+try:
+    # registers the AVIF codec with Pillow
+    import pillow_avif  # noqa: F401
+    AVIF_SUPPORTED = True
+except ImportError:
+    AVIF_SUPPORTED = False
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# generated image store settings, can be overridden in .env
+IMAGE_STORE_FORMAT = os.getenv("image_store_format", "png")  # png | webp | avif
+IMAGE_STORE_QUALITY = int(os.getenv("image_store_quality", 90))
+# longest edge of the thumbnail written next to every image, the largest size the pages display
+THUMBNAIL_SIZE = int(os.getenv("image_thumbnail_size", 768))
+IMAGE_STORE_WRITERS = int(os.getenv("image_store_writers", 2))
+# resized images shown by the pages: max number kept in memory, the folder of their disk copies and the
+# max number of disk copies, the least recently used are deleted first
+DISPLAY_CACHE_ENTRIES = int(os.getenv("display_cache_entries", 128))
+DISPLAY_CACHE_PATH = os.getenv("display_cache_path", ".cache/display")
+DISPLAY_CACHE_MAX_FILES = int(os.getenv("display_cache_max_files", 2000))
+
+THUMBNAIL_SUFFIX = ".thumb.webp"
+_EXTENSIONS = {"png": ".png", "webp": ".webp", "avif": ".avif"}
+
+
+def _digest(image):
+    """
+    sha256 of the decoded pixels, so the same image gets the same name whatever its encoding
+    """
+    sha = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("ascii"))
+    sha.update(image.tobytes())
+    return sha.hexdigest()
+
+
+def thumbnail_path(path):
+    """
+    Returns:
+        str: path of the thumbnail of a stored image.
+    """
+    return os.path.splitext(str(path))[0] + THUMBNAIL_SUFFIX
+
+
+class _Pending:
+    __slots__ = ("image", "thumbnail_ready", "future")
+
+    def __init__(self, image):
+        self.image = image
+        self.thumbnail_ready = threading.Event()
+        self.future = None
+
+
+class ImageStore:
+    """
+    Content addressed store of generated images.
+
+    Images are named by the hash of their pixels and sharded in two directory levels
+    (`<root>/ab/cd/abcd....png`), so concurrent generations never overwrite each other and the
+    same image is stored once. put() returns the final path at once: encoding and writing happen
+    on background writer threads, the thumbnail first. Until written, open() and
+    open_thumbnail() serve the image from memory. A failed write is kept: open(), open_thumbnail()
+    and wait() raise its error until the image is put again, which retries the write.
+    """
+
+    def __init__(self, root, fmt=IMAGE_STORE_FORMAT, quality=IMAGE_STORE_QUALITY, thumbnail_size=THUMBNAIL_SIZE,
+                 writers=IMAGE_STORE_WRITERS):
+        if fmt == "avif" and not AVIF_SUPPORTED:
+            logger.warning("pillow-avif-plugin is not installed, storing images as WebP")
+            fmt = "webp"
+        if fmt not in _EXTENSIONS:
+            raise ValueError(f"Unsupported image store format: {fmt}")
+        self.root = root
+        self.fmt = fmt
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=writers, thread_name_prefix="image-store")
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + _EXTENSIONS[self.fmt])
+
+    def put(self, image):
+        """
+        Store an image, writing it in the background.
+
+        Args:
+            image (PIL.Image): generated image.
+
+        Returns:
+            str: path of the stored image.
+        """
+        image.load()
+        path = self.path_for(_digest(image))
+        with self._lock:
+            pending = self._pending.get(path)
+            if pending is not None and not self._failed(pending):
+                return path
+            if pending is None and os.path.exists(path):
+                return path
+            pending = self._pending[path] = _Pending(image)
+            pending.future = self._executor.submit(self._write, path, pending)
+        return path
+
+    def _write(self, path, pending):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            thumbnail = pending.image if pending.image.mode in ("RGB", "RGBA") else pending.image.convert("RGBA")
+            thumbnail = thumbnail.copy()
+            thumbnail.thumbnail((self.thumbnail_size, self.thumbnail_size), Image.LANCZOS)
+            self._save(thumbnail, thumbnail_path(path), "WEBP", quality=80, method=2)
+            pending.thumbnail_ready.set()
+
+            if self.fmt == "png":
+                self._save(pending.image, path, "PNG")
+            else:
+                image = pending.image if pending.image.mode in ("RGB", "RGBA") else pending.image.convert("RGBA")
+                self._save(image, path, self.fmt.upper(), quality=self.quality)
+            logger.info(f"Image saved as {path}")
+        except Exception as err:
+            logger.error(f"Failed to save image {path}: {str(err)}")
+            raise
+        else:
+            with self._lock:
+                self._pending.pop(path, None)
+        finally:
+            pending.thumbnail_ready.set()
+
+    @staticmethod
+    def _failed(pending):
+        return pending.future.done() and pending.future.exception() is not None
+
+    def _get_pending(self, path):
+        """
+        The pending write of a path, or None once written. Raises the error of a failed write.
+        """
+        with self._lock:
+            pending = self._pending.get(str(path))
+        if pending is not None and self._failed(pending):
+            pending.future.result()
+        return pending
+
+    @staticmethod
+    def _save(image, path, fmt, **params):
+        # write then rename, readers never see a partial file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, format=fmt, **params)
+        os.replace(tmp_path, path)
+
+    def open(self, path):
+        """
+        Open a stored image, from memory while its write is pending.
+
+        Returns:
+            PIL.Image
+        """
+        pending = self._get_pending(path)
+        if pending is not None:
+            return pending.image.copy()
+        return Image.open(path)
+
+    def open_thumbnail(self, path):
+        """
+        Open the thumbnail of a stored image, or None if the image has no thumbnail (e.g. an upload).
+
+        Returns:
+            PIL.Image
+        """
+        pending = self._get_pending(path)
+        if pending is not None:
+            pending.thumbnail_ready.wait()
+        try:
+            return Image.open(thumbnail_path(path))
+        except FileNotFoundError:
+            if pending is not None:
+                # the thumbnail write failed, raise its error
+                pending.future.result()
+            return None
+
+    def wait(self, path):
+        """
+        Block until a stored image is written.
+
+        Raises:
+            Exception: the write error, if any.
+        """
+        pending = self._get_pending(path)
+        if pending is not None:
+            pending.future.result()
+
+    def read_bytes(self, path):
+        """
+        Returns:
+            bytes: encoded stored image, e.g. for a download button.
+        """
+        self.wait(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def flush(self):
+        """
+        Block until every pending image is written.
+        """
+        with self._lock:
+            futures = [pending.future for pending in self._pending.values()]
+        for future in futures:
+            future.result()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_image_store(root=None):
+    """
+    Return the shared image store of a folder, by default the `save_folder` env variable.
+    """
+    root = root or os.getenv("save_folder", "generated_images")
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = ImageStore(root)
+        return _stores[root]
+
+
+_display_cache = OrderedDict()
+_display_lock = threading.Lock()
+# disk copies are evicted on the first write, then every _DISPLAY_EVICT_EVERY writes, so the folder
+# may exceed DISPLAY_CACHE_MAX_FILES by up to 10% in between
+_DISPLAY_EVICT_EVERY = max(1, DISPLAY_CACHE_MAX_FILES // 10)
+_display_writes = 0
+
+
+def _fit_width(img, width):
+    if img.width <= width:
+        img.load()
+        return img
+    return downscale(img, (width, max(1, round(img.height * width / img.width))))
+
+
+def _display_cache_put(key, img):
+    with _display_lock:
+        _display_cache[key] = img
+        _display_cache.move_to_end(key)
+        while len(_display_cache) > DISPLAY_CACHE_ENTRIES:
+            _display_cache.popitem(last=False)
+
+
+def _display_file_written():
+    global _display_writes
+    with _display_lock:
+        _display_writes += 1
+        evict = (_display_writes - 1) % _DISPLAY_EVICT_EVERY == 0
+    if evict:
+        _evict_display_files()
+
+
+def _evict_display_files():
+    entries = []
+    with os.scandir(DISPLAY_CACHE_PATH) as it:
+        for entry in it:
+            try:
+                if entry.name.endswith(".webp"):
+                    entries.append((entry.stat().st_mtime_ns, entry.path))
+            except FileNotFoundError:
+                pass
+    for _, path in sorted(entries)[:max(0, len(entries) - DISPLAY_CACHE_MAX_FILES)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_display_image(image, width):
+    """
+    Return an image scaled down to a display width, cached by (path, mtime, width) in memory and on disk.
+
+    A stored image's thumbnail is used as is when it has the display width, otherwise the image is scaled
+    from the original (decoded at a reduced scale with Image.draft for JPEG), so the disk copy is encoded
+    once. Uploaded files and images still being written are not cached.
+
+    Args:
+        image (str, Path or file): image path, or an uploaded file
+        width (int): max width
+
+    Returns:
+        PIL.Image: the image, narrower than `width` if the original is.
+    """
+    if not isinstance(image, (str, Path)):
+        return _fit_width(Image.open(image), width)
+
+    path = str(image)
+    store = get_image_store()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        # write still pending in the image store
+        thumbnail = store.open_thumbnail(path)
+        return _fit_width(thumbnail if thumbnail is not None and thumbnail.width == width else store.open(path), width)
+
+    key = (os.path.abspath(path), mtime, width)
+    with _display_lock:
+        img = _display_cache.get(key)
+        if img is not None:
+            _display_cache.move_to_end(key)
+            return img
+
+    cache_path = os.path.join(DISPLAY_CACHE_PATH, hashlib.sha256(repr(key).encode("utf-8")).hexdigest() + ".webp")
+    try:
+        img = Image.open(cache_path)
+        img.load()
+        # mark as recently used for the eviction of disk copies
+        os.utime(cache_path)
+    except FileNotFoundError:
+        thumbnail = store.open_thumbnail(path)
+        if thumbnail is not None and thumbnail.width == width:
+            # already on disk at the display width
+            img = thumbnail
+            img.load()
+        else:
+            original = Image.open(path)
+            img = _fit_width(original, width)
+            if img is not original:
+                if img.mode not in ("RGB", "RGBA"):
+                    img = img.convert("RGBA")
+                os.makedirs(DISPLAY_CACHE_PATH, exist_ok=True)
+                ImageStore._save(img, cache_path, "WEBP", quality=90, method=2)
+                _display_file_written()
+    _display_cache_put(key, img)
+    return img
@@ -0,0 +1,245 @@
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+import numpy as np
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+try:
+    import prometheus_client
+except ImportError:  # optional, records are still kept in memory and logged as JSON
+    prometheus_client = None
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# number of recent call records kept in memory for the admin page, can be overridden in .env
+CALL_RECORDS_MAX = int(os.getenv("instrumentation_max_records", 5000))
+# port of the Prometheus /metrics endpoint, disabled if empty
+METRICS_PORT = os.getenv("metrics_port", "")
+
+# modules that wrap model calls, skipped when looking for the call site
+_WRAPPER_MODULES = ("utils.instrumentation", "utils.response_cache", "utils.rate_limiter", "utils.async_bedrock",
+                    "contextlib", "concurrent.futures.thread", "threading")
+
+# invoke_model reports usage and latency in response headers
+_INVOKE_LATENCY_HEADER = "x-amzn-bedrock-invocation-latency"
+_INVOKE_INPUT_TOKENS_HEADER = "x-amzn-bedrock-input-token-count"
+_INVOKE_OUTPUT_TOKENS_HEADER = "x-amzn-bedrock-output-token-count"
+
+
+@dataclass(slots=True)
+class CallRecord:
+    model_id: str
+    call_site: str
+    operation: str
+    status: str = "ok"
+    prompt_bytes: int = 0
+    image_bytes: int = 0
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    server_latency_ms: Optional[int] = None
+    wall_time_ms: int = 0
+    timestamp: float = field(default_factory=time.time)
+
+
+_records = deque(maxlen=CALL_RECORDS_MAX)
+_records_lock = threading.Lock()
+
+
+def _metric(metric_type, name, *args, **kwargs):
+    """
+    Register a Prometheus metric once per process. importlib.reload keeps this module's globals, so the
+    collectors of the first import are reused. A fresh re-import (Streamlit drops modules whose source
+    changed) can't reach them: its metrics are then kept unregistered until the server restarts.
+    """
+    if name not in _METRICS:
+        try:
+            _METRICS[name] = metric_type(name, *args, **kwargs)
+        except ValueError:
+            logger.warning(f"Prometheus metric {name} is already registered, restart to export it again")
+            _METRICS[name] = metric_type(name, *args, registry=None, **kwargs)
+    return _METRICS[name]
+
+
+def _start_metrics_server(port):
+    global _metrics_server_started
+    if _metrics_server_started:
+        return
+    try:
+        prometheus_client.start_http_server(port)
+        logger.info(f"Serving Prometheus metrics on port {port}")
+    except OSError as err:
+        # already served by a previous import of this module (or by another process)
+        logger.info(f"Prometheus metrics port {port} not available: {err}")
+    _metrics_server_started = True
+
+
+# guarded against importlib.reload, which re-executes this module in the same namespace
+_METRICS = globals().get("_METRICS", {})
+_metrics_server_started = globals().get("_metrics_server_started", False)
+
+if prometheus_client is not None:
+    _LABELS = ("model_id", "call_site")
+    _CALLS = _metric(prometheus_client.Counter, "bedrock_calls", "Model invocations", _LABELS + ("status",))
+    _WALL_TIME = _metric(
+        prometheus_client.Histogram, "bedrock_call_wall_seconds", "Client wall time of model invocations", _LABELS,
+        buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120))
+    _SERVER_LATENCY = _metric(
+        prometheus_client.Histogram, "bedrock_call_server_latency_seconds", "Server side latency of model invocations",
+        _LABELS, buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120))
+    _TOKENS = _metric(prometheus_client.Counter, "bedrock_tokens", "Model tokens", _LABELS + ("direction",))
+    _PAYLOAD_BYTES = _metric(
+        prometheus_client.Counter, "bedrock_payload_bytes", "Request payload bytes", _LABELS + ("kind",))
+    if METRICS_PORT:
+        _start_metrics_server(int(METRICS_PORT))
+
+def _call_site():
+    """
+    module.function of the first caller outside the model call wrappers
+    """
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get("__name__", "").startswith(_WRAPPER_MODULES):
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    return f"{frame.f_globals.get('__name__', '').rsplit('.', 1)[-1]}.{frame.f_code.co_name}"
+
+
+def _export(record):
+    labels = {"model_id": record.model_id, "call_site": record.call_site}
+    _CALLS.labels(status=record.status, **labels).inc()
+    _WALL_TIME.labels(**labels).observe(record.wall_time_ms / 1000)
+    if record.server_latency_ms is not None:
+        _SERVER_LATENCY.labels(**labels).observe(record.server_latency_ms / 1000)
+    if record.input_tokens:
+        _TOKENS.labels(direction="input", **labels).inc(record.input_tokens)
+    if record.output_tokens:
+        _TOKENS.labels(direction="output", **labels).inc(record.output_tokens)
+    _PAYLOAD_BYTES.labels(kind="prompt", **labels).inc(record.prompt_bytes)
+    _PAYLOAD_BYTES.labels(kind="image", **labels).inc(record.image_bytes)
+
+
+def record_call(record):
+    """
+    Keep a call record for the admin page, log it as JSON and export it to Prometheus.
+
+    Args:
+        record (CallRecord): the finished call.
+    """
+    with _records_lock:
+        _records.append(record)
+    logger.info(json.dumps(asdict(record), ensure_ascii=False))
+    if prometheus_client is not None:
+        _export(record)
+
+
+@contextlib.contextmanager
+def instrument_call(model_id, operation, estimate=None, call_site=None):
+    """
+    Record one model invocation. The block fills the yielded dict with what the response reports:
+
+        with instrument_call(model_id, "converse", estimate) as call:
+            response = client.converse(...)
+            call.update(usage=response["usage"], latency_ms=response["metrics"]["latencyMs"])
+
+    Args:
+        model_id (str): model id.
+        operation (str): converse / converse_stream / invoke_model.
+        estimate (dict, optional): payload_estimator.estimate_request result, for the payload sizes.
+        call_site (str, optional): defaults to module.function of the caller.
+    """
+    record = CallRecord(model_id=model_id, call_site=call_site or _call_site(), operation=operation)
+    if estimate:
+        record.prompt_bytes = estimate.get("prompt_bytes", 0)
+        record.image_bytes = estimate.get("image_bytes", 0)
+    call = {}
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        record.status = (e.response.get("Error", {}).get("Code") if isinstance(e, ClientError) else None) or type(e).__name__
+        raise
+    except BaseException:
+        # e.g. a stream closed before its end
+        record.status = "cancelled"
+        raise
+    finally:
+        record.wall_time_ms = int((time.perf_counter() - start) * 1000)
+        usage = call.get("usage") or {}
+        record.input_tokens = usage.get("inputTokens", usage.get("input_tokens"))
+        record.output_tokens = usage.get("outputTokens", usage.get("output_tokens"))
+        record.server_latency_ms = call.get("latency_ms")
+        record_call(record)
+
+
+def invoke_model_metadata(response):
+    """
+    usage and server latency of an invoke_model response, from its headers
+
+    Returns:
+        dict: {"usage": {"input_tokens", "output_tokens"}, "latency_ms"}, for instrument_call
+    """
+    headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+
+    def header(name):
+        return int(headers[name]) if headers.get(name) else None
+
+    return {
+        "usage": {"input_tokens": header(_INVOKE_INPUT_TOKENS_HEADER), "output_tokens": header(_INVOKE_OUTPUT_TOKENS_HEADER)},
+        "latency_ms": header(_INVOKE_LATENCY_HEADER),
+    }
+
+
+def get_call_records():
+    """
+    Returns:
+        list: recent CallRecords, oldest first.
+    """
+    with _records_lock:
+        return list(_records)
+
+
+def summarize_calls(records, by="call_site"):
+    """
+    Latency percentiles and token totals of call records grouped by a CallRecord field.
+
+    Returns:
+        list: one dict per group, slowest p95 first.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(getattr(record, by), []).append(record)
+
+    def percentiles(values):
+        values = [value for value in values if value is not None]
+        return [int(p) for p in np.percentile(values, [50, 95])] if values else [None, None]
+
+    rows = []
+    for key, group in groups.items():
+        wall_p50, wall_p95 = percentiles([record.wall_time_ms for record in group])
+        server_p50, server_p95 = percentiles([record.server_latency_ms for record in group])
+        rows.append({
+            by: key,
+            "calls": len(group),
+            "errors": sum(record.status != "ok" for record in group),
+            "wall_p50_ms": wall_p50,
+            "wall_p95_ms": wall_p95,
+            "server_p50_ms": server_p50,
+            "server_p95_ms": server_p95,
+            "input_tokens": sum(record.input_tokens or 0 for record in group),
+            "output_tokens": sum(record.output_tokens or 0 for record in group),
+            "prompt_bytes": sum(record.prompt_bytes for record in group),
+            "image_bytes": sum(record.image_bytes for record in group),
+        })
+    return sorted(rows, key=lambda row: row["wall_p95_ms"] or 0, reverse=True)
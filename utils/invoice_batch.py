@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+batch invoice extraction over a directory or a list of files
+
+usage:
+    python -m utils.invoice_batch data/invoice -o invoices.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Final, Iterable, Iterator, Optional
+
+from utils.dedup_store import fingerprint, get_dedup_store
+from utils.invoice_extract import DEDUP_NAMESPACE, SUPPORTED_EXTENSIONS, InvoiceExtractor
+from utils.rate_limiter import PRIORITY_BATCH, request_priority
+
+# default number of concurrent Bedrock calls
+DEFAULT_IO_WORKERS: Final[int] = int(os.getenv("invoice_io_workers", 4))
+
+
+def collect_invoice_files(inputs: Iterable[str]) -> list[str]:
+    """
+    :param inputs: files and/or directories, directories are scanned (not recursively) for supported files
+
+    :return: sorted list of invoice file paths
+    """
+    files: list[str] = []
+    for path in inputs:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(SUPPORTED_EXTENSIONS)
+            )
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+class _WorkerError(Exception):
+    """
+    picklable stand-in for exceptions raised in worker processes, some (e.g. TesseractNotFoundError) can't be unpickled
+    """
+
+
+def _pre_process_file(file_path: str, page_workers: int) -> (list[str], list[str], list[dict], float):
+    """
+    run in a worker process: OCR / rasterization / encoding of one file
+
+    :return: [page texts, page images base64, page metadata, seconds spent]
+    """
+    start = time.perf_counter()
+    try:
+        texts, images, pages = InvoiceExtractor(file_path, page_workers).pre_process()
+    except Exception as e:
+        raise _WorkerError(f"{type(e).__name__}: {e}") from None
+    return texts, images, pages, time.perf_counter() - start
+
+
+def _extract_file(file_path: str, texts: list[str], images: list[str], priority: int) -> (str, float):
+    """
+    run in an I/O thread: Bedrock call of one pre processed file, with the rate limiter priority of the batch
+
+    :return: [model output, seconds spent]
+    """
+    start = time.perf_counter()
+    with request_priority(priority):
+        output = InvoiceExtractor(file_path).extract_pre_processed(texts, images)
+    return output, time.perf_counter() - start
+
+
+def _result(file_path: str, started: float, timings: dict, output: Optional[str] = None,
+            error: Optional[BaseException] = None, pages: Optional[list[dict]] = None) -> dict:
+    result = {"file": file_path, "status": "error" if error else "ok"}
+    if error:
+        result["error"] = str(error) if isinstance(error, _WorkerError) else f"{type(error).__name__}: {error}"
+    else:
+        try:
+            result["invoices"] = json.loads(output)
+        except ValueError:
+            result["status"] = "error"
+            result["error"] = "model output is not valid JSON"
+            result["raw_output"] = output
+    timings["total_s"] = round(time.perf_counter() - started, 3)
+    result["timings"] = timings
+    if pages is not None:
+        result["pages"] = pages
+    return result
+
+
+def extract_invoices(file_paths: Iterable[str], cpu_workers: Optional[int] = None,
+                     io_workers: int = DEFAULT_IO_WORKERS, page_workers: int = 1,
+                     priority: int = PRIORITY_BATCH) -> Iterator[dict]:
+    """
+    extract many invoices concurrently: pre processing in a process pool, Bedrock calls in a bounded thread pool
+
+    :param file_paths: invoice files
+    :param cpu_workers: number of pre processing processes, defaults to the number of CPUs
+    :param io_workers: number of concurrent Bedrock calls
+    :param page_workers: page processes per file, files are already processed in parallel so defaults to 1
+    :param priority: rate limiter priority of the Bedrock calls, batch jobs queue behind interactive calls,
+        pages pass PRIORITY_INTERACTIVE
+
+    :return: one result dict per file, in completion order:
+        {"file", "status": "ok"|"error", "invoices" | "error", "timings": {"pre_process_s", "extract_s", "total_s"},
+         "pages": [page metadata, e.g. processing path], "cached": True if served from the dedup store}
+    """
+    started = time.perf_counter()
+    store = get_dedup_store()
+    fingerprints: dict[str, tuple[str, Optional[int]]] = {}
+    with ProcessPoolExecutor(max_workers=cpu_workers) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=io_workers) as io_pool:
+        pending: dict[Future, tuple[str, str, dict, Optional[list[dict]]]] = {}
+        for file_path in file_paths:
+            try:
+                # exact matches only, see InvoiceExtractor.extract_with_metadata
+                fingerprints[file_path] = fingerprint(file_path, perceptual=False)
+            except OSError as e:
+                yield _result(file_path, started, {}, error=e)
+                continue
+            cached = store.lookup(DEDUP_NAMESPACE, *fingerprints[file_path])
+            if cached is not None:
+                output, pages = cached
+                yield {**_result(file_path, started, {}, output=output, pages=pages), "cached": True}
+                continue
+            pending[cpu_pool.submit(_pre_process_file, file_path, page_workers)] = ("pre_process", file_path, {}, None)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, file_path, timings, pages = pending.pop(future)
+                error = future.exception()
+                if error is not None:
+                    yield _result(file_path, started, timings, error=error, pages=pages)
+                elif stage == "pre_process":
+                    texts, images, pages, elapsed = future.result()
+                    timings["pre_process_s"] = round(elapsed, 3)
+                    pending[io_pool.submit(_extract_file, file_path, texts, images, priority)] = ("extract", file_path, timings, pages)
+                else:
+                    output, elapsed = future.result()
+                    timings["extract_s"] = round(elapsed, 3)
+                    result = _result(file_path, started, timings, output=output, pages=pages)
+                    if result["status"] == "ok":
+                        store.store(DEDUP_NAMESPACE, *fingerprints[file_path], [output, pages])
+                    yield result
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="extract invoice information from many files, output JSON Lines")
+    parser.add_argument("inputs", nargs="+", help="invoice files or directories")
+    parser.add_argument("-o", "--output", help="output JSON Lines file, defaults to stdout")
+    parser.add_argument("--cpu-workers", type=int, default=None, help="pre processing processes")
+    parser.add_argument("--io-workers", type=int, default=DEFAULT_IO_WORKERS, help="concurrent Bedrock calls")
+    parser.add_argument("--page-workers", type=int, default=1, help="page processes per file")
+    args = parser.parse_args(argv)
+
+    files = collect_invoice_files(args.inputs)
+    out = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    failures = 0
+    start = time.perf_counter()
+    try:
+        for result in extract_invoices(files, args.cpu_workers, args.io_workers, args.page_workers):
+            failures += result["status"] != "ok"
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"{len(files)} files, {failures} failed, {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,22 +8,305 @@ ref:
 """
 
 import base64
+import contextvars
 import io
+import itertools
 import json
-from typing import Final
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Final, Iterable, Iterator, Optional
 
-import boto3
 import numpy as np
 import pdfplumber
+import pypdfium2 as pdfium
 import pytesseract
 from PIL import Image
-from pdf2image import convert_from_path
+
+from utils.bedrock_client import get_bedrock_client
+from utils.dedup_store import dedup_call
+from utils.instrumentation import instrument_call, invoke_model_metadata
+from utils.payload_estimator import estimate_request, image_tokens, log_usage, pick_image_size
+from utils.rate_limiter import rate_limited_call
+
+logger = logging.getLogger(__name__)
+
+MODEL_ID: Final[str] = "anthropic.claude-3-haiku-20240307-v1:0"
+# dedup store namespace of extraction results
+DEDUP_NAMESPACE: Final[str] = f"invoice:{MODEL_ID}"
 
 # https://docs.anthropic.com/en/docs/build-with-claude/vision#evaluate-image-size
 # the max image height: 1568
 IMAGE_MAX_HEIGHT: Final[int] = 1568
 # the max image height: 1092
 IMAGE_MAX_WIDTH: Final[int] = 1092
+# page groups: Bedrock accepts at most 20 images per Claude 3 request, long invoices are split into
+# groups of at most this many pages / estimated input tokens, extracted concurrently
+MAX_PAGES_PER_REQUEST: Final[int] = min(20, int(os.getenv("invoice_max_pages_per_request", 5)))
+MAX_TOKENS_PER_REQUEST: Final[int] = int(os.getenv("invoice_max_tokens_per_request", 30000))
+# https://docs.anthropic.com/en/docs/build-with-claude/vision#calculate-image-costs
+# tokens = width * height / 750, upper bound for a page resized to IMAGE_MAX_WIDTH
+IMAGE_TOKENS: Final[int] = IMAGE_MAX_WIDTH * IMAGE_MAX_WIDTH // 750
+# pages are downscaled until their smallest text is MIN_TEXT_HEIGHT px high (see payload_estimator),
+# and at most to this many estimated image tokens. Without a measured text height pages keep the
+# IMAGE_MAX_WIDTH long edge cap, the budget only lets small print grow past it
+PAGE_IMAGE_TOKEN_BUDGET: Final[int] = int(os.getenv("invoice_image_token_budget", IMAGE_TOKENS))
+# OCR words below this confidence are ignored when measuring the text height
+OCR_MIN_CONFIDENCE: Final[float] = 60
+# number of processes used to pre process (OSD/OCR/resize/encode) the pages of one invoice
+PAGE_WORKERS: Final[int] = int(os.getenv("invoice_page_workers", os.cpu_count() or 1))
+
+# a PDF text layer is trusted (no OSD/OCR) when it has enough characters, mostly mapped to unicode and upright
+TEXT_LAYER_MIN_CHARS: Final[int] = 20
+TEXT_LAYER_MIN_GLYPH_COVERAGE: Final[float] = 0.9
+TEXT_LAYER_MIN_UPRIGHT: Final[float] = 0.9
+# rasterization dpi of scanned PDF pages, OCR needs the detail
+SCANNED_PDF_DPI: Final[int] = 200
+
+# page processing paths, reported in the page metadata
+PAGE_PATH_TEXT_LAYER: Final[str] = "text_layer"
+PAGE_PATH_OCR: Final[str] = "ocr"
+
+
+def _text_layer_quality(page) -> dict:
+    """
+    :param page: pdfplumber page
+
+    :return: {"chars", "glyph_coverage", "upright", "rotation"} of the page's text layer
+    """
+    chars = page.chars
+    total = len(chars)
+    # glyphs without unicode mapping are extracted as "(cid:N)"
+    mapped = sum(1 for char in chars if not char["text"].startswith("(cid:") and char["text"].isprintable())
+    upright = sum(1 for char in chars if char.get("upright", True))
+    return {
+        "chars": total,
+        "glyph_coverage": round(mapped / total, 3) if total else 0.0,
+        "upright": round(upright / total, 3) if total else 0.0,
+        "rotation": page.rotation or 0,
+    }
+
+
+def _text_layer_usable(quality: dict) -> bool:
+    return (quality["chars"] >= TEXT_LAYER_MIN_CHARS
+            and quality["glyph_coverage"] >= TEXT_LAYER_MIN_GLYPH_COVERAGE
+            and quality["upright"] >= TEXT_LAYER_MIN_UPRIGHT)
+
+
+def _small_text_height(heights: list[float]) -> Optional[float]:
+    """
+    :param heights: heights of the page's characters or words
+
+    :return: height of the page's small print (10th percentile, robust to stray marks), None without text
+    """
+    heights = sorted(height for height in heights if height > 0)
+    return heights[len(heights) // 10] if heights else None
+
+
+def _text_layer_text_height(page) -> Optional[float]:
+    """
+    :param page: pdfplumber page
+
+    :return: small print height in points of the page's text layer
+    """
+    return _small_text_height([char["height"] for char in page.chars if char["text"].strip()])
+
+
+def _page_size(size: tuple[int, int], text_height: Optional[float] = None) -> tuple[int, int]:
+    """
+    :param size: page image (width, height) in px
+    :param text_height: small print height in px, None if not measured
+
+    :return: size picked by pick_image_size (small print MIN_TEXT_HEIGHT px high, within PAGE_IMAGE_TOKEN_BUDGET),
+             without a text height the long edge is capped at IMAGE_MAX_WIDTH
+    """
+    if text_height:
+        return pick_image_size(size, text_height, PAGE_IMAGE_TOKEN_BUDGET)
+    width, height = pick_image_size(size, None, PAGE_IMAGE_TOKEN_BUDGET)
+    scale = min(1.0, IMAGE_MAX_WIDTH / max(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _text_layer_dpi(width: float, height: float, text_height: Optional[float] = None) -> int:
+    """
+    dpi at which the page renders to the size picked by _page_size, so no resize is needed
+
+    :param width: page width in points
+    :param height: page height in points
+    :param text_height: small print height in points
+    """
+    scale = SCANNED_PDF_DPI / 72
+    target_width, _ = _page_size((width * scale, height * scale), text_height * scale if text_height else None)
+    return max(36, min(SCANNED_PDF_DPI, int(SCANNED_PDF_DPI * target_width / (width * scale))))
+
+
+def render_pdf_pages(file_path: str, dpis: Iterable[int]) -> Iterator[Image]:
+    """
+    render PDF pages one at a time, so only the page being processed is held in memory
+
+    :param file_path: PDF file path
+    :param dpis: rendering dpi of each page, in page order
+
+    :return: generator of page images (the PDF's /Rotate is applied by pdfium)
+    """
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        for i, dpi in enumerate(dpis):
+            page = pdf[i]
+            try:
+                yield page.render(scale=dpi / 72).to_pil()
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+
+
+def _ocr(image: Image) -> (str, Optional[float]):
+    """
+    :param image: page image, upright
+
+    :return: [page text, small print height in px of the recognized words]
+    """
+    # image_to_string keeps tesseract's own line and layout output, the word boxes only measure the text
+    text = pytesseract.image_to_string(image, config="-l chi_sim+eng")
+    data = pytesseract.image_to_data(image, config="-l chi_sim+eng", output_type=pytesseract.Output.DICT)
+    heights = [data["height"][i] for i, word in enumerate(data["text"])
+               if word.strip() and float(data["conf"][i]) >= OCR_MIN_CONFIDENCE]
+    return text, _small_text_height(heights)
+
+
+def _pre_process_page(image: Image, text: str, path: str = PAGE_PATH_OCR) -> (str, str, dict):
+    """
+    preprocessing one page for claude, runs in a worker process
+        1. rotate image if necessary
+        2. try to extract txt directly from image, measuring the text height
+        3. downscale the image to the smallest size that keeps its small print readable,
+           within PAGE_IMAGE_TOKEN_BUDGET (see _page_size)
+        4. convert image to webp format
+        5. convert image to base64 encoding
+
+    steps 1 and 2 are skipped for pages on the PAGE_PATH_TEXT_LAYER path: the text comes from the PDF
+    and the renderer already applied the PDF's rotation
+
+    :param image: page image
+    :param text: page text already extracted, empty if none
+    :param path: page processing path
+
+    :return: [page text content,page image base64 encoding,page image metadata (size, estimated tokens)]
+    """
+
+    text_height = None
+    if path == PAGE_PATH_OCR:
+        # detect orientation and rotate
+        # https://notes-of-python.readthedocs.io/zh/latest/python/python-notes-for-ocr-with-tesseract/
+        orientation = pytesseract.image_to_osd(
+            np.array(image),
+            output_type=pytesseract.Output.DICT
+        )["orientation"]
+
+        # rotate image if necessary
+        if orientation != 0:
+            image = Image.fromarray(np.rot90(np.array(image), k=orientation // 90))
+
+        # extract txt from image if necessary
+        if not text:
+            text, text_height = _ocr(image)
+
+    # keep image size in proper size
+    size = _page_size(image.size, text_height)
+    if size != image.size:
+        image = image.resize(size)
+
+    # convert image to webp format
+    buffer = io.BytesIO()
+    image.save(buffer, format="webp", quality=85)
+    image_data = buffer.getvalue()
+    info = {"image_size": list(image.size), "image_tokens": image_tokens(*image.size)}
+    if text_height:
+        info["text_height_px"] = round(text_height, 1)
+    # convert image to base64 encoding
+    return text, base64.b64encode(image_data).decode("utf-8"), info
+
+
+def _pre_process_page_in_worker(image: Image, text: str, path: str = PAGE_PATH_OCR) -> (str, str, dict):
+    """
+    _pre_process_page for worker processes, some exceptions (e.g. TesseractNotFoundError) can't be unpickled
+    and would break the whole pool, so they are re-raised as RuntimeError
+    """
+    try:
+        return _pre_process_page(image, text, path)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def _page_groups(texts: list[str]) -> list[range]:
+    """
+    split pages into consecutive groups of at most MAX_PAGES_PER_REQUEST pages and MAX_TOKENS_PER_REQUEST
+    estimated input tokens (PAGE_IMAGE_TOKEN_BUDGET per image plus ~4 characters per text token)
+
+    :param texts: page text content
+
+    :return: page index ranges, in page order
+    """
+    groups: list[range] = []
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        page_tokens = PAGE_IMAGE_TOKEN_BUDGET + len(text or "") // 4
+        if i > start and (i - start >= MAX_PAGES_PER_REQUEST or tokens + page_tokens > MAX_TOKENS_PER_REQUEST):
+            groups.append(range(start, i))
+            start, tokens = i, 0
+        tokens += page_tokens
+    groups.append(range(start, len(texts)))
+    return groups
+
+
+def _parse_invoices(output: str) -> list[dict]:
+    """
+    :param output: model output, expected to be a JSON array, possibly wrapped in extra text
+
+    :return: list of invoices
+    """
+    try:
+        invoices = json.loads(output)
+    except ValueError:
+        start, end = output.find("["), output.rfind("]")
+        if start < 0 or end < start:
+            raise ValueError(f"model output is not a JSON array: {output[:200]}")
+        invoices = json.loads(output[start:end + 1])
+    return invoices if isinstance(invoices, list) else [invoices]
+
+
+def _merge_invoices(groups: list[list[dict]]) -> list[dict]:
+    """
+    merge the invoices of consecutive page groups in order. an invoice spanning a group boundary is
+    extracted by both groups: entries with the same invoice_number are merged into the first one, empty
+    fields are filled from later entries and total_amount is taken from the last entry that has one,
+    as totals are printed on an invoice's last page. invoices without invoice_number are kept as is
+
+    :param groups: invoices of each page group, in page order
+
+    :return: merged list of invoices
+    """
+    merged: list[dict] = []
+    by_number: dict[str, dict] = {}
+    for invoices in groups:
+        for invoice in invoices:
+            number = str(invoice.get("invoice_number") or "").strip()
+            if not number:
+                merged.append(invoice)
+                continue
+            if number not in by_number:
+                by_number[number] = dict(invoice)
+                merged.append(by_number[number])
+                continue
+            existing = by_number[number]
+            for key, value in invoice.items():
+                if value in (None, ""):
+                    continue
+                if key == "total_amount" or existing.get(key) in (None, ""):
+                    existing[key] = value
+    return merged
 
 
 class _ImageInvoiceExtractor:
@@ -31,11 +314,13 @@ class _ImageInvoiceExtractor:
     image invoice extractor
     """
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, page_workers: Optional[int] = None):
         """
         :param file_path: image file path
+        :param page_workers: number of processes used to pre process pages, defaults to PAGE_WORKERS
         """
         self._file_path = file_path
+        self._page_workers = page_workers or PAGE_WORKERS
         self._prompts_template: str = """
                         The unformated raw text in the image is pre parsed in messages's content,text start with 'Image N:',N represents the sequence number of images.
                         Please prioritize messages's content results when responding, and keep the exact spelling of words in uppercase and lowercase letters.
@@ -89,87 +374,119 @@ class _ImageInvoiceExtractor:
                         Please note that output is a JSON array according to <json_format> structure,and it's must can be directly parsed as json array.
                         """
 
-    def _pre_process_images(self, texts: list[str], images: list[str]) -> (list[str], list[str]):
+    def _pre_process_images(self, texts: list[str], images: Iterable[Image],
+                            paths: Optional[Iterable[str]] = None) -> (list[str], list[str], list[dict]):
         """
-        preprocessing image for claude
-            1. rotate image if necessary
-            2. try to extract txt directly from image
-            3. keep image size in proper size
-            4. convert image to webp format
-            5. convert image to base64 encoding
+        preprocessing image for claude, pages are processed in parallel worker processes
+        (see _pre_process_page) and returned in the original page order
+
+        images may be a generator (see render_pdf_pages): at most `page_workers` pages are in flight,
+        so the next page is only rendered once a slot is free and peak memory doesn't grow with page count
 
         ref: https://docs.anthropic.com/en/docs/build-with-claude/vision#evaluate-image-size
 
-        :param texts: list of texts
-        :param images: list of images
+        :param texts: list of texts, one per page
+        :param images: list or generator of images
+        :param paths: processing path of each page, defaults to PAGE_PATH_OCR
 
-        :return: [list of pdf page text content,list of pdf page image base64 encoding]
+        :return: [list of pdf page text content,list of pdf page image base64 encoding,list of page image metadata]
         """
 
-        images_base64: list[str] = []
-
-        for i, image in enumerate(images):
-            # detect orientation and rotate
-            # https://notes-of-python.readthedocs.io/zh/latest/python/python-notes-for-ocr-with-tesseract/
-            orientation = pytesseract.image_to_osd(
-                np.array(image),
-                output_type=pytesseract.Output.DICT
-            )["orientation"]
-
-            # rotate image if necessary
-            if orientation != 0:
-                image = Image.fromarray(np.rot90(np.array(image), k=orientation // 90))
-
-            # extract txt from image if necessary
-            if not texts[i]:
-                texts[i] = pytesseract.image_to_string(image, config="-l chi_sim+eng")
-
-            # keep image size in proper size
-            # get image's width,height
-            width, height = image.size
-            # get image's max long edge
-            max_size = max(width, height)
-            # if image's long edge is larger than 1568, resize max long edge to 1568
-            if max_size > IMAGE_MAX_WIDTH:
-                # resize image's with
-                width = round(width * IMAGE_MAX_WIDTH / max_size)
-                # resize image's height
-                height = round(height * IMAGE_MAX_WIDTH / max_size)
-                # resize image
-                image = image.resize((width, height))
-
-            # convert image to webp format
-            buffer = io.BytesIO()
-            image.save(buffer, format="webp", quality=85)
-            image_data = buffer.getvalue()
-            # convert image to base64 encoding
-            images_base64.append(base64.b64encode(image_data).decode("utf-8"))
-
-        return texts, images_base64
-
-    def _pre_process(self) -> (list[str], list[str]):
+        paths = paths or itertools.repeat(PAGE_PATH_OCR)
+        workers = min(self._page_workers, len(texts))
+        if workers <= 1:
+            pages = list(map(_pre_process_page, images, texts, paths))
+        else:
+            pages = []
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                in_flight = deque()
+                for image, text, path in zip(images, texts, paths):
+                    if len(in_flight) >= workers:
+                        pages.append(in_flight.popleft().result())
+                    in_flight.append(executor.submit(_pre_process_page_in_worker, image, text, path))
+                    del image
+                pages.extend(future.result() for future in in_flight)
+
+        return [text for text, _, _ in pages], [image for _, image, _ in pages], [info for _, _, info in pages]
+
+    def _pre_process(self) -> (list[str], list[str], list[dict]):
         """
         preprocessing image for claude,keep image size in proper size and follow claude's best practice
 
         ref: https://docs.anthropic.com/en/docs/build-with-claude/vision#evaluate-image-size
 
-        :return: [list of pdf page text content,list of pdf page image base64 encoding]
+        :return: [list of pdf page text content,list of pdf page image base64 encoding,list of page metadata]
         """
 
         images: list[Image] = [Image.open(self._file_path)]
         texts: list[str] = ['' for image in images]
+        pages: list[dict] = [{"page": i, "path": PAGE_PATH_OCR} for i, _ in enumerate(images)]
 
-        return self._pre_process_images(texts, images)
+        texts, images, infos = self._pre_process_images(texts, images)
+        for page, info in zip(pages, infos):
+            page.update(info)
+        return texts, images, pages
+
+    def pre_process(self) -> (list[str], list[str], list[dict]):
+        """
+        :return: [list of page text content,list of page image base64 encoding,list of page metadata]
+        """
+        return self._pre_process()
 
     def extract(self) -> str:
         """
         :return: use claude 3 haiku to extract invoice information
         """
 
-        texts, images = self._pre_process()
+        return self.extract_with_metadata()[0]
+
+    def extract_with_metadata(self) -> (str, list[dict]):
+        """
+        :return: [extracted invoice information,list of page metadata (processing path, text layer quality, dpi)]
+        """
+
+        texts, images, pages = self._pre_process()
+        return self.extract_pre_processed(texts, images), pages
+
+    def extract_pre_processed(self, texts: list[str], images: list[str]) -> str:
+        """
+        long invoices are split into page groups within the per request image and token limits
+        (see _page_groups), the groups are extracted concurrently and their results merged
+
+        :param texts: list of page text content, as returned by pre_process
+        :param images: list of page image base64 encoding, as returned by pre_process
+
+        :return: use claude 3 haiku to extract invoice information
+        """
+
+        groups = _page_groups(texts)
+        if len(groups) == 1:
+            return self._invoke(texts, images)
+
+        # each group runs in the caller's context, so it keeps the request priority (see rate_limiter)
+        contexts = [contextvars.copy_context() for _ in groups]
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            outputs = list(executor.map(
+                lambda pages, context: context.run(
+                    self._invoke, texts[pages.start:pages.stop], images[pages.start:pages.stop], pages.start),
+                groups,
+                contexts,
+            ))
+        return json.dumps(_merge_invoices([_parse_invoices(output) for output in outputs]), ensure_ascii=False)
+
+    def _invoke(self, texts: list[str], images: list[str], first_page: int = 0) -> str:
+        """
+        one claude 3 haiku call over a group of pages
+
+        :param texts: page text content of the group
+        :param images: page image base64 encoding of the group
+        :param first_page: index of the group's first page in the invoice
+
+        :return: model output, a JSON array string
+        """
 
         _content = []
-        for i, val in enumerate(texts):
+        for i, val in enumerate(texts, first_page):
             _text = {
                 "type": "text",
                 "text": f"Image {i}: {val}"
@@ -181,7 +498,7 @@ class _ImageInvoiceExtractor:
                 "source": {
                     "type": "base64",
                     "media_type": "image/webp",
-                    "data": images[i],
+                    "data": images[i - first_page],
                 },
             }
             _content.append(_image)
@@ -205,13 +522,17 @@ class _ImageInvoiceExtractor:
             ],
         }, ensure_ascii=False)
 
-        bedrock_runtime = boto3.client(service_name='bedrock-runtime', region_name="us-east-1")
-        response = bedrock_runtime.invoke_model(
-            body=body,
-            modelId="anthropic.claude-3-haiku-20240307-v1:0"
-        )
-
-        result = json.loads(response.get('body').read())["content"][0]["text"]
+        estimate = estimate_request(body=body)
+        bedrock_runtime = get_bedrock_client(region_name="us-east-1")
+        with instrument_call(MODEL_ID, "invoke_model", estimate, call_site="invoice") as call:
+            response = rate_limited_call(MODEL_ID, lambda: bedrock_runtime.invoke_model(
+                body=body,
+                modelId=MODEL_ID
+            ))
+            response_body = json.loads(response.get('body').read())
+            call.update(invoke_model_metadata(response), usage=response_body.get("usage"))
+        log_usage(f"{self._file_path} pages {first_page}-{first_page + len(texts) - 1}", estimate, response_body.get("usage"))
+        result = response_body["content"][0]["text"]
         return result
 
 
@@ -220,46 +541,106 @@ class _PdfInvoiceExtractor(_ImageInvoiceExtractor):
     PDF invoice extractor
     """
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, page_workers: Optional[int] = None):
         """
         :param file_path: PDF file path
+        :param page_workers: number of processes used to pre process pages
         """
-        super().__init__(file_path)
+        super().__init__(file_path, page_workers)
 
-    def _pre_process(self) -> (list[str], list[str]):
+    def _pre_process(self) -> (list[str], list[str], list[dict]):
         """
         preprocessing PDF file for claude:
             1. try to extract txt directly from pdf file
-            2. convert PDF to images
+            2. convert PDF to images, one page at a time
             3. combining images and text to extract information comprehensively
 
+        pages with a usable text layer (digital PDFs) skip OSD and OCR and are rasterized at the dpi
+        matching IMAGE_MAX_WIDTH, only scanned pages are rasterized at SCANNED_PDF_DPI and OCRed
+
         ref: https://docs.anthropic.com/en/docs/build-with-claude/vision#evaluate-image-size
 
-        :return: [list of pdf page text content,list of pdf page image base64 encoding]
+        :return: [list of pdf page text content,list of pdf page image base64 encoding,list of page metadata]
         """
         texts: list[str] = []
+        pages: list[dict] = []
         with pdfplumber.open(self._file_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                texts.append(text)
-
-        # convert pdf to images
-        images: list[Image] = convert_from_path(self._file_path)
-        return self._pre_process_images(texts, images)
+            for i, page in enumerate(pdf.pages):
+                quality = _text_layer_quality(page)
+                if _text_layer_usable(quality):
+                    texts.append(page.extract_text())
+                    text_height = _text_layer_text_height(page)
+                    path, dpi = PAGE_PATH_TEXT_LAYER, _text_layer_dpi(page.width, page.height, text_height)
+                    quality["text_height_pt"] = round(text_height, 1) if text_height else None
+                else:
+                    # an unusable text layer (e.g. unmapped glyphs) is replaced by OCR
+                    texts.append('')
+                    path, dpi = PAGE_PATH_OCR, SCANNED_PDF_DPI
+                pages.append({"page": i, "path": path, "dpi": dpi, **quality})
+                # drop pdfplumber's cached layout objects of this page
+                page.close()
+
+        # convert pdf to images lazily, each page at its own dpi
+        images = render_pdf_pages(self._file_path, [page["dpi"] for page in pages])
+        paths = [page["path"] for page in pages]
+        texts, images, infos = self._pre_process_images(texts, images, paths)
+        for page, info in zip(pages, infos):
+            page.update(info)
+        return texts, images, pages
+
+
+# supported invoice file extensions
+SUPPORTED_EXTENSIONS: Final[tuple[str, ...]] = ('pdf', 'png', 'jpg', 'jpeg', 'webp')
 
 
 class InvoiceExtractor:
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, page_workers: Optional[int] = None):
+        """
+        :param file_path: invoice file path
+        :param page_workers: number of processes used to pre process pages, defaults to PAGE_WORKERS
+        """
         self._file_path = file_path
-
-    def extract(self) -> str:
-        if self._file_path.endswith(".pdf"):
-            return _PdfInvoiceExtractor(self._file_path).extract()
-        elif self._file_path.endswith(('png', 'jpg', 'jpeg')):
-            return _ImageInvoiceExtractor(self._file_path).extract()
+        self._page_workers = page_workers
+
+    def _extractor(self) -> _ImageInvoiceExtractor:
+        file_path = self._file_path.lower()
+        if file_path.endswith(".pdf"):
+            return _PdfInvoiceExtractor(self._file_path, self._page_workers)
+        elif file_path.endswith(SUPPORTED_EXTENSIONS[1:]):
+            return _ImageInvoiceExtractor(self._file_path, self._page_workers)
         else:
             raise ValueError("Unsupported file type")
 
+    def pre_process(self) -> (list[str], list[str], list[dict]):
+        """
+        CPU bound part of the extraction (OCR, rasterization, encoding), safe to run in a worker process
+
+        :return: [list of page text content,list of page image base64 encoding,list of page metadata]
+        """
+        return self._extractor().pre_process()
+
+    def extract_pre_processed(self, texts: list[str], images: list[str]) -> str:
+        """
+        I/O bound part of the extraction (Bedrock call)
+
+        :return: extracted invoice information, a JSON array string
+        """
+        return self._extractor().extract_pre_processed(texts, images)
+
+    def extract(self) -> str:
+        return self.extract_with_metadata()[0]
+
+    def extract_with_metadata(self) -> (str, list[dict]):
+        """
+        identical re-uploads are served from the dedup store; near-identical ones are not, an invoice on the same
+        template differs only by its number and amounts
+
+        :return: [extracted invoice information,list of page metadata (processing path, text layer quality, dpi)]
+        """
+        result, pages = dedup_call(
+            DEDUP_NAMESPACE, self._file_path, lambda: list(self._extractor().extract_with_metadata()), perceptual=False)
+        return result, pages
+
 
 if __name__ == '__main__':
     pdf_extractor = InvoiceExtractor("../data/invoice/invoice_sample_1.pdf")
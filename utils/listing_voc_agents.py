@@ -1,5 +1,4 @@
 import os
-import boto3
 import json
 from dotenv import load_dotenv
 
@@ -17,15 +16,14 @@ from langchain.agents import AgentExecutor, AgentType, initialize_agent, create_
 #from langchain_community.tools.tavily_search import TavilySearchResults
 
 from utils.amazon_scraper import get_product, get_reviews
+from utils.bedrock_client import get_bedrock_client
 
 os.environ["TAVILY_API_KEY"] = "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"
 
 def initialize_llm():
     """Initialize the Bedrock runtime."""
-    bedrock_runtime =  boto3.client(
-        service_name="bedrock-runtime",
-        region_name="us-west-2",
-    )
+    # ChatBedrock calls the client directly, not through the rate limiter, so keep botocore's retries
+    bedrock_runtime = get_bedrock_client(region_name="us-west-2", rate_limited=False)
 
     """Initialize the language model."""
     model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
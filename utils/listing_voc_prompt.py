@@ -1,36 +1,50 @@
 import os
-import boto3
-import json
+import hashlib
+import logging
+import time
 from dotenv import load_dotenv
 from botocore.exceptions import ClientError
 
-import base64
-import io
-from PIL import Image
+from utils.bedrock_client import get_bedrock_client
+from utils.catalog import get_catalog
+from utils.dedup_store import dedup_call
+from utils.image_preprocess import prepare_image
+from utils.response_cache import cached_converse, cached_converse_stream
+from utils.review_condenser import condense_reviews
 
 
 # loading in variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 data_folder = os.getenv("data_folder")
 
 # instantiating the Bedrock client, and passing in the CLI profile
 # boto3.setup_default_session(profile_name=os.getenv("profile_name"))
 
-bedrock = boto3.client('bedrock-runtime', 'us-west-2')
+bedrock = get_bedrock_client('us-west-2')
+
+# sections of the VoC report, shared by the single call and the map-reduce prompts
+VOC_REPORT_SECTIONS = '''Executive Summary - Briefly summarize the key findings and recommendations
+    Positive Feedback - List the main aspects that customers praised about the product
+    Areas for Improvement - Summarize the key areas of dissatisfaction and improvement needs raised by customers
+    Differentiation from Competitors - Unique features or advantages that set a product apart from competitors
+    Unperceived Product Features - Valuable product characteristics or benefits that customers are not fully aware of
+    Core Factors for Repurchase and Recommendation - Critical elements that drive customers to repurchase and recommend a product
+    Sentiment Analysis - Analyze the sentiment tendencies (positive, negative, neutral) in the reviews
+    Topic Categorization - Categorize the review content by topics such as product quality, scent, effectiveness, etc.
+    Recommendations - Based on the analysis, provide recommendations for product improvements and marketing strategies'''
+
 
 def gen_listing_prompt(asin, domain, brand, features, language):
     # results = get_product(asin, domain)
 
-    filename = './data/' + 'asin_' + asin + '_product.json'
-    with open(filename, 'r', encoding='utf-8') as file:
-        data = file.read()
+    product = get_catalog().get_product(asin, domain)
 
-    results = json.loads(data)
-
-    as_title = results['results'][0]['content']['title']
-    as_bullet = results['results'][0]['content']['bullet_points']
-    as_des = results['results'][0]['content']['description']
+    as_title = product.title
+    as_bullet = product.bullet_points
+    as_des = product.description
     
     prompt_template = '''If you were an excellent Amazon product listing specialist.
     Your task is to create compelling and optimized product listings for Amazon based on the provided information.
@@ -67,30 +81,21 @@ def gen_listing_prompt(asin, domain, brand, features, language):
     return user_prompt
 
 
-def gen_voc_prompt(asin, domain, language):
+def gen_voc_prompt(asin, domain, language, condensed=None):
 
     print('asin:' + asin, 'domain:' + domain)
     #results = get_reviews(asin, domain)
 
-    filename = './data/' + 'asin_' + asin + '_reviews.json'
-    with open(filename, 'r', encoding='utf-8') as file:
-        reviews = file.read()
-
-    results = json.loads(reviews)
+    if condensed is None:
+        review_set = get_catalog().get_reviews(asin, domain)
+        condensed = condense_reviews(review_set.reviews, source_tokens=review_set.source_tokens)
+    logger.info(condensed.summary())
 
     prompt_template = '''
     You are an analyst tasked with analyzing the provided customer review examples on an e-commerce platform and summarizing them into a comprehensive Voice of Customer (VoC) report. Your job is to carefully read through the product description and reviews, identify key areas of concern, praise, and dissatisfaction regarding the product. You will then synthesize these findings into a well-structured report that highlights the main points for the product team and management to consider.
 
     The report should include the following sections:
-    Executive Summary - Briefly summarize the key findings and recommendations
-    Positive Feedback - List the main aspects that customers praised about the product
-    Areas for Improvement - Summarize the key areas of dissatisfaction and improvement needs raised by customers
-    Differentiation from Competitors - Unique features or advantages that set a product apart from competitors
-    Unperceived Product Features - Valuable product characteristics or benefits that customers are not fully aware of
-    Core Factors for Repurchase and Recommendation - Critical elements that drive customers to repurchase and recommend a product
-    Sentiment Analysis - Analyze the sentiment tendencies (positive, negative, neutral) in the reviews
-    Topic Categorization - Categorize the review content by topics such as product quality, scent, effectiveness, etc.
-    Recommendations - Based on the analysis, provide recommendations for product improvements and marketing strategies
+    {sections}
 
     When writing the report, use concise and professional language, highlight key points, and provide reviews examples where relevant. Also, be mindful of protecting individual privacy by not disclosing any personally identifiable information.
 
@@ -105,36 +110,55 @@ def gen_voc_prompt(asin, domain, language):
     if output is not English, Please also ouput the reuslt in {lang}
     '''
     
-    user_prompt  = prompt_template.format(product_description='', product_reviews=results['results'], lang=language)
+    user_prompt  = prompt_template.format(sections=VOC_REPORT_SECTIONS, product_description='', product_reviews=condensed.text, lang=language)
 
     return user_prompt
 
-def image_base64_encoder(image_path, max_size=1568):
-    with open(image_path, "rb") as f:
-        image_bytes = f.read()
 
-    img = Image.open(io.BytesIO(image_bytes))
-    width, height = img.size
-    img_format = img.format.lower()
+def gen_voc_map_prompt(product_reviews):
+    prompt_template = '''
+    You are an analyst preparing one batch of customer reviews of a product for a Voice of Customer (VoC) report.
+    Summarize the batch below into concise notes covering: what customers praised, what they complained about, suggestions, purchase motivations, expectations, and the star rating distribution of the batch.
+    Keep the number of reviews behind each point, and quote up to two short representative reviews per point. Do not include any personally identifiable information.
 
-    if width > max_size or height > max_size:
-        if width > height:
-            new_width = max_size
-            new_height = int(height * (max_size / width))
-        else:
-            new_height = max_size
-            new_width = int(width * (max_size / height))
+    <product reviews>
+    {product_reviews}
+    <product reviews>
 
-        img = img.resize((new_width, new_height), resample=Image.Resampling.LANCZOS)
+    Respond in English with the notes only.
+    '''
+    return prompt_template.format(product_reviews=product_reviews)
 
-    resized_bytes = io.BytesIO()
-    img.save(resized_bytes, format=img_format)
-    resized_bytes = resized_bytes.getvalue()
 
-    return resized_bytes, img_format
+def gen_voc_reduce_prompt(partial_summaries, language, product_description=''):
+    prompt_template = '''
+    You are an analyst tasked with merging the partial summaries below, each covering one batch of customer reviews of the same product on an e-commerce platform, into one comprehensive Voice of Customer (VoC) report. Weigh each point by the number of reviews behind it across all batches.
+
+    The report should include the following sections:
+    {sections}
 
+    When writing the report, use concise and professional language, highlight key points, and provide reviews examples where relevant. Also, be mindful of protecting individual privacy by not disclosing any personally identifiable information.
 
-def bedrock_converse_api(model_id, input_text):
+    <Product descriptions>
+    {product_description}
+    <Product descriptions>
+
+    <partial summaries>
+    {partial_summaries}
+    <partial summaries>
+    {missing}
+    if output is not English, Please also ouput the reuslt in {lang}
+    '''
+    summaries = "\n\n".join(
+        f"<batch {i}>\n{summary if summary is not None else '(summary unavailable)'}\n</batch {i}>"
+        for i, summary in enumerate(partial_summaries, 1))
+    failed = sum(summary is None for summary in partial_summaries)
+    missing = (f"\n    {failed} of the {len(partial_summaries)} batches could not be summarized. State at the start of the report that it covers only part of the reviews.\n"
+               if failed else "")
+    return prompt_template.format(sections=VOC_REPORT_SECTIONS, product_description=product_description, partial_summaries=summaries, missing=missing, lang=language)
+
+
+def bedrock_converse_api(model_id, input_text, use_cache=None, call_site=None):
     conversation = [
         {
             "role": "user",
@@ -144,7 +168,10 @@ def bedrock_converse_api(model_id, input_text):
 
     try:
         # Send the message to the model, using a basic inference configuration.
-        response = bedrock.converse(
+        response = cached_converse(
+            bedrock,
+            use_cache,
+            call_site,
             modelId=model_id,
             messages=conversation,
             inferenceConfig={"maxTokens": 2048, "temperature": 0.5, "topP": 0.9},
@@ -160,8 +187,80 @@ def bedrock_converse_api(model_id, input_text):
         print(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
 
 
-def bedrock_converse_api_with_image(model_id, image_filename, input_text):
-    image_base64, file_type = image_base64_encoder(image_filename)
+def bedrock_converse_stream_api(model_id, input_text, use_cache=None, on_metadata=None, call_site=None):
+    """
+    Streaming variant of bedrock_converse_api built on ConverseStream.
+
+    Args:
+        model_id (str): The ID of the model to use.
+        input_text (str): The user prompt.
+        use_cache (bool, optional): passed through to the response cache.
+        on_metadata (callable, optional): called once the stream ends with a dict holding the
+            stream's `usage` and `metrics`, plus client side `time_to_first_token_ms` and `wall_time_ms`,
+            and `error` if the call failed.
+        call_site (str, optional): feature the call is recorded under on the Admin page, e.g. "listing".
+
+    Yields:
+        str: text deltas as they arrive.
+    """
+    conversation = [
+        {
+            "role": "user",
+            "content": [{"text": input_text}],
+        }
+    ]
+
+    start = time.perf_counter()
+    stats = {"time_to_first_token_ms": None}
+    try:
+        stream = cached_converse_stream(
+            bedrock,
+            use_cache,
+            call_site,
+            modelId=model_id,
+            messages=conversation,
+            inferenceConfig={"maxTokens": 2048, "temperature": 0.5, "topP": 0.9},
+        )
+        for event in stream:
+            if "contentBlockDelta" in event:
+                if stats["time_to_first_token_ms"] is None:
+                    stats["time_to_first_token_ms"] = int((time.perf_counter() - start) * 1000)
+                yield event["contentBlockDelta"]["delta"].get("text", "")
+            elif "metadata" in event:
+                stats["usage"] = event["metadata"].get("usage", {})
+                stats["metrics"] = event["metadata"].get("metrics", {})
+
+    except (ClientError, Exception) as e:
+        logger.error(f"Can't invoke '{model_id}'. Reason: {e}")
+        stats["error"] = f"{type(e).__name__}: {e}"
+
+    stats["wall_time_ms"] = int((time.perf_counter() - start) * 1000)
+    logger.info(f"model: {model_id}, stream stats: {stats}")
+    if on_metadata:
+        on_metadata(stats)
+
+
+def format_stream_stats(stats):
+    """
+    One line summary of the stats reported by bedrock_converse_stream_api.
+    """
+    usage = stats.get("usage", {})
+    return (f"输入tokens: {usage.get('inputTokens', '-')} | 输出tokens: {usage.get('outputTokens', '-')} | "
+            f"首token: {stats.get('time_to_first_token_ms', '-')} ms | "
+            f"服务端延迟: {stats.get('metrics', {}).get('latencyMs', '-')} ms | 总耗时: {stats.get('wall_time_ms', '-')} ms")
+
+
+def bedrock_converse_api_with_image(model_id, image_filename, input_text, use_cache=None, call_site=None):
+    if use_cache:
+        # identical or near-identical images with the same prompt are served from the dedup store
+        prompt_hash = hashlib.sha256(input_text.encode('utf-8')).hexdigest()
+        return dedup_call(f"converse_image:{model_id}:{prompt_hash}", image_filename,
+                          lambda: _bedrock_converse_api_with_image(model_id, image_filename, input_text, use_cache, call_site))
+    return _bedrock_converse_api_with_image(model_id, image_filename, input_text, use_cache, call_site)
+
+
+def _bedrock_converse_api_with_image(model_id, image_filename, input_text, use_cache=None, call_site=None):
+    image_base64, file_type = prepare_image(image_filename, max_size=1568, target='claude')
     conversation = [
         {
             "role": "user",
@@ -180,7 +279,10 @@ def bedrock_converse_api_with_image(model_id, image_filename, input_text):
 
     try:
         # Send the message to the model, using a basic inference configuration.
-        response = bedrock.converse(
+        response = cached_converse(
+            bedrock,
+            use_cache,
+            call_site,
             modelId=model_id,
             messages=conversation,
             inferenceConfig={"maxTokens": 2048, "temperature": 0.5, "topP": 0.9},
@@ -0,0 +1,183 @@
+import base64
+import io
+import json
+import logging
+import math
+import os
+
+from dotenv import load_dotenv
+from PIL import Image
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# https://docs.anthropic.com/en/docs/build-with-claude/vision#evaluate-image-size
+# images with a long edge above 1568 px or above ~1600 tokens are downscaled by the model
+CLAUDE_IMAGE_MAX_EDGE = 1568
+CLAUDE_IMAGE_MAX_TOKENS = 1600
+# pixels per image token
+PIXELS_PER_TOKEN = 750
+
+# default token budget of one image, can be overridden in .env
+IMAGE_TOKEN_BUDGET = int(os.getenv("image_token_budget", CLAUDE_IMAGE_MAX_TOKENS))
+# height in px the smallest text of a document image must keep to stay readable for the model
+MIN_TEXT_HEIGHT = int(os.getenv("image_min_text_height", 14))
+# strings longer than this in non-messages request bodies (e.g. Titan image tasks) are base64 images
+_BASE64_IMAGE_MIN_LENGTH = 1024
+
+
+def estimate_tokens(text):
+    """
+    Rough token count without a tokenizer: ~4 ASCII characters per token, ~1 token per CJK character.
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def image_tokens(width, height):
+    """
+    Estimated input tokens of an image (width * height / 750), after the model's own downscaling.
+
+    Args:
+        width (int): image width in px
+        height (int): image height in px
+
+    Returns:
+        int: estimated tokens
+    """
+    scale = min(1.0, CLAUDE_IMAGE_MAX_EDGE / max(width, height),
+                math.sqrt(CLAUDE_IMAGE_MAX_TOKENS * PIXELS_PER_TOKEN / (width * height)))
+    return math.ceil(round(width * scale) * round(height * scale) / PIXELS_PER_TOKEN)
+
+
+def pick_image_size(size, text_height=None, token_budget=IMAGE_TOKEN_BUDGET, min_text_height=MIN_TEXT_HEIGHT):
+    """
+    Smallest image size that keeps the document's text readable, within a token budget.
+
+    The image is scaled down until its smallest text is min_text_height px high, never up; it is further
+    scaled down if that size still costs more than token_budget. Without a known text height only the
+    budget applies.
+
+    Args:
+        size (tuple): (width, height) in px
+        text_height (float, optional): height in px of the smallest relevant text at this size
+        token_budget (int): max estimated image tokens
+        min_text_height (int): min text height in px
+
+    Returns:
+        tuple: (width, height)
+    """
+    width, height = size
+    scale = min(1.0, math.sqrt(token_budget * PIXELS_PER_TOKEN / (width * height)))
+    if text_height:
+        scale = min(scale, min_text_height / text_height)
+    return max(1, math.floor(width * scale)), max(1, math.floor(height * scale))
+
+
+def _image_size(data):
+    # only the header is parsed
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+
+def _content_estimate(blocks, estimate):
+    for block in blocks:
+        text = block if isinstance(block, str) else block.get("text")
+        data = None
+        if text is not None:
+            # plain string, converse {"text"} and anthropic {"type": "text", "text"}
+            estimate["text_tokens"] += estimate_tokens(text)
+            estimate["prompt_bytes"] += len(text.encode("utf-8"))
+        elif "image" in block:
+            # converse {"image": {"format", "source": {"bytes"}}}
+            data = block["image"]["source"]["bytes"]
+        elif block.get("type") == "image":
+            # anthropic {"type": "image", "source": {"type": "base64", "data"}}
+            data = base64.b64decode(block["source"]["data"])
+        if data is not None:
+            estimate["image_tokens"] += image_tokens(*_image_size(data))
+            estimate["image_bytes"] += len(data)
+            estimate["images"] += 1
+
+
+def _body_estimate(value, estimate):
+    """
+    payload sizes of a request body without messages (e.g. Titan / Stability image tasks)
+    """
+    if isinstance(value, dict):
+        for item in value.values():
+            _body_estimate(item, estimate)
+    elif isinstance(value, list):
+        for item in value:
+            _body_estimate(item, estimate)
+    elif isinstance(value, str) and len(value) >= _BASE64_IMAGE_MIN_LENGTH:
+        estimate["image_bytes"] += len(value) * 3 // 4
+        estimate["images"] += 1
+    elif isinstance(value, str):
+        estimate["text_tokens"] += estimate_tokens(value)
+        estimate["prompt_bytes"] += len(value.encode("utf-8"))
+
+
+def _payload_bytes(request):
+    """
+    size of the serialized request, bytes are sent base64 encoded
+    """
+    blobs = []
+
+    def default(value):
+        if isinstance(value, (bytes, bytearray)):
+            blobs.append(len(value))
+            return ""
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    size = len(json.dumps(request, default=default, ensure_ascii=False).encode("utf-8"))
+    return size + sum(4 * math.ceil(n / 3) for n in blobs)
+
+
+def estimate_request(**request):
+    """
+    Estimate the input tokens and payload size of a Bedrock request before sending it.
+
+    Args:
+        **request: converse arguments (messages, system, ...) or invoke_model arguments with an
+            Anthropic messages `body`.
+
+    Returns:
+        dict: {"text_tokens", "image_tokens", "input_tokens", "images", "prompt_bytes", "image_bytes",
+            "payload_bytes"}, prompt / image bytes are the raw text and image sizes
+    """
+    estimate = {"text_tokens": 0, "image_tokens": 0, "images": 0, "prompt_bytes": 0, "image_bytes": 0}
+    body = request
+    if "body" in request:
+        body = json.loads(request["body"])
+        if "messages" not in body:
+            _body_estimate(body, estimate)
+    system = body.get("system") or []
+    _content_estimate([system] if isinstance(system, str) else system, estimate)
+    for message in body.get("messages", []):
+        content = message.get("content", [])
+        _content_estimate([content] if isinstance(content, str) else content, estimate)
+    estimate["input_tokens"] = estimate["text_tokens"] + estimate["image_tokens"]
+    estimate["payload_bytes"] = len(request["body"].encode("utf-8")) if "body" in request else _payload_bytes(request)
+    return estimate
+
+
+def log_usage(call_site, estimate, usage):
+    """
+    Log an estimate next to the usage reported by the model, to tune image sizes and token budgets.
+
+    Args:
+        call_site (str): model id or feature name
+        estimate (dict): as returned by estimate_request
+        usage (dict): converse `usage` (inputTokens) or invoke_model `usage` (input_tokens)
+    """
+    actual = usage.get("inputTokens", usage.get("input_tokens")) if usage else None
+    output = usage.get("outputTokens", usage.get("output_tokens")) if usage else None
+    error = f", error {(estimate['input_tokens'] - actual) / actual:+.0%}" if actual else ""
+    logger.info(
+        f"{call_site}: estimated input tokens {estimate['input_tokens']} (text {estimate['text_tokens']}, "
+        f"{estimate['images']} images {estimate['image_tokens']}), payload {estimate['payload_bytes']} bytes; "
+        f"actual input tokens {actual}, output tokens {output}{error}"
+    )
@@ -1,6 +1,6 @@
-from PIL import Image
-import io
-import boto3
+from utils.bedrock_client import get_bedrock_client
+from utils.image_preprocess import prepare_image
+from utils.response_cache import cached_converse
 
 def generate_prompt_from_image(source_image, positive_prompt=None):
     user_text = f'''Analyze the provided image and generate an optimized text prompt for Stable Diffusion image-to-image generation. Your response should:
@@ -28,31 +28,14 @@ Based on this initial prompt and the image analysis, create an enhanced, compreh
 Provide only the generated prompt, formatted for direct use in Stable Diffusion. Aim for 50-75 words. Do not include explanations or notes.
 
 '''
-    max_size=1568
     # source_image is a file name
-    with open(source_image, "rb") as f:
-        image_bytes = f.read()
-        img = Image.open(io.BytesIO(image_bytes))
-        width, height = img.size
-        img_format = img.format.lower()
+    resized_bytes, img_format = prepare_image(source_image, max_size=1568, target='claude')
 
-        if width > max_size or height > max_size:
-            if width > height:
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-
-        resized_bytes = io.BytesIO()
-        img.save(resized_bytes, format=img_format)
-        resized_bytes = resized_bytes.getvalue()
-
-    bedrock_client = boto3.client(service_name='bedrock-runtime', region_name='us-west-2')
+    bedrock_client = get_bedrock_client(region_name='us-west-2')
     model_id = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
-    response = bedrock_client.converse(
+    response = cached_converse(
+        bedrock_client,
+        call_site="image_factory.prompt",
         modelId=model_id,
         messages=[{"role": "user", "content": [{"text": user_text, }, {"image": {"format": img_format, "source": {"bytes": resized_bytes}}}]}],
         inferenceConfig={"temperature": 0.1},
@@ -88,10 +71,12 @@ Based on this text analysis, create an enhanced, comprehensive prompt that maint
 
 Provide only the generated prompt, formatted for direct use in Stable Diffusion. Aim for 50-75 words. Do not include explanations, notes, or variations.
 '''
-    bedrock_client = boto3.client(service_name='bedrock-runtime', region_name='us-west-2')
+    bedrock_client = get_bedrock_client(region_name='us-west-2')
     model_id = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
     #model_id = 'meta.llama3-1-8b-instruct-v1:0'
-    response = bedrock_client.converse(
+    response = cached_converse(
+        bedrock_client,
+        call_site="image_factory.prompt",
         modelId=model_id,
         messages=[{"role": "user", "content": [{"text": user_text, }, {"text": source_text}]}],
         inferenceConfig={"temperature": 0.1},
@@ -0,0 +1,243 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+from dotenv import load_dotenv
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# request priorities, lower goes first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# per model token bucket, in requests per second, can be overridden in .env
+RATE_LIMIT_INITIAL_RPS = float(os.getenv("rate_limit_initial_rps", 5))
+RATE_LIMIT_MIN_RPS = float(os.getenv("rate_limit_min_rps", 0.2))
+RATE_LIMIT_MAX_RPS = float(os.getenv("rate_limit_max_rps", 50))
+RATE_LIMIT_BURST = float(os.getenv("rate_limit_burst", 5))
+# AIMD: the rate grows by this much per successful call and is multiplied by the factor on a throttle
+RATE_LIMIT_INCREASE = float(os.getenv("rate_limit_increase", 0.05))
+RATE_LIMIT_DECREASE_FACTOR = float(os.getenv("rate_limit_decrease_factor", 0.5))
+# retries of throttled calls, full jitter exponential backoff
+RETRY_MAX_ATTEMPTS = int(os.getenv("rate_limit_max_attempts", 6))
+RETRY_BASE_DELAY = float(os.getenv("rate_limit_base_delay", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("rate_limit_max_delay", 20))
+
+THROTTLING_ERROR_CODES = ("ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+                          "ModelNotReadyException")
+# transient failures, retried with the same backoff as throttles but without lowering the rate
+TRANSIENT_ERROR_CODES = ("InternalServerException", "InternalFailure", "ServiceUnavailable", "ModelErrorException",
+                         "ModelTimeoutException", "RequestTimeout", "RequestTimeoutException")
+
+_priority = contextvars.ContextVar("bedrock_request_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def request_priority(priority):
+    """
+    Run the model calls of the block (in this thread / task) with the given priority.
+
+    Args:
+        priority (int): PRIORITY_INTERACTIVE or PRIORITY_BATCH
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_throttling_error(error):
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def is_transient_error(error):
+    """
+    Connection errors, read timeouts, 5xx and the transient model errors of TRANSIENT_ERROR_CODES.
+    """
+    if isinstance(error, ClientError):
+        if is_throttling_error(error):
+            return False
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return code in TRANSIENT_ERROR_CODES or status >= 500
+    return isinstance(error, (ConnectionError, HTTPClientError))
+
+
+class ModelLimiter:
+    """
+    Token bucket of one model whose rate follows AIMD: additive increase on success, multiplicative
+    decrease on throttle. Waiting callers are served by priority, then arrival order.
+    """
+
+    def __init__(self, model_id, rate=RATE_LIMIT_INITIAL_RPS, burst=RATE_LIMIT_BURST):
+        self.model_id = model_id
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {"calls": 0, "throttles": 0, "errors": 0, "retries": 0, "failures": 0, "wait_s_total": 0.0,
+                      "wait_s_max": 0.0}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        """
+        Block until the caller may send one request.
+
+        Returns:
+            float: seconds waited.
+        """
+        start = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            while True:
+                self._refill()
+                head = self._waiters[0] == ticket
+                if head and self._tokens >= 1:
+                    heapq.heappop(self._waiters)
+                    self._tokens -= 1
+                    # the next waiter becomes head
+                    self._cond.notify_all()
+                    break
+                self._cond.wait((1 - self._tokens) / self.rate if head else None)
+        waited = time.monotonic() - start
+        with self._cond:
+            self.stats["calls"] += 1
+            self.stats["wait_s_total"] += waited
+            self.stats["wait_s_max"] = max(self.stats["wait_s_max"], waited)
+        return waited
+
+    def on_success(self):
+        with self._cond:
+            self.rate = min(RATE_LIMIT_MAX_RPS, self.rate + RATE_LIMIT_INCREASE)
+
+    def on_throttle(self, retry=True):
+        """
+        Args:
+            retry (bool): the call will be retried, otherwise it counts as a failure.
+        """
+        with self._cond:
+            self.stats["throttles"] += 1
+            self.stats["retries" if retry else "failures"] += 1
+            self.rate = max(RATE_LIMIT_MIN_RPS, self.rate * RATE_LIMIT_DECREASE_FACTOR)
+            # drop the burst, the service is telling us we are already too fast
+            self._tokens = min(self._tokens, 0)
+        logger.warning(f"{self.model_id} throttled, rate lowered to {self.rate:.2f} req/s")
+
+    def on_error(self, retry=True):
+        """
+        A transient error, the rate is left unchanged.
+
+        Args:
+            retry (bool): the call will be retried, otherwise it counts as a failure.
+        """
+        with self._cond:
+            self.stats["errors"] += 1
+            self.stats["retries" if retry else "failures"] += 1
+
+    def metrics(self):
+        with self._cond:
+            calls = self.stats["calls"]
+            return {
+                "queue_depth": len(self._waiters),
+                "rate_rps": round(self.rate, 3),
+                **self.stats,
+                "wait_s_avg": round(self.stats["wait_s_total"] / calls, 3) if calls else 0.0,
+            }
+
+
+class RateLimiter:
+    """
+    ModelLimiter registry plus the retry loop shared by every model call.
+    """
+
+    def __init__(self):
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model_id):
+        with self._lock:
+            if model_id not in self._limiters:
+                self._limiters[model_id] = ModelLimiter(model_id)
+            return self._limiters[model_id]
+
+    def call(self, model_id, fn, priority=None, max_attempts=RETRY_MAX_ATTEMPTS):
+        """
+        Call `fn()` once the model's limiter allows it, retrying throttled calls and transient errors
+        (is_transient_error) with jittered exponential backoff. The bedrock-runtime clients don't retry
+        on their own (see bedrock_client._client_config), so every throttle reaches the limiter.
+
+        Args:
+            model_id (str): limiter key.
+            fn (callable): sends the request.
+            priority (int, optional): defaults to the priority set with request_priority.
+            max_attempts (int): attempts before the throttling or transient error is raised.
+
+        Returns:
+            the result of fn().
+        """
+        limiter = self.limiter(model_id)
+        priority = _priority.get() if priority is None else priority
+        for attempt in range(max_attempts):
+            limiter.acquire(priority)
+            try:
+                result = fn()
+            except Exception as e:
+                if is_throttling_error(e):
+                    limiter.on_throttle(retry=attempt < max_attempts - 1)
+                elif is_transient_error(e):
+                    limiter.on_error(retry=attempt < max_attempts - 1)
+                    logger.warning(f"{model_id} transient error ({type(e).__name__}: {e}), attempt {attempt + 1}")
+                else:
+                    raise
+                if attempt == max_attempts - 1:
+                    raise
+                time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+            else:
+                limiter.on_success()
+                return result
+
+    def metrics(self):
+        """
+        Returns:
+            dict: model id -> {"queue_depth", "rate_rps", "calls", "throttles", "errors", "retries", "failures",
+                "wait_s_total", "wait_s_max", "wait_s_avg"}
+        """
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {limiter.model_id: limiter.metrics() for limiter in limiters}
+
+
+_rate_limiter = RateLimiter()
+
+
+def get_rate_limiter():
+    """
+    Return the process wide rate limiter.
+    """
+    return _rate_limiter
+
+
+def rate_limited_call(model_id, fn, priority=None, max_attempts=RETRY_MAX_ATTEMPTS):
+    """
+    Shortcut for get_rate_limiter().call(...).
+    """
+    return _rate_limiter.call(model_id, fn, priority, max_attempts)
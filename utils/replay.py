@@ -0,0 +1,258 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from dotenv import load_dotenv
+from requests.structures import CaseInsensitiveDict
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# record / replay of external calls (Bedrock runtime, Oxylabs scraper API), can be overridden in .env
+REPLAY_MODE = os.getenv("replay_mode", "off")  # off | record | replay
+REPLAY_PATH = os.getenv("replay_path", ".cache/replay.jsonl")
+# replay delay: none (as fast as possible, to measure our own overhead) | recorded (the recorded latency)
+REPLAY_LATENCY = os.getenv("replay_latency", "none")
+
+# strings and bytes above this size are replaced by their hash in the recorded request
+_MAX_INLINE_LENGTH = 4096
+# invoke_model response headers worth keeping (usage, latency)
+_BEDROCK_HEADER_PREFIX = "x-amzn-bedrock-"
+
+
+class ReplayMissError(KeyError):
+    """
+    No recording matches the request in replay mode.
+    """
+
+
+def _normalize(value):
+    """
+    JSON-safe canonical form of a request: bytes and large strings are replaced by their sha256,
+    JSON encoded strings (invoke_model bodies) are parsed so formatting doesn't change the key
+    """
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        return {"sha256": hashlib.sha256(value).hexdigest(), "length": len(value)}
+    if isinstance(value, str) and value[:1] in ("{", "["):
+        try:
+            return _normalize(json.loads(value))
+        except ValueError:
+            pass
+    if isinstance(value, str) and len(value) > _MAX_INLINE_LENGTH:
+        return {"sha256": hashlib.sha256(value.encode("utf-8")).hexdigest(), "length": len(value)}
+    return value
+
+
+def request_key(service, operation, request):
+    """
+    Args:
+        service (str): bedrock-runtime / oxylabs
+        operation (str): converse / converse_stream / invoke_model / POST ...
+        request (dict): request arguments, without credentials
+
+    Returns:
+        tuple: (sha256 key, normalized request)
+    """
+    normalized = _normalize(request)
+    canonical = json.dumps([service, operation, normalized], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest(), normalized
+
+
+class ReplayStore:
+    """
+    JSON Lines file of recorded request / response pairs, indexed in memory by request key.
+
+    One line per call: {"key", "service", "operation", "request", "response", "elapsed_ms", "recorded_at"}.
+    When a request was recorded several times the latest recording is served.
+    """
+
+    def __init__(self, path=REPLAY_PATH):
+        self.path = path
+        self._index = {}
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "replayed": 0, "misses": 0}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._index[entry["key"]] = entry
+        logger.info(f"Replay store {path}: {len(self._index)} recorded requests")
+
+    def __len__(self):
+        return len(self._index)
+
+    def lookup(self, service, operation, request):
+        """
+        Returns:
+            dict: the recorded entry.
+
+        Raises:
+            ReplayMissError: if the request was never recorded.
+        """
+        key, _ = request_key(service, operation, request)
+        with self._lock:
+            entry = self._index.get(key)
+            self.stats["misses" if entry is None else "replayed"] += 1
+        if entry is None:
+            raise ReplayMissError(f"No recording of {service} {operation} request {key[:12]} in {self.path}")
+        if REPLAY_LATENCY == "recorded":
+            time.sleep(entry.get("elapsed_ms", 0) / 1000)
+        return entry
+
+    def record(self, service, operation, request, response, elapsed_ms):
+        key, normalized = request_key(service, operation, request)
+        entry = {
+            "key": key,
+            "service": service,
+            "operation": operation,
+            "request": normalized,
+            "response": response,
+            "elapsed_ms": elapsed_ms,
+            "recorded_at": time.time(),
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._index[key] = entry
+            self.stats["recorded"] += 1
+
+
+def _elapsed_ms(start):
+    return int((time.perf_counter() - start) * 1000)
+
+
+class ReplayBedrockClient:
+    """
+    Record / replay wrapper of a bedrock-runtime client (converse, converse_stream, invoke_model).
+    Other operations go to the wrapped client.
+    """
+
+    def __init__(self, client, store, mode=REPLAY_MODE):
+        self.client = client
+        self.store = store
+        self.mode = mode
+
+    def converse(self, **request):
+        if self.mode == "replay":
+            return self.store.lookup("bedrock-runtime", "converse", request)["response"]
+        start = time.perf_counter()
+        response = self.client.converse(**request)
+        self.store.record("bedrock-runtime", "converse", request,
+                          {key: value for key, value in response.items() if key != "ResponseMetadata"}, _elapsed_ms(start))
+        return response
+
+    def converse_stream(self, **request):
+        if self.mode == "replay":
+            return {"stream": iter(self.store.lookup("bedrock-runtime", "converse_stream", request)["response"]["events"])}
+        start = time.perf_counter()
+        return {"stream": self._record_stream(request, self.client.converse_stream(**request)["stream"], start)}
+
+    def _record_stream(self, request, stream, start):
+        events = []
+        for event in stream:
+            events.append(event)
+            yield event
+        # only complete streams are recorded
+        self.store.record("bedrock-runtime", "converse_stream", request, {"events": events}, _elapsed_ms(start))
+
+    def invoke_model(self, **request):
+        if self.mode == "replay":
+            response = dict(self.store.lookup("bedrock-runtime", "invoke_model", request)["response"])
+            response["body"] = io.BytesIO(base64.b64decode(response["body"]))
+            return response
+        start = time.perf_counter()
+        response = self.client.invoke_model(**request)
+        body = response["body"].read()
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        self.store.record("bedrock-runtime", "invoke_model", request, {
+            "body": base64.b64encode(body).decode("ascii"),
+            "contentType": response.get("contentType"),
+            "ResponseMetadata": {"HTTPHeaders": {
+                name: value for name, value in headers.items() if name.startswith(_BEDROCK_HEADER_PREFIX)}},
+        }, _elapsed_ms(start))
+        response["body"] = io.BytesIO(body)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+_store = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_replay_store():
+    """
+    Return the process wide replay store.
+    """
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = ReplayStore()
+    return _store
+
+
+def replay_client(client):
+    """
+    Return the shared record / replay wrapper of a bedrock-runtime client, or the client itself when
+    `replay_mode` is off.
+    """
+    if REPLAY_MODE == "off":
+        return client
+    store = get_replay_store()
+    with _lock:
+        if id(client) not in _clients:
+            _clients[id(client)] = (client, ReplayBedrockClient(client, store))
+        return _clients[id(client)][1]
+
+
+def replay_request(method, url, **kwargs):
+    """
+    `requests.request` with record / replay, for the Oxylabs scraper API.
+
+    Credentials (auth, headers) are not part of the key and are never recorded.
+
+    Returns:
+        requests.Response
+    """
+    if REPLAY_MODE == "off":
+        return requests.request(method, url, **kwargs)
+
+    request = {"url": url, **{key: value for key, value in kwargs.items() if key in ("params", "json", "data")}}
+    store = get_replay_store()
+    if REPLAY_MODE == "replay":
+        recorded = store.lookup("oxylabs", method, request)["response"]
+        response = requests.Response()
+        response.status_code = recorded["status_code"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response._content = recorded["content"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = url
+        return response
+
+    start = time.perf_counter()
+    response = requests.request(method, url, **kwargs)
+    store.record("oxylabs", method, request, {
+        "status_code": response.status_code,
+        "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+        "content": response.text,
+    }, _elapsed_ms(start))
+    return response
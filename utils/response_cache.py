@@ -0,0 +1,270 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from utils.instrumentation import instrument_call
+from utils.payload_estimator import estimate_request, log_usage
+from utils.rate_limiter import rate_limited_call
+
+# loading in variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# cache settings, can be overridden in .env
+CACHE_BACKEND = os.getenv("response_cache_backend", "memory")  # memory | sqlite | none
+CACHE_TTL = int(os.getenv("response_cache_ttl", 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.getenv("response_cache_max_entries", 1024))
+CACHE_MAX_BYTES = int(os.getenv("response_cache_max_bytes", 64 * 1024 * 1024))
+CACHE_PATH = os.getenv("response_cache_path", ".cache/bedrock_responses.sqlite3")
+# calls at or below this temperature are treated as deterministic and cached by default
+CACHE_MAX_TEMPERATURE = float(os.getenv("response_cache_max_temperature", 0.2))
+
+# only these response fields are kept, ResponseMetadata is request specific
+_CACHED_RESPONSE_FIELDS = ("output", "stopReason", "usage", "metrics")
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes_sha256__": hashlib.sha256(value).hexdigest()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def make_cache_key(**request):
+    """
+    Content-addressed key of a Bedrock request.
+
+    The request is serialized canonically (sorted keys) and image bytes are replaced by their
+    sha256, so the same model, messages, inference config and images always give the same key.
+
+    Returns:
+        str: sha256 hex digest
+    """
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, default=_json_default)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    """
+    In-memory LRU cache with TTL, bounded by number of entries and total value size.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._remove(key)
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._bytes += len(value)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+
+class SQLiteCache:
+    """
+    On-disk cache with TTL and LRU eviction, shared by every process using the same file.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats["hits"] += 1
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            evicted = self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self._conn.commit()
+            self.stats["evictions"] += max(evicted, 0)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process wide response cache configured by `response_cache_backend`, or None if disabled.
+    """
+    global _cache
+    if _cache is None and CACHE_BACKEND != "none":
+        with _cache_lock:
+            if _cache is None:
+                _cache = SQLiteCache() if CACHE_BACKEND == "sqlite" else MemoryCache()
+    return _cache
+
+
+def set_response_cache(cache):
+    """
+    Replace the process wide response cache, e.g. with a custom backend implementing get/set/clear.
+    """
+    global _cache
+    _cache = cache
+
+
+def is_deterministic(inference_config):
+    return (inference_config or {}).get("temperature", 1.0) <= CACHE_MAX_TEMPERATURE
+
+
+def _cache_for(use_cache, request):
+    if use_cache is None:
+        use_cache = is_deterministic(request.get("inferenceConfig"))
+    return get_response_cache() if use_cache else None
+
+
+def _store(cache, key, response):
+    cache.set(key, json.dumps({k: response[k] for k in _CACHED_RESPONSE_FIELDS if k in response}, ensure_ascii=False))
+
+
+def cached_converse(client, use_cache=None, call_site=None, **request):
+    """
+    Call `client.converse(**request)` through the response cache.
+
+    Args:
+        client: bedrock-runtime client.
+        use_cache (bool, optional): force caching on or off, by default only deterministic
+            (low temperature) calls are cached.
+        call_site (str, optional): feature the call is recorded under, see instrument_call.
+        **request: converse arguments (modelId, messages, inferenceConfig, ...).
+
+    Returns:
+        dict: converse response.
+    """
+    cache = _cache_for(use_cache, request)
+    key = make_cache_key(**request) if cache is not None else None
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        logger.info(f"Response cache hit for {request.get('modelId')}")
+        return json.loads(cached)
+
+    estimate = estimate_request(**request)
+    with instrument_call(request.get("modelId"), "converse", estimate, call_site) as call:
+        response = rate_limited_call(request.get("modelId"), lambda: client.converse(**request))
+        call.update(usage=response.get("usage"), latency_ms=response.get("metrics", {}).get("latencyMs"))
+    log_usage(request.get("modelId"), estimate, response.get("usage"))
+    if cache is not None:
+        _store(cache, key, response)
+    return response
+
+
+def cached_converse_stream(client, use_cache=None, call_site=None, **request):
+    """
+    Call `client.converse_stream(**request)` through the response cache.
+
+    A cache hit is replayed as a single text delta followed by the cached metadata event, a
+    completed stream is stored in the same shape as a converse response so both share entries.
+
+    Yields:
+        dict: converse_stream events.
+    """
+    cache = _cache_for(use_cache, request)
+    key = make_cache_key(**request) if cache is not None else None
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        logger.info(f"Response cache hit for {request.get('modelId')}")
+        response = json.loads(cached)
+        yield {"messageStart": {"role": "assistant"}}
+        for block in response["output"]["message"]["content"]:
+            if "text" in block:
+                yield {"contentBlockDelta": {"delta": {"text": block["text"]}, "contentBlockIndex": 0}}
+        yield {"messageStop": {"stopReason": response.get("stopReason", "end_turn")}}
+        yield {"metadata": {"usage": response.get("usage", {}), "metrics": response.get("metrics", {})}}
+        return
+
+    estimate = estimate_request(**request)
+    chunks = []
+    response = {}
+    with instrument_call(request.get("modelId"), "converse_stream", estimate, call_site) as call:
+        stream = rate_limited_call(request.get("modelId"), lambda: client.converse_stream(**request))["stream"]
+        for event in stream:
+            if "contentBlockDelta" in event:
+                chunks.append(event["contentBlockDelta"]["delta"].get("text", ""))
+            elif "messageStop" in event:
+                response["stopReason"] = event["messageStop"].get("stopReason")
+            elif "metadata" in event:
+                response["usage"] = event["metadata"].get("usage", {})
+                response["metrics"] = event["metadata"].get("metrics", {})
+                call.update(usage=response["usage"], latency_ms=response["metrics"].get("latencyMs"))
+                log_usage(request.get("modelId"), estimate, response["usage"])
+            yield event
+
+    if cache is not None:
+        response["output"] = {"message": {"role": "assistant", "content": [{"text": "".join(chunks)}]}}
+        _store(cache, key, response)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import re
+from dataclasses import asdict, dataclass, field
+
+from dotenv import load_dotenv
+
+from utils.catalog import Review
+from utils.payload_estimator import estimate_tokens
+
+# loading in variables from .env file
+load_dotenv()
+
+# max estimated tokens of review text put into one VOC prompt, can be overridden in .env
+VOC_REVIEW_TOKEN_BUDGET = int(os.getenv("voc_review_token_budget", 12000))
+# word shingle jaccard similarity above which two reviews count as duplicates
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("voc_near_duplicate_threshold", 0.8))
+
+_RATING_TITLE_PREFIX = re.compile(r"^\d(\.\d)? out of 5 stars\s*")
+_WORD = re.compile(r"\w+")
+
+
+@dataclass(slots=True)
+class CondensedReviews:
+    text: str
+    selected: list[Review] = field(default_factory=list)
+    total_reviews: int = 0
+    duplicates_removed: int = 0
+    original_tokens: int = 0
+    tokens: int = 0
+
+    @property
+    def truncated(self):
+        """
+        True if reviews were left out to fit the token budget.
+        """
+        return len(self.selected) < self.total_reviews - self.duplicates_removed
+
+    @property
+    def saved_tokens(self):
+        return self.original_tokens - self.tokens
+
+    def summary(self):
+        return (f"选取评论 {len(self.selected)}/{self.total_reviews} 条（去重 {self.duplicates_removed} 条），"
+                f"约 {self.tokens} tokens，节省约 {self.saved_tokens} tokens")
+
+
+def format_review(review):
+    """
+    Compact one line rendering of a review, keeping only content fields.
+    """
+    title = _RATING_TITLE_PREFIX.sub("", review.title).strip()
+    helpful = f"[helpful:{review.helpful_count}]" if review.helpful_count else ""
+    content = " ".join(review.content.split())
+    return f"[{review.rating}★]{helpful} {title} | {content}" if title else f"[{review.rating}★]{helpful} {content}"
+
+
+def _shingles(text, size=3):
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def dedupe_reviews(reviews, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Drop exact and near-identical reviews, keeping the most helpful copy.
+
+    :return: list of unique reviews, in input order
+    """
+    kept = []
+    seen_digests = set()
+    kept_shingles = []
+    for i in sorted(range(len(reviews)), key=lambda i: reviews[i].helpful_count, reverse=True):
+        review = reviews[i]
+        normalized = " ".join(_WORD.findall(review.content.lower()))
+        digest = hashlib.sha1(normalized.encode("utf-8")).digest()
+        if digest in seen_digests:
+            continue
+        shingles = _shingles(normalized)
+        if any(len(shingles & other) / len(shingles | other) >= threshold for other in kept_shingles):
+            continue
+        seen_digests.add(digest)
+        kept_shingles.append(shingles)
+        kept.append(i)
+    return [reviews[i] for i in sorted(kept)]
+
+
+def select_reviews(reviews, token_budget=VOC_REVIEW_TOKEN_BUDGET):
+    """
+    Stratified sample by star rating that fits the token budget.
+
+    Each rating keeps roughly its share of the reviews, within a rating the most helpful
+    (then longest) reviews are taken first.
+
+    :return: (selected reviews, estimated tokens)
+    """
+    strata = {}
+    for review in reviews:
+        strata.setdefault(review.rating, []).append(review)
+    for stratum in strata.values():
+        stratum.sort(key=lambda r: (r.helpful_count, len(r.content)), reverse=True)
+
+    picked = {rating: 0 for rating in strata}
+    cursor = {rating: 0 for rating in strata}
+    selected = []
+    tokens = 0
+    while True:
+        open_strata = [rating for rating in strata if cursor[rating] < len(strata[rating])]
+        if not open_strata:
+            break
+        # the stratum furthest below its share goes next
+        rating = min(open_strata, key=lambda r: picked[r] / len(strata[r]))
+        review = strata[rating][cursor[rating]]
+        cursor[rating] += 1
+        review_tokens = estimate_tokens(format_review(review))
+        if tokens + review_tokens > token_budget:
+            continue
+        selected.append(review)
+        picked[rating] += 1
+        tokens += review_tokens
+
+    selected.sort(key=lambda r: (r.rating, r.helpful_count), reverse=True)
+    return selected, tokens
+
+
+def condense_reviews(reviews, token_budget=VOC_REVIEW_TOKEN_BUDGET, source_tokens=None):
+    """
+    Strip, deduplicate and sample reviews to fit a VOC prompt.
+
+    :param reviews: list of catalog Review records
+    :param token_budget: max estimated tokens of the rendered reviews
+    :param source_tokens: estimated tokens of the raw review dump the prompt used to contain
+        (ReviewSet.source_tokens), the saving is reported against it; defaults to the review records
+    :return: CondensedReviews
+    """
+    if source_tokens is None:
+        source_tokens = estimate_tokens(json.dumps([asdict(review) for review in reviews], ensure_ascii=False))
+    unique = dedupe_reviews(reviews)
+    selected, _ = select_reviews(unique, token_budget)
+    text = "\n".join(format_review(review) for review in selected)
+    return CondensedReviews(
+        text=text,
+        selected=selected,
+        total_reviews=len(reviews),
+        duplicates_removed=len(reviews) - len(unique),
+        original_tokens=source_tokens,
+        tokens=estimate_tokens(text),
+    )
@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.listing_voc_prompt import bedrock_converse_api
+from utils.listing_voc_prompt import gen_purchase_motivation_prompt, gen_user_suggestions_prompt, gen_negative_opinions_prompt, gen_product_experience_prompt, gen_star_rating_distribution_prompt, gen_user_expectations_prompt
+
+# max number of VOC calls in flight at once, can be overridden in .env
+VOC_MAX_CONCURRENCY = int(os.getenv("voc_max_concurrency", 7))
+
+SUMMARY_REPORT = "总结报告"
+
+# VOC aspect name -> prompt generator, in display order
+VOC_ASPECTS = {
+    "购买动机": gen_purchase_motivation_prompt,
+    "用户建议": gen_user_suggestions_prompt,
+    "负面观点": gen_negative_opinions_prompt,
+    "产品体验": gen_product_experience_prompt,
+    "星级分布": gen_star_rating_distribution_prompt,
+    "用户期望": gen_user_expectations_prompt,
+}
+
+
+def gen_aspect_prompts(product_reviews, product_description=None):
+    """
+    Build the prompt of every VOC aspect.
+
+    Returns:
+        dict: aspect name -> prompt
+    """
+    return {aspect: generator(product_description, product_reviews) for aspect, generator in VOC_ASPECTS.items()}
+
+
+def submit_voc_analysis(model_id, prompts, max_concurrency=VOC_MAX_CONCURRENCY, use_cache=None, call_site=None):
+    """
+    Start sending VOC prompts to Bedrock in the background.
+
+    Args:
+        model_id (str): The ID of the model to use.
+        prompts (dict): name -> prompt, e.g. the summary report plus every aspect prompt.
+        max_concurrency (int): max number of calls in flight at the same time.
+        use_cache (bool, optional): passed through to bedrock_converse_api.
+        call_site (str, optional): call site of every call, by default "voc.summary" for the
+            summary report and "voc.aspect" for the aspects.
+
+    Returns:
+        dict: future -> name of every pending call, to be drained with collect_voc_results.
+    """
+    max_workers = max(1, min(len(prompts), max_concurrency))
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {
+        executor.submit(bedrock_converse_api, model_id, prompt, use_cache,
+                        call_site or ("voc.summary" if name == SUMMARY_REPORT else "voc.aspect")): name
+        for name, prompt in prompts.items()
+    }
+    # submitted calls keep running, the pool is released once they are done
+    executor.shutdown(wait=False)
+    return futures
+
+
+def collect_voc_results(futures, wait=True):
+    """
+    Yield (name, response text) of finished calls in completion order, removing them from `futures`.
+
+    Args:
+        futures (dict): as returned by submit_voc_analysis.
+        wait (bool): block until every call is done, or only yield the ones already finished.
+    """
+    pending = as_completed(list(futures)) if wait else [future for future in list(futures) if future.done()]
+    for future in pending:
+        yield futures.pop(future), future.result()
+
+
+def run_voc_analysis(model_id, prompts, max_concurrency=VOC_MAX_CONCURRENCY, use_cache=None):
+    """
+    Send all VOC prompts to Bedrock at once and yield each result as soon as it arrives.
+
+    Yields:
+        tuple: (name, response text), in completion order.
+    """
+    return collect_voc_results(submit_voc_analysis(model_id, prompts, max_concurrency, use_cache))
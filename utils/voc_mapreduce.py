@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import threading
+
+from utils.listing_voc_prompt import gen_voc_map_prompt, gen_voc_reduce_prompt
+from utils.response_cache import SQLiteCache
+from utils.payload_estimator import estimate_tokens
+from utils.review_condenser import dedupe_reviews, format_review
+from utils.voc_engine import VOC_MAX_CONCURRENCY, collect_voc_results, submit_voc_analysis
+
+logger = logging.getLogger(__name__)
+
+# max estimated tokens of review text in one map call, can be overridden in .env
+VOC_CHUNK_TOKENS = int(os.getenv("voc_chunk_tokens", 8000))
+# partial summaries of review chunks, kept on disk whatever the response cache backend
+VOC_CHUNK_CACHE_PATH = os.getenv("voc_chunk_cache_path", ".cache/voc_chunks.sqlite3")
+VOC_CHUNK_CACHE_TTL = int(os.getenv("voc_chunk_cache_ttl", 7 * 24 * 3600))
+VOC_CHUNK_CACHE_MAX_ENTRIES = int(os.getenv("voc_chunk_cache_max_entries", 10000))
+
+
+class VocMapError(Exception):
+    """
+    No review chunk could be summarized.
+    """
+
+
+_chunk_cache = None
+_chunk_cache_lock = threading.Lock()
+
+
+def get_chunk_cache():
+    """
+    Return the process wide cache of partial summaries.
+    """
+    global _chunk_cache
+    if _chunk_cache is None:
+        with _chunk_cache_lock:
+            if _chunk_cache is None:
+                _chunk_cache = SQLiteCache(VOC_CHUNK_CACHE_PATH, VOC_CHUNK_CACHE_TTL, VOC_CHUNK_CACHE_MAX_ENTRIES)
+    return _chunk_cache
+
+
+def chunk_reviews(reviews, chunk_tokens=VOC_CHUNK_TOKENS):
+    """
+    Pack reviews in order into text chunks of at most `chunk_tokens` estimated tokens.
+
+    Packing is sequential, so appending a new page of reviews leaves every earlier chunk
+    (and its hash) unchanged except the last one.
+
+    :return: list of chunk texts
+    """
+    chunks = []
+    lines = []
+    tokens = 0
+    for review in reviews:
+        line = format_review(review)
+        line_tokens = estimate_tokens(line)
+        if lines and tokens + line_tokens > chunk_tokens:
+            chunks.append("\n".join(lines))
+            lines, tokens = [], 0
+        lines.append(line)
+        tokens += line_tokens
+    if lines:
+        chunks.append("\n".join(lines))
+    return chunks
+
+
+def chunk_key(model_id, chunk):
+    return "voc-map:" + hashlib.sha256(f"{model_id}\n{chunk}".encode("utf-8")).hexdigest()
+
+
+def map_review_chunks(model_id, reviews, chunk_tokens=VOC_CHUNK_TOKENS, max_concurrency=VOC_MAX_CONCURRENCY, on_progress=None):
+    """
+    Map step: summarize every review chunk in parallel, reusing cached partial summaries.
+
+    Args:
+        model_id (str): The ID of the model to use.
+        reviews (list): catalog Review records.
+        chunk_tokens (int): max estimated tokens per chunk.
+        max_concurrency (int): max number of map calls in flight at the same time.
+        on_progress (callable, optional): called with (done, total) after each chunk.
+
+    Returns:
+        list: partial summaries in chunk order, None for chunks whose call failed.
+    """
+    chunks = chunk_reviews(dedupe_reviews(reviews), chunk_tokens)
+    keys = [chunk_key(model_id, chunk) for chunk in chunks]
+    cache = get_chunk_cache()
+
+    summaries = {}
+    for key in keys:
+        cached = cache.get(key)
+        if cached is not None:
+            summaries[key] = cached
+
+    prompts = {key: gen_voc_map_prompt(chunk) for key, chunk in zip(keys, chunks) if key not in summaries}
+    logger.info(f"VOC map: {len(chunks)} chunks, {len(chunks) - len(prompts)} cached")
+    if on_progress:
+        on_progress(len(summaries), len(chunks))
+
+    if prompts:
+        for key, summary in collect_voc_results(submit_voc_analysis(model_id, prompts, max_concurrency, use_cache=False, call_site="voc.map")):
+            if summary is not None:
+                summaries[key] = summary
+                cache.set(key, summary)
+            if on_progress:
+                on_progress(len(summaries), len(chunks))
+
+    failed = len(keys) - len(summaries)
+    if failed:
+        logger.warning(f"VOC map: {failed} of {len(chunks)} chunks could not be summarized")
+    return [summaries.get(key) for key in keys]
+
+
+def gen_voc_mapreduce_prompt(model_id, reviews, language, chunk_tokens=VOC_CHUNK_TOKENS, on_progress=None):
+    """
+    Run the map step and build the reduce prompt that merges the partial summaries into the VoC report.
+    The prompt marks the chunks whose summary failed, so the report says it covers part of the reviews.
+
+    Raises:
+        VocMapError: no chunk could be summarized.
+    """
+    partial_summaries = map_review_chunks(model_id, reviews, chunk_tokens, on_progress=on_progress)
+    if not any(summary is not None for summary in partial_summaries):
+        raise VocMapError(f"none of the {len(partial_summaries)} review chunks could be summarized")
+    return gen_voc_reduce_prompt(partial_summaries, language)